@@ -1,3 +1,6 @@
+# See also the registered experiments `topk_dask_parallel_<n>` and `threshold_dask_parallel_<n>`
+# (`src/coralsarticle/benchmark/algorithms/python/local_cluster.py`).
+
 # prevent oversupscription of CPUs
 from corals.threads import set_threads_for_external_libraries
 set_threads_for_external_libraries(1)
@@ -1,3 +1,6 @@
+# See also the registered experiments `topk_spark_parallel_<n>` and `threshold_spark_parallel_<n>`
+# (`src/coralsarticle/benchmark/algorithms/python/local_cluster.py`), which do not require a standalone master.
+
 # Before running this, install and run Spark (3.3.0) either locally or use a cluster
 # * install java: 
 #   * mkdir -p /usr/share/man/man1
@@ -9,31 +9,36 @@ from numpy.core.fromnumeric import sort
 @click.option("--method", default="tree")
 @click.option("--overwrite", default=False)
 @click.option("--n_threads", default=4)
+@click.option("--sweep", default=True, type=bool, 
+    help="Query the tree once for the largest approximation factor and derive the results of smaller factors from it.")
+@click.option("--reference_dir", default="_out/benchmark/reference", help="Store of exact reference results.")
 def main(
         k_ratio, 
         data, 
         overwrite,
         max_approx,
         n_threads,
-        method):
+        method,
+        sweep,
+        reference_dir):
 
     import coralsarticle.utils
     coralsarticle.utils.set_threads_for_external_libraries(n_threads=n_threads)
 
     import numpy as np
-    import scipy.sparse
-    import sklearn.metrics
     import collections
     import pathlib
     import h5py
     import datetime
 
     import coralsarticle.data.utils
+    import coralsarticle.benchmark.metrics
+    import coralsarticle.benchmark.reference
     import corals.correlation.topk
     import corals.correlation.fast
 
     # data
-    X = coralsarticle.data.utils.load_h5(f"data/benchmark/{data}.h5").values
+    X = coralsarticle.data.utils.load_matrix(f"data/benchmark/{data}.h5", mmap=False)
 
     # k
     k = int(X.shape[1] * X.shape[1] * k_ratio)
@@ -55,54 +60,41 @@ def main(
 
     #%%
     # reference
-    print("* Calculate reference topk")
-    cor_topk_ref, idx_topk_ref = corals.correlation.topk.topk_matrix(X, k=k)
-    cor_topk_ref_matrix1 = scipy.sparse.coo_matrix((cor_topk_ref, idx_topk_ref))
-    values1 = cor_topk_ref_matrix1.toarray()[np.tril_indices(n=X.shape[1], k=-1)]
+    print("* Reference topk")
+    cor_topk_ref, idx_topk_ref = coralsarticle.benchmark.reference.load_reference(
+        corals.correlation.topk.topk_matrix, X, data_name=data, reference_dir=reference_dir, k=k)
+    keys_ref = coralsarticle.benchmark.metrics.pair_keys(*idx_topk_ref, n=X.shape[1], values=cor_topk_ref)
+    n_total = coralsarticle.benchmark.metrics.n_pairs_tril(X.shape[1])
+    del cor_topk_ref, idx_topk_ref
 
     #%%
     approximation_factors = np.arange(1, max_approx + 1)
+
+    if method != "tree":
+        raise ValueError(f"Unknown method: {method}")
+    if sweep:
+        results = topk_balltree_sweep(X, k=k, approximation_factors=approximation_factors, n_jobs=n_threads)
+    else:
+        results = (
+            (approximation_factor, *corals.correlation.topk.topk_balltree_combined_tree_parallel(
+                X, k=k, approximation_factor=approximation_factor, n_jobs=n_threads))
+            for approximation_factor in approximation_factors)
+
     metrics = collections.OrderedDict()
-    for approximation_factor in approximation_factors:
+    print()
+    print(f"* Calculate topk (sweep: {sweep})")
+    print(f"* Start time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    for approximation_factor, cor2, idx2 in results:
         print()
         print(f"* Approximation factor: {approximation_factor}")
-        print(f"* Start time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-
-        print(f"  * calculate topk")
-        if method == "tree":
-            cor2, idx2 = corals.correlation.topk.topk_balltree_combined_tree_parallel(
-                X, k=k, approximation_factor=approximation_factor, n_jobs=n_threads)
-        else:
-            raise ValueError(f"Unknown method: {method}")
-
-
-        print("  * prepare data")
-        m2 = scipy.sparse.coo_matrix((cor2, idx2))
-        v2 = m2.toarray()[np.tril_indices(n=X.shape[1], k=-1)]
+        print(f"* Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
         print("  * metrics")
-        
-        print("    * accuracy:  ", end="")
-        a = sklearn.metrics.accuracy_score(values1 != 0, v2 != 0)
-        metrics.setdefault("accuracy", []).append(a)
-        print(f"{a:.02f}")
-
-        print("    * precision: ", end="")
-        p = sklearn.metrics.precision_score(values1 != 0, v2 != 0)
-        metrics.setdefault("precision", []).append(p)
-        print(f"{p:.02f}")
-
-        print("    * recall:    ", end="")
-        r = sklearn.metrics.recall_score(values1 != 0, v2 != 0)
-        metrics.setdefault("recall", []).append(r)
-        print(f"{r:.02f}")
-
-        print("    * f1:        ", end="")
-        f1 = sklearn.metrics.f1_score(values1 != 0, v2 != 0)
-        metrics.setdefault("f1", []).append(f1)
-        print(f"{f1:.02f}")
-
-    
+        keys2 = coralsarticle.benchmark.metrics.pair_keys(*idx2, n=X.shape[1], values=cor2)
+        for key, value in coralsarticle.benchmark.metrics.set_metrics(keys_ref, keys2, n_total=n_total).items():
+            metrics.setdefault(key, []).append(value)
+            print(f"    * {key + ':':<10} {value:.02f}")
+
     # write results
     print("* Write results")
     file.parent.mkdir(parents=True, exist_ok=True)
@@ -113,6 +105,56 @@ def main(
         for key, value in metrics.items():
             f[f"metrics/{key}"] =  value
 
+        f.attrs["sweep"] = sweep
+
+
+def topk_balltree_sweep(X, k, approximation_factors, n_jobs=1):
+    """
+    Like `topk_balltree_combined_tree_parallel` for several approximation factors.
+
+    The tree is built and queried once for the largest approximation factor.
+    Since query results are sorted by distance, 
+    the neighbors for a smaller approximation factor are the first `kk` neighbors of each query.
+    Yields `(approximation_factor, values, (idx_r, idx_c))`.
+    """
+
+    import numpy as np
+    import joblib
+    import sklearn.neighbors
+    from corals.correlation.utils import preprocess_XY, derive_k, derive_k_per_query, derive_topk, derive_bins
+
+    # preprocess matrices
+    Xh, Yh = preprocess_XY(X, None, normalize=True, Y_fill_none=True)
+    k = derive_k(Xh, Yh, k=k)
+    kk_max = derive_k_per_query(Xh, Yh, k, max(approximation_factors))
+
+    # build tree; note that we concatenate Xh and -Xh to capture negative correlations
+    tree = sklearn.neighbors.BallTree(np.concatenate([Xh, -Xh], axis=1).transpose())
+
+    # query in batches
+    bins = derive_bins(Yh.shape[1], n_jobs)
+    Yht = Yh.transpose()
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(tree.query)(Yht[bins[i]:bins[i+1],:], k=kk_max, return_distance=True, sort_results=True)
+        for i in range(len(bins) - 1))
+    dst = np.concatenate([r[0] for r in results])
+    idx = np.concatenate([r[1] for r in results])
+    del results
+
+    for approximation_factor in approximation_factors:
+        kk = derive_k_per_query(Xh, Yh, k, approximation_factor)
+
+        # normalize index
+        idx_r = np.repeat(np.arange(idx.shape[0]), kk)
+        idx_c = idx[:, :kk].flatten()
+
+        # get mask for selecting correlations from -Xh and fix index
+        mask_inverse = idx_c >= Xh.shape[1]
+        idx_c[mask_inverse] -= Xh.shape[1]
+
+        values, idx_topk = derive_topk(mask_inverse, dst[:, :kk].flatten(), idx_r, idx_c, k)
+        yield approximation_factor, values, idx_topk
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -16,6 +16,8 @@ import click
 @click.option("--n_threads", default=4)
 @click.option("--method", default="tree")
 @click.option("--spearman", default=False)
+@click.option("--rank_metrics", default=True, type=bool, help="Also calculate recall@k and the error of the k-th value.")
+@click.option("--reference_dir", default="_out/benchmark/reference", help="Store of exact reference results.")
 def main(
         k_ratio, 
         data, 
@@ -30,20 +32,22 @@ def main(
         data_sample,
         n_threads,
         method,
-        spearman):
+        spearman,
+        rank_metrics,
+        reference_dir):
 
     import coralsarticle.utils
     coralsarticle.utils.set_threads_for_external_libraries(n_threads=n_threads)
 
     import numpy as np
-    import scipy.sparse
-    import sklearn.metrics
     import collections
     import pathlib
     import h5py
     import datetime
 
     import coralsarticle.data.utils
+    import coralsarticle.benchmark.metrics
+    import coralsarticle.benchmark.reference
     import corals.correlation.topkdiff
     import corals.correlation.fast
 
@@ -109,12 +113,21 @@ def main(
 
     #%%
     # reference
-    print("* Calculate reference topk")
-
-    cor_topkdiff_ref, idx_topkdiff_ref = corals.correlation.topkdiff.topkdiff_matrix(X1, X2, k=k, spearman=spearman)
-    
-    cor_topk_ref_matrix1 = scipy.sparse.csr_matrix((cor_topkdiff_ref, idx_topkdiff_ref), shape=[X1.shape[1]] * 2)
-    values1 = cor_topk_ref_matrix1.toarray()[np.tril_indices(n=X1.shape[1], k=-1)]
+    print("* Reference topk")
+
+    cor_topkdiff_ref, idx_topkdiff_ref = coralsarticle.benchmark.reference.load_reference(
+        corals.correlation.topkdiff.topkdiff_matrix, X1, X2, 
+        data_name=data_name, reference_dir=reference_dir, k=k, spearman=spearman)
+
+    # pairs are canonicalized, i.e., (i, j) and (j, i) are the same pair
+    n_features = X1.shape[1]
+    n_total = coralsarticle.benchmark.metrics.n_pairs_tril(n_features)
+    keys_ref = coralsarticle.benchmark.metrics.pair_keys(
+        *idx_topkdiff_ref, n=n_features, values=cor_topkdiff_ref, mode="symmetric")
+    if rank_metrics:
+        keys_ref_ranked, values_ref_ranked = coralsarticle.benchmark.metrics.ranked_pair_keys(
+            *idx_topkdiff_ref, n=n_features, values=cor_topkdiff_ref)
+    del cor_topkdiff_ref, idx_topkdiff_ref
 
     #%%
     approximation_factors = np.arange(1, max_approx + 1)
@@ -131,33 +144,20 @@ def main(
         else:
             raise ValueError(f"Unknown method: {method}")
 
-        print("  * prepare data")
-        m2 = scipy.sparse.csr_matrix((cor2, idx2), shape=[X1.shape[1]] * 2)
-        v2 = m2.toarray()[np.tril_indices(n=X1.shape[1], k=-1)]
-
         print("  * metrics")
-        
-        print("    * accuracy:  ", end="")
-        a = sklearn.metrics.accuracy_score(values1 != 0, v2 != 0)
-        metrics.setdefault("accuracy", []).append(a)
-        print(f"{a:.02f}")
-
-        print("    * precision: ", end="")
-        p = sklearn.metrics.precision_score(values1 != 0, v2 != 0)
-        metrics.setdefault("precision", []).append(p)
-        print(f"{p:.02f}")
-
-        print("    * recall:    ", end="")
-        r = sklearn.metrics.recall_score(values1 != 0, v2 != 0)
-        metrics.setdefault("recall", []).append(r)
-        print(f"{r:.02f}")
-
-        print("    * f1:        ", end="")
-        f1 = sklearn.metrics.f1_score(values1 != 0, v2 != 0)
-        metrics.setdefault("f1", []).append(f1)
-        print(f"{f1:.02f}")
-
-    
+        keys2 = coralsarticle.benchmark.metrics.pair_keys(*idx2, n=n_features, values=cor2, mode="symmetric")
+        metrics_factor = coralsarticle.benchmark.metrics.set_metrics(keys_ref, keys2, n_total=n_total)
+        if rank_metrics:
+            keys2_ranked, values2_ranked = coralsarticle.benchmark.metrics.ranked_pair_keys(
+                *idx2, n=n_features, values=cor2)
+            # the reference's number of distinct pairs corresponds to k
+            metrics_factor.update(coralsarticle.benchmark.metrics.rank_metrics(
+                keys_ref_ranked, values_ref_ranked, keys2_ranked, values2_ranked, k=keys_ref_ranked.size))
+
+        for key, value in metrics_factor.items():
+            metrics.setdefault(key, []).append(value)
+            print(f"    * {key + ':':<25} {value:.02f}")
+
     # write results
     print("* Write results")
     file.parent.mkdir(parents=True, exist_ok=True)
@@ -168,6 +168,8 @@ def main(
         for key, value in metrics.items():
             f[f"metrics/{key}"] =  value
 
+        f.attrs["pairs"] = "symmetric"
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,4 +1,6 @@
 import click
+from measure import MEMORY_BACKENDS
+from placement import MEMORY_POLICIES
 
 @click.command()
 @click.option("--prefix", default="default", help="Prefix")
@@ -9,12 +11,77 @@ import click
 @click.option("--threshold", default=0.75)
 @click.option("--n_threads", default=1)
 @click.option("--overwrite", default=False, type=bool)
-@click.option("--memory_backend", default="psutil")
-def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, memory_backend):
+@click.option("--memory_backend", default="psutil", type=click.Choice(MEMORY_BACKENDS))
+@click.option("--timing_mode", default="combined", type=click.Choice(["combined", "separate"]), 
+    help="Measure runtime and memory in the same rounds or in separate passes (adaptive timing).")
+@click.option("--n_warmup", default=1, help="Separate mode: warm-up rounds before timing.")
+@click.option("--min_repeat", default=3, help="Separate mode: minimum number of timed rounds (`n_repeat` is the maximum).")
+@click.option("--target_ci", default=0.05, help="Separate mode: stop when the confidence interval of the mean runtime is within this fraction of the mean.")
+@click.option("--time_budget", default=None, type=float, help="Separate mode: time budget for the timing pass in seconds.")
+@click.option("--n_repeat_memory", default=1, help="Separate mode: rounds of the memory pass.")
+@click.option("--mmap", default=False, type=bool, help="Memory-map the dataset read-only instead of reading it into memory.")
+@click.option("--shm", default=False, type=bool, help="Hand the dataset to joblib workers via shared memory (see `shm.py`).")
+@click.option("--placement", default="none", help="CPU placement: `none`, `compact`, `scatter` or a CPU list like `0-7,16-23` (see `placement.py`).")
+@click.option("--memory_placement", default="default", type=click.Choice(MEMORY_POLICIES), help="NUMA memory placement (see `placement.py`).")
+@click.option("--bind_threads", default=False, type=bool, help="Bind OpenMP threads to single CPUs of the placement.")
+@click.option("--counters", default=True, type=bool, help="Record OS and hardware counters per round (see `counters.py`).")
+@click.option("--results_store", default=None, help="Also append results to this results store (see `coralsarticle/benchmark/results.py`).")
+def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, memory_backend, 
+        timing_mode, n_warmup, min_repeat, target_ci, time_budget, n_repeat_memory, mmap, shm, placement, memory_placement, bind_threads, counters, results_store):
+
+    # pin CPUs and set memory policy (before threads are created)
+    import coralsarticle.benchmark.scheduler
+    import placement as placement_module
+    cpu_placement = placement_module.derive_placement(
+        placement, 
+        coralsarticle.benchmark.scheduler.derive_n_cores(exp, n_threads), 
+        memory=memory_placement, 
+        bind_threads=bind_threads)
+    placement_module.apply(cpu_placement)
 
     # set threads
     import corals.threads
     corals.threads.set_threads_for_external_libraries(n_threads=n_threads)
+
+    run_benchmark(
+        prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, memory_backend, 
+        timing_mode=timing_mode, 
+        n_warmup=n_warmup, 
+        min_repeat=min_repeat, 
+        target_ci=target_ci, 
+        time_budget=time_budget, 
+        n_repeat_memory=n_repeat_memory,
+        mmap=mmap,
+        shm=shm,
+        placement=cpu_placement,
+        counters=counters,
+        results_store=results_store)
+
+
+def run_benchmark(
+        prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, memory_backend, X=None,
+        timing_mode="combined", n_warmup=1, min_repeat=3, target_ci=0.05, time_budget=None, n_repeat_memory=1, mmap=False,
+        shm=False, placement=None, counters=True, results_store=None):
+    """
+    Runs a single benchmark experiment.
+
+    In `combined` timing mode, each of the `n_repeat` rounds measures runtime and memory at the same time.
+    In `separate` timing mode, runtime is measured first without memory monitoring 
+    (with warm-up and adaptive repeats up to `n_repeat`; see `timing.py`), 
+    followed by a memory pass of `n_repeat_memory` rounds.
+
+    If `X` is given, the dataset is not loaded again (see `worker.py`).
+    With `mmap`, the dataset is memory-mapped read-only and handed to the algorithm without copying.
+    With `shm`, the dataset (and CorALS' standardized copy of it) is placed in shared memory and handed to joblib workers without copying;
+    the time spent serializing tasks for joblib workers is recorded per round in any case (see `shm.py`).
+    `placement` is the CPU and memory placement already applied to this process (see `placement.py`);
+    joblib workers are pinned accordingly, and the placement is recorded with the results.
+    With `counters`, OS and hardware counters (CPU time, context switches, page faults, I/O, cycles, ...)
+    are recorded for each round of the memory pass (see `counters.py`).
+    If `results_store` is given, results are also appended to it (see `coralsarticle/benchmark/results.py`).
+    Threads for external libraries must be set before calling this function.
+    """
+
     threads_context = "" if n_threads == 1 else f"_nthreads-{n_threads}"
 
     import pathlib
@@ -23,28 +90,18 @@ def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, m
     import collections
     import h5py
     import gc
-
-    from memory_profiler import memory_usage
+    import contextlib
 
     import coralsarticle.data.utils
 
-    # benchmark parameters
-    memory_usage_kwargs = dict(
-        # doesn't make a difference either it seems
-        # default value (0.1) seems fine
-        interval=0.1,
-        # we are only interested in max imum memory consumption over time
-        max_usage=True,  
-        # combines memory usage of parent and children processes
-        # NOTE: This measures RSS and might overestimate memory usage! 
-        #       There is an updated version of `memory_profiler` coming up 
-        #       that can measure PSS and USS which might be more accurate 
-        include_children=True,
-        # also keep track of children's memory consumption separately ... we don't really use this
-        multiprocess=True,
-        # default backend measures RSS which may overestimate memory usage in parallel case
-        backend=memory_backend
-    )
+    from measure import measure, memory_monitors, MEMORY_PROFILER_BACKENDS
+    import timing
+    import counters as counters_module
+    import shm as shm_module
+    import placement as placement_module
+
+    if placement is None:
+        placement = placement_module.derive_placement("none", n_threads)
 
     # k
     k_name = f"{k_ratio * 100:.02f}percent"
@@ -67,7 +124,7 @@ def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, m
         raise ValueError(f"No matching context found for experiment: {experiment_name}")
 
     experiment_name += threads_context
-    file = pathlib.Path(f"_out/benchmark/benchmark___prefix-{prefix}___context-{context}___lang-python___data-{data}___algorithm-{experiment_name}___repeat-{n_repeat}___memory_backend-{memory_backend}.h5")
+    file = pathlib.Path(f"_out/benchmark/benchmark___prefix-{prefix}___context-{context}___lang-python___data-{data}___algorithm-{experiment_name}___repeat-{n_repeat}___memory_backend-{memory_backend}{'___timing-separate' if timing_mode == 'separate' else ''}.h5")
     file.parent.mkdir(parents=True, exist_ok=True)
 
     # experiment
@@ -76,6 +133,12 @@ def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, m
     print(f"* File:      {file}")
     print(f"* Threads:   {n_threads}")
     print(f"* Backend:   {memory_backend}")
+    print(f"* Timing:    {timing_mode}")
+    print(f"* Mmap:      {mmap}")
+    print(f"* Shm:       {shm}")
+    print(f"* Placement: {placement.policy} (CPUs: {placement_module.format_cpulist(placement.cpus)}; memory: {placement.memory})")
+    print(f"* Counters:  {counters}")
+    print(f"* Store:     {results_store}")
     print(f"* Overwrite: {overwrite}")
 
     # stop if experiment already exists
@@ -85,10 +148,11 @@ def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, m
             return
             
     # load and prepare dataset
-    X = coralsarticle.data.utils.load_h5(f"data/benchmark/{data}.h5").values
+    if X is None:
+        X = load_data(data, mmap=mmap)
     if "topkdiff" in exp:
         print(f"* Prepare diff experiment: {X.shape}")
-        X = corals.data.utils.preprocess_diff(X)
+        X = coralsarticle.data.utils.preprocess_diff(X)
     
     print(f"* Data:      {X.shape}")
 
@@ -100,52 +164,167 @@ def run(prefix, exp, n_repeat, data, k_ratio, threshold, n_threads, overwrite, m
     # threshold
     print(f"* Threshold: {threshold}")
     
-    # experiments
-    from exps import load_experiments
-    experiments = load_experiments(X, k=k, threshold=threshold)
-    exp_init_func, exp_args, exp_kwargs = experiments[exp]
-    exp_func = exp_init_func()
-
-    # run rounds
-    print("Running experiments")
-    results = collections.OrderedDict()
-    timestamp = time.time()
-    for i in range(n_repeat):
-
-        print(f"* Round {i} ({datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}): ")
-
-        exp_results = results.setdefault(experiment_name, {"memory":[], "runtime":[]})
-
-        # NOTE: runtime may be slower due to memory monitoring
-        gc.collect()
-        start_time = time.time()
-        if memory_backend == "none":
-            exp_func(*exp_args, **exp_kwargs)
-            mem = -1
+    # the shared-memory hand-off (if any) is cleaned up after all rounds
+    with contextlib.ExitStack() as stack:
+
+        # place data in shared memory before creating the experiment, so the experiment receives the shared array
+        if shm:
+            start_time = time.perf_counter()
+            X = stack.enter_context(shm_module.share(X))
+            shm_setup_time = time.perf_counter() - start_time
+            stack.enter_context(shm_module.share_preprocessed())
+            stack.enter_context(shm_module.joblib_config())
+            print(f"* Shm file:  {X.filename} ({shm_setup_time:.03f}s)")
+
+        unpinned_workers = stack.enter_context(placement_module.pin_joblib_workers(placement))
+
+        # experiments
+        from exps import load_experiment
+        exp_init_func, exp_args, exp_kwargs = load_experiment(exp, X, k=k, threshold=threshold)
+        exp_func = exp_init_func()
+
+        # run rounds
+        print("Running experiments")
+        results = collections.OrderedDict()
+        exp_results = results.setdefault(experiment_name, {"memory":[], "runtime":[], "memory_extra": {}, "timing": {}, "counters": {}, "handoff": {}})
+        timestamp = time.time()
+
+        if timing_mode == "combined":
+            n_rounds_memory = n_repeat
+        elif timing_mode == "separate":
+            print("Timing pass")
+            samples, warmup = timing.time_adaptive(
+                exp_func, exp_args, exp_kwargs,
+                n_warmup=n_warmup,
+                min_repeat=min_repeat,
+                max_repeat=n_repeat,
+                target_ci=target_ci,
+                time_budget=time_budget)
+            exp_results["runtime"] = samples
+            exp_results["timing"]["runtime_warmup"] = warmup
+            exp_results["timing"]["runtime_ci"] = timing.relative_ci(samples)
+            print("Memory pass")
+            n_rounds_memory = n_repeat_memory
         else:
-            mem = memory_usage(proc=(exp_func, exp_args, exp_kwargs), **memory_usage_kwargs)
-        end_time = time.time()
+            raise ValueError(f"Unknown timing mode: {timing_mode}")
+
+        for i in range(n_rounds_memory):
 
-        exp_results["memory"].append(mem)
-        exp_results["runtime"].append(end_time - start_time)
+            print(f"* Round {i} ({datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}): ")
 
-        runtime = datetime.datetime.fromtimestamp(end_time) - datetime.datetime.fromtimestamp(start_time)
-        print(f"  {str(runtime)} ({mem:.02f} Mb)")
+            gc.collect()
+            round_counters = collections.OrderedDict()
+            round_func = exp_func
+            snapshot = None
+            if counters and memory_backend in MEMORY_PROFILER_BACKENDS:
+                # memory_profiler's monitor process runs within the round; count within the call without it
+                round_func = counters_module.counted(exp_func, round_counters, exclude=memory_monitors)
+            elif counters:
+                snapshot = counters_module.start()
+            with shm_module.time_serialization() as serialization:
+                runtime, mem, mem_extra = measure(round_func, exp_args, exp_kwargs, memory_backend=memory_backend)
+            if snapshot is not None:
+                round_counters.update(counters_module.stop(snapshot))
+
+            exp_results["memory"].append(mem)
+            if timing_mode == "combined":
+                exp_results["runtime"].append(runtime)
+            else:
+                exp_results["timing"].setdefault("runtime_memory_pass", []).append(runtime)
+            for key, value in mem_extra.items():
+                exp_results["memory_extra"].setdefault(key, []).append(value)
+            for key, value in round_counters.items():
+                exp_results["counters"].setdefault(key, []).append(value)
+            for key, value in [
+                    ("serialization_time", serialization.time), 
+                    ("serialization_bytes", serialization.bytes), 
+                    ("serialization_tasks", serialization.n_tasks), 
+                    ("compute_time", max(0., runtime - serialization.time))]:
+                exp_results["handoff"].setdefault(key, []).append(value)
+
+            print(f"  {str(datetime.timedelta(seconds=runtime))} ({mem:.02f} Mb)")
+            if counters:
+                print(
+                    f"  CPU: {round_counters['cpu_user']:.02f}s user, {round_counters['cpu_system']:.02f}s system; "
+                    f"context switches: {round_counters['ctx_switches_involuntary']} involuntary; "
+                    f"page faults: {round_counters['page_faults_major']} major")
+            if serialization.n_tasks > 0:
+                print(
+                    f"  Serialization: {serialization.time:.03f}s ({serialization.bytes / 1024**2:.02f} Mb, "
+                    f"{serialization.n_tasks} tasks); compute: {max(0., runtime - serialization.time):.03f}s")
+
+    # summary statistics
+    runtime_median, runtime_iqr = timing.summarize(exp_results["runtime"])
+    memory_median, memory_iqr = timing.summarize(exp_results["memory"])
+    print(f"Runtime:     {str(datetime.timedelta(seconds=runtime_median))} (median; IQR: {runtime_iqr:.03f}s; rounds: {len(exp_results['runtime'])})")
 
     # write results
     print("Writing results")
     file.parent.mkdir(parents=True, exist_ok=True)
     with h5py.File(file, "a") as f:
         for key, value in results.items():
-            if key not in f:
-                f[f"{key}/memory"] =  value["memory"]
-                f[f"{key}/runtime"] =  value["runtime"]
-            else:
-                f[f"{key}/memory"][...] =  value["memory"]
-                f[f"{key}/runtime"][...] =  value["runtime"]
+
+            write_dataset(f, f"{key}/memory", value["memory"])
+            write_dataset(f, f"{key}/runtime", value["runtime"])
+
+            for extra_key, extra_value in [
+                    item for extra in ("memory_extra", "timing", "counters", "handoff") for item in value[extra].items()]:
+                write_dataset(f, f"{key}/{extra_key}", extra_value)
 
             f[f"{key}"].attrs["timestamp"] = timestamp
             f[f"{key}"].attrs["memory_backend"] = memory_backend
+            f[f"{key}"].attrs["timing_mode"] = timing_mode
+            f[f"{key}"].attrs["timer"] = "perf_counter"
+            f[f"{key}"].attrs["n_warmup"] = n_warmup if timing_mode == "separate" else 0
+            f[f"{key}"].attrs["runtime_median"] = runtime_median
+            f[f"{key}"].attrs["runtime_iqr"] = runtime_iqr
+            f[f"{key}"].attrs["memory_median"] = memory_median
+            f[f"{key}"].attrs["memory_iqr"] = memory_iqr
+            f[f"{key}"].attrs["mmap"] = mmap
+            f[f"{key}"].attrs["k"] = k
+            f[f"{key}"].attrs["n_threads"] = n_threads
+            f[f"{key}"].attrs["counters"] = counters
+            f[f"{key}"].attrs["shm"] = shm
+            if shm:
+                f[f"{key}"].attrs["shm_setup_time"] = shm_setup_time
+            for attr_key, attr_value in placement_module.describe(placement, len(unpinned_workers)).items():
+                f[f"{key}"].attrs[attr_key] = attr_value
+
+    if results_store is not None:
+        print(f"Appending results to store: {results_store}")
+        import coralsarticle.benchmark.results
+        store = coralsarticle.benchmark.results.ResultsStore(results_store)
+        params = coralsarticle.benchmark.results.parse_file_name(file.name)
+        if params["context"].startswith("topk"):
+            params.update(k=k, k_ratio=k_ratio)
+        for key, value in results.items():
+            store.append(
+                runtime=value["runtime"],
+                memory=value["memory"],
+                extra=dict(**value["memory_extra"], **value["timing"], **value["counters"], **value["handoff"]),
+                attrs=dict(
+                    n_warmup=n_warmup if timing_mode == "separate" else 0, 
+                    timer="perf_counter",
+                    **placement_module.describe(placement, len(unpinned_workers))),
+                **params,
+                file=file.name,
+                algorithm=key,
+                n_threads=n_threads,
+                mmap=mmap,
+                timestamp=timestamp,
+                runtime_median=runtime_median,
+                memory_median=memory_median)
+
+
+def write_dataset(f, name, value):
+    if name in f:
+        del f[name]
+    f[name] = value
+
+
+def load_data(data, mmap=False):
+    import coralsarticle.data.utils
+    return coralsarticle.data.utils.load_matrix(f"data/benchmark/{data}.h5", mmap=mmap)
 
 
 if __name__ == "__main__":
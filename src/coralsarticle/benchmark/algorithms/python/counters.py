@@ -0,0 +1,265 @@
+"""
+OS and hardware counters per benchmark round for `benchmark.py`.
+
+Counters help to explain slow runs (e.g., BLAS oversubscription, page faults, joblib serialization):
+
+* `cpu_user`, `cpu_system`: CPU time in seconds
+* `ctx_switches_voluntary`, `ctx_switches_involuntary`: context switches
+* `page_faults_major`, `page_faults_minor`: page faults
+* `io_read_bytes`, `io_write_bytes`: bytes read from / written to storage
+* `io_read_chars`, `io_write_chars`: bytes passed to `read`/`write` calls (including pipes, e.g., joblib serialization)
+* `perf_<event>`: hardware counters (user space) via `perf_event_open` (e.g., `perf_cycles`, `perf_cache_misses`);
+  only if permitted (see `/proc/sys/kernel/perf_event_paranoid`), otherwise they are omitted
+
+Usage:
+
+```python
+snapshot = counters.start()
+func()
+values = counters.stop(snapshot)
+```
+
+OS counters cover the benchmark process (all threads), reaped children (e.g., the child of the `rusage` memory backend)
+and all descendants alive at the end of the round (e.g., joblib's loky workers; relative to the start of the round).
+Hardware counters cover all threads of the benchmark process and processes forked during the round that exited
+before its end (inherited counts are only added to the parent when a child exits),
+but neither processes forked during the round that are still alive at its end (e.g., new loky workers)
+nor processes that already existed before the round (e.g., reused loky workers).
+
+With `memory_profiler`'s backends (e.g., `psutil`), a monitor process samples memory during the round;
+to exclude it, counters are taken within the measured call (see `counted`) without the monitor process.
+"""
+import collections
+import ctypes
+import os
+import resource
+import struct
+
+from measure import process_tree
+
+
+Snapshot = collections.namedtuple("Snapshot", ["rusage_self", "rusage_children", "io", "tree", "perf", "exclude"])
+
+
+RUSAGE_FIELDS = collections.OrderedDict([
+    ("cpu_user", "ru_utime"),
+    ("cpu_system", "ru_stime"),
+    ("ctx_switches_voluntary", "ru_nvcsw"),
+    ("ctx_switches_involuntary", "ru_nivcsw"),
+    ("page_faults_major", "ru_majflt"),
+    ("page_faults_minor", "ru_minflt"),
+])
+
+IO_FIELDS = collections.OrderedDict([
+    ("io_read_bytes", "read_bytes"),
+    ("io_write_bytes", "write_bytes"),
+    ("io_read_chars", "rchar"),
+    ("io_write_chars", "wchar"),
+])
+
+
+# `perf_event_open` (see `man perf_event_open`)
+PERF_TYPE_HARDWARE = 0
+PERF_EVENTS = collections.OrderedDict([
+    ("cycles", 0),              # PERF_COUNT_HW_CPU_CYCLES
+    ("instructions", 1),        # PERF_COUNT_HW_INSTRUCTIONS
+    ("cache_references", 2),    # PERF_COUNT_HW_CACHE_REFERENCES
+    ("cache_misses", 3),        # PERF_COUNT_HW_CACHE_MISSES
+])
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1
+PERF_FORMAT_TOTAL_TIME_RUNNING = 2
+PERF_FLAG_FD_CLOEXEC = 8
+PERF_ATTR_FLAG_INHERIT = 1 << 1
+PERF_ATTR_FLAG_EXCLUDE_KERNEL = 1 << 5
+PERF_ATTR_FLAG_EXCLUDE_HV = 1 << 6
+SYS_PERF_EVENT_OPEN = {"x86_64": 298, "aarch64": 241, "ppc64le": 319}
+
+
+class PerfEventAttr(ctypes.Structure):
+    # PERF_ATTR_SIZE_VER5
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+        ("branch_sample_type", ctypes.c_uint64),
+        ("sample_regs_user", ctypes.c_uint64),
+        ("sample_stack_user", ctypes.c_uint32),
+        ("clockid", ctypes.c_int32),
+        ("sample_regs_intr", ctypes.c_uint64),
+        ("aux_watermark", ctypes.c_uint32),
+        ("sample_max_stack", ctypes.c_uint16),
+        ("reserved_2", ctypes.c_uint16),
+    ]
+
+
+def start(perf=True, exclude=()):
+    """
+    Takes a snapshot of all counters (and starts hardware counters if `perf`);
+    descendants in `exclude` (process ids) are not counted while they are alive.
+    """
+    return Snapshot(
+        rusage_self=resource.getrusage(resource.RUSAGE_SELF),
+        rusage_children=resource.getrusage(resource.RUSAGE_CHILDREN),
+        io=read_io("self"),
+        tree={pid: read_process(pid) for pid in process_tree()[1:] if pid not in exclude},
+        perf=perf_open() if perf else {},
+        exclude=frozenset(exclude))
+
+
+def counted(func, values, exclude=None):
+    """
+    Wraps `func`, so counters are taken within each call and written to `values` (dict);
+    `exclude()` returns the process ids not to count (e.g., `measure.memory_monitors`).
+    """
+
+    def counted_func(*args, **kwargs):
+        snapshot = start(exclude=exclude() if exclude is not None else ())
+        try:
+            return func(*args, **kwargs)
+        finally:
+            values.update(stop(snapshot))
+
+    return counted_func
+
+
+def stop(snapshot):
+    """Returns the counters accumulated since `snapshot` (see module documentation)."""
+
+    # read hardware counters first, so reading the other counters is not counted
+    values = collections.OrderedDict()
+    perf = perf_read(snapshot.perf)
+
+    rusage_self = resource.getrusage(resource.RUSAGE_SELF)
+    rusage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    for name, field in RUSAGE_FIELDS.items():
+        values[name] = \
+            getattr(rusage_self, field) - getattr(snapshot.rusage_self, field) + \
+            getattr(rusage_children, field) - getattr(snapshot.rusage_children, field)
+
+    # includes reaped children
+    io = read_io("self")
+    for name, field in IO_FIELDS.items():
+        values[name] = io.get(field, 0) - snapshot.io.get(field, 0)
+
+    # descendants that are still alive (relative to the start of the round if they existed already)
+    for pid in process_tree()[1:]:
+        if pid in snapshot.exclude:
+            continue
+        current = read_process(pid)
+        before = snapshot.tree.get(pid, {})
+        for name in values:
+            values[name] += max(0, current.get(name, 0) - before.get(name, 0))
+
+    for name, value in perf.items():
+        values[f"perf_{name}"] = value
+
+    return values
+
+
+def read_io(pid):
+    """Reads `/proc/<pid>/io` (empty if not available)."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                values[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return values
+
+
+def read_process(pid):
+    """Reads the counters of another process from `/proc` (empty if it terminated in the meantime)."""
+
+    values = {}
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # fields after the command name (which may contain spaces), starting with `state` (field 3)
+            stat = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status", "r") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return values
+
+    ticks = os.sysconf("SC_CLK_TCK")
+    values["cpu_user"] = int(stat[11]) / ticks
+    values["cpu_system"] = int(stat[12]) / ticks
+    values["page_faults_minor"] = int(stat[7])
+    values["page_faults_major"] = int(stat[9])
+    values["ctx_switches_voluntary"] = int(status.get("voluntary_ctxt_switches", 0))
+    values["ctx_switches_involuntary"] = int(status.get("nonvoluntary_ctxt_switches", 0))
+
+    io = read_io(pid)
+    for name, field in IO_FIELDS.items():
+        values[name] = io.get(field, 0)
+
+    return values
+
+
+def perf_open():
+    """
+    Opens hardware counters for all threads of this process (inherited by threads and processes created later).
+    Returns a dict mapping event names to lists of file descriptors (empty if `perf_event_open` is not available).
+    """
+
+    import platform
+
+    syscall_nr = SYS_PERF_EVENT_OPEN.get(platform.machine())
+    if syscall_nr is None:
+        return {}
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+
+    fds = collections.OrderedDict()
+    try:
+        tids = [int(t) for t in os.listdir("/proc/self/task")]
+    except OSError:
+        return {}
+
+    for name, config in PERF_EVENTS.items():
+        for tid in tids:
+            attr = PerfEventAttr(
+                type=PERF_TYPE_HARDWARE,
+                size=ctypes.sizeof(PerfEventAttr),
+                config=config,
+                read_format=PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING,
+                # user space only, which is permitted for unprivileged users by default (`perf_event_paranoid` <= 2)
+                flags=PERF_ATTR_FLAG_INHERIT | PERF_ATTR_FLAG_EXCLUDE_KERNEL | PERF_ATTR_FLAG_EXCLUDE_HV)
+            fd = libc.syscall(
+                syscall_nr, ctypes.byref(attr), tid, -1, -1, ctypes.c_ulong(PERF_FLAG_FD_CLOEXEC))
+            if fd < 0:
+                if tid == tids[0]:
+                    # event not supported or not permitted
+                    break
+                # thread terminated in the meantime
+                continue
+            fds.setdefault(name, []).append(fd)
+
+    return fds
+
+
+def perf_read(fds):
+    """Reads (scaled for multiplexing) and closes hardware counters opened via `perf_open`."""
+
+    values = collections.OrderedDict()
+    for name, event_fds in fds.items():
+        total = 0
+        for fd in event_fds:
+            try:
+                value, enabled, running = struct.unpack("QQQ", os.read(fd, 24))
+                if running > 0:
+                    total += value * enabled / running
+            finally:
+                os.close(fd)
+        values[name] = total
+    return values
@@ -1,20 +1,46 @@
 import collections
+import importlib
 
 
-def load_experiments(X, **kwargs):
+# modules registering experiments (see `registry/base.py`)
+# NOTE: these must not import any algorithm modules at module level
+REGISTRY_MODULES = [
+    "registry.cor",
+    "registry.topk",
+    "registry.threshold",
+    "registry.topkdiff",
+    "registry.outofcore",
+    "registry.distributed",
+]
 
-    experiments = collections.OrderedDict()
 
-    from registry.cor import load_experiments as load
-    experiments.update(load(X, **kwargs))
+def load_registry():
+    import registry.base
+    for module in REGISTRY_MODULES:
+        importlib.import_module(module)
+    return registry.base
+
+
+def list_experiments():
+    """Names of all registered experiments (with expanded parameter grids)."""
+    base = load_registry()
+    return [name for template in base.TEMPLATES.values() for name, _ in base.expand(template)]
+
 
-    from registry.topk import load_experiments as load
-    experiments.update(load(X, **kwargs))
+def load_experiment(name, X, **kwargs):
+    """Returns `(init_func, args, kwargs)` for the given experiment name."""
+    base = load_registry()
+    template, params = base.match(name)
+    return template.factory(X, **kwargs, **params)
 
-    from registry.threshold import load_experiments as load
-    experiments.update(load(X, **kwargs))
 
-    from registry.topkdiff import load_experiments as load
-    experiments.update(load(X, **kwargs))
+def load_experiments(X, **kwargs):
+
+    base = load_registry()
+
+    experiments = collections.OrderedDict()
+    for template in base.TEMPLATES.values():
+        for name, params in base.expand(template):
+            experiments[name] = template.factory(X, **kwargs, **params)
     
     return experiments
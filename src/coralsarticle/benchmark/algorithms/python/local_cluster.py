@@ -0,0 +1,184 @@
+"""
+Dask and Spark baselines for top-k and threshold correlations on a local cluster.
+
+Unlike `scripts/cor_dask.py` and `scripts/cor_spark.py`, which compute the full correlation matrix
+(and require a manually started Spark master), the cluster is started within the experiment
+(Dask: `LocalCluster` with one single-threaded worker process per job; Spark: `local[<n_jobs>]`),
+so startup, hand-off and computation are measured like any other experiment
+(worker processes and Spark's JVM are children of the benchmark process).
+
+The normalized data is broadcast to all workers once; each task computes the correlations of a pair of
+column blocks (see `outofcore.topk_kernel`) and returns its top-k (or thresholded) correlations,
+which are merged on the driver as results arrive (see `outofcore.TopkBuffer`).
+With Spark, block pairs are distributed over `TASKS_PER_WORKER * n_jobs` partitions whose results are reduced
+within each partition (see `topk_partition`), so partitions run concurrently and only reduced results are collected.
+Results cover the full correlation matrix like `topk_matrix` and `threshold_matrix`.
+
+Block sizes are chosen automatically (see `derive_block_size`).
+Spark requires Java (see `scripts/cor_spark.py`).
+"""
+import numpy as np
+
+import outofcore
+
+
+# block pairs (tasks) per worker for load balancing
+TASKS_PER_WORKER = 4
+
+
+def topk_dask(X, k, n_jobs=1, block_size=None):
+    Z, pairs = prepare(X, n_jobs, k=k, block_size=block_size)
+    buffer = outofcore.TopkBuffer(int(min(k, Z.shape[1]**2)))
+    for result in run_dask(topk_pair, Z, pairs, n_jobs, k=buffer.k):
+        buffer.add(*result)
+    return buffer.result()
+
+
+def threshold_dask(X, threshold, n_jobs=1, block_size=None):
+    Z, pairs = prepare(X, n_jobs, block_size=block_size)
+    return concatenate(run_dask(threshold_pair, Z, pairs, n_jobs, threshold=threshold))
+
+
+def topk_spark(X, k, n_jobs=1, block_size=None):
+    Z, pairs = prepare(X, n_jobs, k=k, block_size=block_size)
+    buffer = outofcore.TopkBuffer(int(min(k, Z.shape[1]**2)))
+    for result in run_spark(topk_partition, Z, pairs, n_jobs, k=buffer.k):
+        buffer.add(*result)
+    return buffer.result()
+
+
+def threshold_spark(X, threshold, n_jobs=1, block_size=None):
+    Z, pairs = prepare(X, n_jobs, block_size=block_size)
+    return concatenate(run_spark(threshold_partition, Z, pairs, n_jobs, threshold=threshold))
+
+
+def run_dask(func, Z, pairs, n_jobs, **kwargs):
+    """Yields the results of `func(Z, pair, **kwargs)` for all pairs (in order of completion)."""
+
+    import tempfile
+    from dask.distributed import Client, LocalCluster, as_completed
+
+    with tempfile.TemporaryDirectory(prefix="coralsarticle-dask-") as local_directory:
+        with LocalCluster(
+                    n_workers=n_jobs,
+                    threads_per_worker=1,
+                    processes=True,
+                    dashboard_address=None,
+                    local_directory=local_directory) as cluster, \
+                Client(cluster) as client:
+            [Z_future] = client.scatter([Z], broadcast=True)
+            futures = [client.submit(func, Z_future, pair, pure=False, **kwargs) for pair in pairs]
+            for _, result in as_completed(futures, with_results=True):
+                yield result
+
+
+def run_spark(func, Z, pairs, n_jobs, **kwargs):
+    """Yields the results of `func(Z, pairs, **kwargs)` for all partitions of the pairs."""
+
+    import tempfile
+    from pyspark.sql import SparkSession
+
+    with tempfile.TemporaryDirectory(prefix="coralsarticle-spark-") as local_directory:
+        spark = SparkSession.builder \
+            .master(f"local[{n_jobs}]") \
+            .appName("corals") \
+            .config("spark.ui.enabled", "false") \
+            .config("spark.local.dir", local_directory) \
+            .getOrCreate()
+        try:
+            sc = spark.sparkContext
+            # Python workers import functions by module
+            sc.addPyFile(outofcore.__file__)
+            sc.addPyFile(__file__)
+            Z_broadcast = sc.broadcast(Z)
+            try:
+                rdd = sc.parallelize(pairs, numSlices=min(len(pairs), TASKS_PER_WORKER * n_jobs))
+                # NOTE: `collect` runs all partitions concurrently (unlike `toLocalIterator`, which runs one after another)
+                rdd = rdd.mapPartitions(lambda partition: [func(Z_broadcast.value, list(partition), **kwargs)])
+                for result in rdd.collect():
+                    yield result
+            finally:
+                Z_broadcast.destroy()
+        finally:
+            spark.stop()
+
+
+def prepare(X, n_jobs, k=0, block_size=None):
+    """Normalizes `X` (zero mean, unit norm per column) and splits its columns into block pairs."""
+
+    Z = np.array(X, dtype=np.float64, order="F")
+    Z -= Z.mean(axis=0)
+    norm = np.sqrt(np.einsum("ij,ij->j", Z, Z))
+    norm[norm == 0] = 1
+    Z /= norm
+
+    m, n = Z.shape
+    block_size = derive_block_size(m, n, n_jobs, k=k, block_size=block_size)
+    starts = list(range(0, n, block_size))
+    pairs = [
+        (i, min(n, i + block_size), j, min(n, j + block_size))
+        for i in starts for j in starts if j >= i]
+    return Z, pairs
+
+
+def derive_block_size(m, n, n_jobs, k=0, block_size=None):
+    """
+    Columns per block: small enough for `TASKS_PER_WORKER` block pairs per worker
+    and for all workers' block pairs to fit into half of the available memory (see `outofcore.derive_block_size`).
+    """
+
+    if block_size is not None:
+        return int(min(n, max(1, block_size)))
+
+    # n_blocks (n_blocks + 1) / 2 >= TASKS_PER_WORKER * n_jobs
+    n_blocks = int(np.ceil((-1 + np.sqrt(1 + 8 * TASKS_PER_WORKER * n_jobs)) / 2))
+    block_size_tasks = int(np.ceil(n / n_blocks))
+
+    memory_budget = outofcore.derive_memory_available() // (2 * n_jobs)
+    block_size_memory = outofcore.derive_block_size(m, n, k=k, memory_budget=memory_budget)
+
+    return int(min(n, max(1, min(block_size_tasks, block_size_memory))))
+
+
+def topk_pair(Z, pair, k):
+    """Top-k correlations of a block pair (in both orientations for different blocks) as `(values, rows, cols)`."""
+    i_start, i_stop, j_start, j_stop = pair
+    values, (rows, cols) = outofcore.topk_kernel(Z[:, i_start:i_stop], Z[:, j_start:j_stop], k, kernel="matmul")
+    return mirror(values, rows + i_start, cols + j_start, i_start != j_start)
+
+
+def threshold_pair(Z, pair, threshold):
+    """Thresholded correlations of a block pair (in both orientations for different blocks) as `(values, rows, cols)`."""
+    i_start, i_stop, j_start, j_stop = pair
+    values, (rows, cols) = outofcore.threshold_kernel(
+        Z[:, i_start:i_stop], Z[:, j_start:j_stop], threshold, kernel="matmul")
+    return mirror(values, rows + i_start, cols + j_start, i_start != j_start)
+
+
+def topk_partition(Z, pairs, k):
+    """Top-k correlations of a partition of block pairs as `(values, rows, cols)`."""
+    buffer = outofcore.TopkBuffer(k)
+    for pair in pairs:
+        buffer.add(*topk_pair(Z, pair, k))
+    values, (rows, cols) = buffer.result()
+    return values, rows, cols
+
+
+def threshold_partition(Z, pairs, threshold):
+    """Thresholded correlations of a partition of block pairs as `(values, rows, cols)`."""
+    results = [threshold_pair(Z, pair, threshold) for pair in pairs]
+    if len(results) == 0:
+        return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    values, (rows, cols) = concatenate(results)
+    return values, rows, cols
+
+
+def mirror(values, rows, cols, both):
+    if not both:
+        return values, rows, cols
+    return np.concatenate([values, values]), np.concatenate([rows, cols]), np.concatenate([cols, rows])
+
+
+def concatenate(results):
+    values, rows, cols = zip(*results)
+    return np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))
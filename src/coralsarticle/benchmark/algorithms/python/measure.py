@@ -0,0 +1,244 @@
+"""
+Memory measurement backends for `benchmark.py`.
+
+All backends run the experiment once and return runtime and peak memory of that same run:
+
+* `none`: runtime only
+* `psutil`, `psutil_pss`, `psutil_uss`, `posix`, `tracemalloc`:
+  `memory_profiler` which samples memory usage in a separate process (every 0.1 seconds);
+  this may skew runtimes and overestimate memory (RSS) for joblib children
+* `rusage`: runs the experiment in a forked child and reads its peak RSS from `wait4`;
+  no sampling; only covers the experiment's process (peak RSS of reaped descendants is reported separately)
+* `proc`: resets the peak RSS of the process tree via `/proc/<pid>/clear_refs`
+  and sums the peak RSS (`VmHWM`) of all processes in the tree after the run;
+  no sampling; PSS and USS at the end of the run are reported separately (`/proc/<pid>/smaps_rollup`)
+* `cgroup`: peak memory of the cgroup the benchmark runs in (`memory.peak`, cgroup v2);
+  no sampling; covers the whole process tree, but also anything else in the cgroup (including page cache),
+  so the benchmark should run in a dedicated cgroup, e.g., via `systemd-run --user --scope ...` or in a container
+
+Memory is reported in MiB (like `memory_profiler`).
+"""
+import os
+import time
+import pickle
+import resource
+
+
+MEMORY_PROFILER_BACKENDS = ["psutil", "psutil_pss", "psutil_uss", "posix", "tracemalloc"]
+MEMORY_BACKENDS = ["none"] + MEMORY_PROFILER_BACKENDS + ["rusage", "proc", "cgroup"]
+
+
+def measure(func, args, kwargs, memory_backend="psutil"):
+    """
+    Runs `func(*args, **kwargs)` once.
+
+    Returns
+    -------
+    runtime: float
+        Runtime in seconds.
+    memory: float
+        Peak memory in MiB (-1 if not measured).
+    memory_extra: dict
+        Additional backend-specific statistics (memory in MiB).
+    """
+
+    if memory_backend == "none":
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        end_time = time.perf_counter()
+        return end_time - start_time, -1, {}
+
+    elif memory_backend in MEMORY_PROFILER_BACKENDS:
+        return measure_memory_profiler(func, args, kwargs, memory_backend)
+
+    elif memory_backend == "rusage":
+        return measure_rusage(func, args, kwargs)
+
+    elif memory_backend == "proc":
+        return measure_proc(func, args, kwargs)
+
+    elif memory_backend == "cgroup":
+        return measure_cgroup(func, args, kwargs)
+
+    else:
+        raise ValueError(f"Unknown memory backend: {memory_backend}")
+
+
+def measure_memory_profiler(func, args, kwargs, memory_backend):
+
+    from memory_profiler import memory_usage
+
+    memory_usage_kwargs = dict(
+        # doesn't make a difference either it seems
+        # default value (0.1) seems fine
+        interval=0.1,
+        # we are only interested in max imum memory consumption over time
+        max_usage=True,
+        # combines memory usage of parent and children processes
+        # NOTE: This measures RSS and might overestimate memory usage!
+        #       There is an updated version of `memory_profiler` coming up
+        #       that can measure PSS and USS which might be more accurate
+        include_children=True,
+        # also keep track of children's memory consumption separately ... we don't really use this
+        multiprocess=True,
+        # default backend measures RSS which may overestimate memory usage in parallel case
+        backend=memory_backend
+    )
+
+    # NOTE: runtime may be slower due to memory monitoring
+    start_time = time.perf_counter()
+    mem = memory_usage(proc=(func, args, kwargs), **memory_usage_kwargs)
+    end_time = time.perf_counter()
+
+    return end_time - start_time, mem, {}
+
+
+def memory_monitors():
+    """Process ids of `memory_profiler`'s monitor processes (`MemTimer`) started by this process."""
+    import multiprocessing
+    return [p.pid for p in multiprocessing.active_children() if type(p).__name__ == "MemTimer"]
+
+
+def measure_rusage(func, args, kwargs):
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        # child
+        os.close(read_fd)
+        exit_code = 0
+        try:
+            start_time = time.perf_counter()
+            func(*args, **kwargs)
+            end_time = time.perf_counter()
+            # reap worker processes (e.g., joblib's loky workers), so their usage is accounted for
+            shutdown_joblib_workers()
+            result = (end_time - start_time, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, None)
+        except BaseException as e:
+            result = (None, None, repr(e))
+            exit_code = 1
+        with os.fdopen(write_fd, "wb") as f:
+            pickle.dump(result, f)
+        os._exit(exit_code)
+
+    # parent
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        data = f.read()
+    _, status, rusage = os.wait4(pid, 0)
+
+    if len(data) == 0:
+        raise RuntimeError(f"Experiment process died (status: {status})")
+    runtime, maxrss_children, error = pickle.loads(data)
+    if error is not None:
+        raise RuntimeError(f"Experiment failed: {error}")
+
+    # `ru_maxrss` is given in KiB on Linux
+    return runtime, rusage.ru_maxrss / 1024, dict(memory_children=maxrss_children / 1024)
+
+
+def measure_proc(func, args, kwargs):
+
+    # reset peak RSS of the current process tree
+    for pid in process_tree():
+        reset_peak_rss(pid)
+
+    start_time = time.perf_counter()
+    func(*args, **kwargs)
+    end_time = time.perf_counter()
+
+    # collect peak RSS of the process tree
+    # NOTE: processes that terminated during the run are not accounted for;
+    #       joblib's (loky) workers are kept alive and thus included
+    mem = 0
+    pss = 0
+    uss = 0
+    for pid in process_tree():
+        status = read_proc_kb(pid, "status")
+        rollup = read_proc_kb(pid, "smaps_rollup")
+        mem += status.get("VmHWM", 0)
+        pss += rollup.get("Pss", 0)
+        uss += rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)
+
+    return end_time - start_time, mem / 1024, dict(memory_pss=pss / 1024, memory_uss=uss / 1024)
+
+
+def measure_cgroup(func, args, kwargs):
+
+    path = cgroup_path()
+
+    # reset the peak for this file descriptor (Linux >= 6.12), otherwise the peak includes prior usage;
+    # older kernels reject opening `memory.peak` for writing
+    try:
+        f = open(path / "memory.peak", "r+")
+        try:
+            f.write("reset\n")
+            f.flush()
+        except OSError:
+            f.close()
+            raise
+        reset = True
+    except OSError:
+        f = open(path / "memory.peak", "r")
+        reset = False
+
+    with f:
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        end_time = time.perf_counter()
+
+        f.seek(0)
+        peak = int(f.read().strip())
+
+    return end_time - start_time, peak / 1024**2, dict(memory_peak_reset=float(reset))
+
+
+def cgroup_path():
+    import pathlib
+    with open("/proc/self/cgroup", "r") as f:
+        for line in f:
+            # cgroup v2 entry: "0::/path"
+            if line.startswith("0::"):
+                path = pathlib.Path("/sys/fs/cgroup") / line.strip()[3:].lstrip("/")
+                if (path / "memory.peak").exists():
+                    return path
+    raise RuntimeError("No cgroup v2 with `memory.peak` found for this process.")
+
+
+def process_tree(pid=None):
+    import psutil
+    process = psutil.Process(pid)
+    return [process.pid] + [p.pid for p in process.children(recursive=True)]
+
+
+def reset_peak_rss(pid):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def read_proc_kb(pid, name):
+    """Reads the `kB` entries of `/proc/<pid>/status` or `/proc/<pid>/smaps_rollup`."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/{name}", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        # process terminated in the meantime
+        pass
+    return values
+
+
+def shutdown_joblib_workers():
+    import sys
+    if "joblib" not in sys.modules:
+        return
+    from joblib.externals.loky import reusable_executor
+    if reusable_executor._executor is not None:
+        reusable_executor._executor.shutdown(wait=True)
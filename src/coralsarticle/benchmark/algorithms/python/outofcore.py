@@ -0,0 +1,250 @@
+"""
+Out-of-core driver for top-k and threshold experiments on memory-mapped matrices larger than memory.
+
+Instead of the whole (normalized) matrix, algorithms only see pairs of column blocks:
+
+1. column means and norms are computed in one pass over column blocks,
+2. for each pair of blocks `(i, j)` with `i <= j`, a kernel computes the top-k (or thresholded) correlations
+   between the columns of block `i` and block `j`,
+3. per-pair results are merged into a bounded top-k buffer (see `TopkBuffer`) or collected (threshold).
+
+Pairs of different blocks are added in both orientations, so results cover the full correlation matrix
+(including the diagonal) like `topk_matrix` and `threshold_matrix`.
+Inputs should be column-major (e.g., `create_outofcore_synthetic_mn` in `coralsarticle/data/utils.py`),
+so column blocks are contiguous in the memory map; row-major inputs work but read far more pages per block.
+
+Kernels:
+
+* `matmul`: dense correlations of the block pair via matrix multiplication (exact)
+* `balltree`: CorALS' ball tree search with block `j` as search space and block `i` as queries
+  (approximate like its in-memory counterpart)
+
+The block size is derived from a memory budget (by default, a quarter of the available memory).
+Blocks are read in chunks with the chunk size and `madvise` hint recommended for this machine
+(see `coralsarticle/data/blocked.py` and `coralsarticle/benchmark/blocked_io.py`).
+"""
+import numpy as np
+
+import coralsarticle.data.blocked as blocked
+
+
+KERNELS = ["matmul", "balltree"]
+
+
+def topk_outofcore(X, k, kernel="matmul", block_size=None, memory_budget=None, n_jobs=1):
+    """
+    Returns the `k` largest absolute correlations between the columns of `X` as `(values, (rows, cols))`,
+    sorted by absolute value (descending).
+    """
+
+    m, n = X.shape
+    k = int(min(k, n * n))
+    block_size = derive_block_size(m, n, k=k, block_size=block_size, memory_budget=memory_budget)
+    reading = derive_reading(X)
+    mean, scale = column_stats(X, block_size, reading)
+
+    buffer = TopkBuffer(k)
+    for i_start, i_stop, j_start, j_stop, Xi, Xj in iterate_block_pairs(X, block_size, mean, scale, reading):
+        values, (rows, cols) = topk_kernel(Xi, Xj, k, kernel=kernel, n_jobs=n_jobs)
+        buffer.add(values, rows + i_start, cols + j_start)
+        if i_start != j_start:
+            buffer.add(values, cols + j_start, rows + i_start)
+
+    return buffer.result()
+
+
+def threshold_outofcore(X, threshold, kernel="matmul", block_size=None, memory_budget=None, n_jobs=1):
+    """
+    Returns all correlations between the columns of `X` whose absolute value exceeds `threshold`
+    as `(values, (rows, cols))`.
+    """
+
+    m, n = X.shape
+    block_size = derive_block_size(m, n, block_size=block_size, memory_budget=memory_budget)
+    reading = derive_reading(X)
+    mean, scale = column_stats(X, block_size, reading)
+
+    values, rows, cols = [], [], []
+    for i_start, i_stop, j_start, j_stop, Xi, Xj in iterate_block_pairs(X, block_size, mean, scale, reading):
+        v, (r, c) = threshold_kernel(Xi, Xj, threshold, kernel=kernel, n_jobs=n_jobs)
+        values.append(v)
+        rows.append(r + i_start)
+        cols.append(c + j_start)
+        if i_start != j_start:
+            values.append(v)
+            rows.append(c + j_start)
+            cols.append(r + i_start)
+
+    return np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))
+
+
+def topk_kernel(Xi, Xj, k, kernel="matmul", n_jobs=1):
+    """Top-k correlations between the (normalized) columns of `Xi` (rows) and `Xj` (columns)."""
+
+    if kernel == "matmul":
+        cor = Xi.T @ Xj
+        k = min(k, cor.size)
+        flat = cor.ravel()
+        # absolute values in place (keeping the signs) to limit temporaries (see `derive_block_size`)
+        negative = np.signbit(flat)
+        np.abs(flat, out=flat)
+        idx = np.argpartition(flat, flat.size - k)[flat.size - k:]
+        rows, cols = np.unravel_index(idx, cor.shape)
+        return np.where(negative[idx], -flat[idx], flat[idx]), (rows, cols)
+
+    elif kernel == "balltree":
+        from corals.correlation.topk._deprecated.original import topk_balltree_combined_tree_parallel_optimized
+        # queries (`Y`) index rows, the search space (`X`) columns
+        values, (rows, cols) = topk_balltree_combined_tree_parallel_optimized(
+            Xj, Xi, k=min(k, Xi.shape[1] * Xj.shape[1]), query_sort=True, n_jobs=n_jobs,
+            argtopk_method="argpartition", require_sorted_topk=False, handle_zero_variance=None)
+        return values, (rows, cols)
+
+    raise ValueError(f"Unknown kernel: {kernel}")
+
+
+def threshold_kernel(Xi, Xj, threshold, kernel="matmul", n_jobs=1):
+    """Thresholded correlations between the (normalized) columns of `Xi` (rows) and `Xj` (columns)."""
+
+    if kernel == "matmul":
+        cor = Xi.T @ Xj
+        rows, cols = np.nonzero(np.abs(cor) > threshold)
+        return cor[rows, cols], (rows, cols)
+
+    elif kernel == "balltree":
+        from corals.correlation.threshold._deprecated import original
+        if n_jobs == 1:
+            values, (rows, cols) = original.cor_threshold_balltree_combined_tree(Xj, Xi, threshold=threshold)
+        else:
+            values, (rows, cols) = original.cor_threshold_balltree_combined_query_parallel(
+                Xj, Xi, threshold=threshold, n_jobs=n_jobs)
+        return values, (rows, cols)
+
+    raise ValueError(f"Unknown kernel: {kernel}")
+
+
+class TopkBuffer():
+    """
+    Bounded buffer of the `k` largest absolute values seen so far.
+
+    Candidates are appended until the buffer holds `2 k` values and then partitioned down to `k`
+    (`np.argpartition`), which bounds memory like a heap but merges whole blocks at a time.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.values = np.empty(2 * k, dtype=np.float64)
+        self.rows = np.empty(2 * k, dtype=np.int64)
+        self.cols = np.empty(2 * k, dtype=np.int64)
+        self.size = 0
+
+    def add(self, values, rows, cols):
+        if self.k == 0:
+            return
+        start = 0
+        while start < len(values):
+            n = min(len(values) - start, 2 * self.k - self.size)
+            self.values[self.size:self.size + n] = values[start:start + n]
+            self.rows[self.size:self.size + n] = rows[start:start + n]
+            self.cols[self.size:self.size + n] = cols[start:start + n]
+            self.size += n
+            start += n
+            if self.size == 2 * self.k:
+                self.shrink()
+
+    def shrink(self):
+        if self.size <= self.k:
+            return
+        keep = np.argpartition(-np.abs(self.values[:self.size]), self.k - 1)[:self.k]
+        for a in (self.values, self.rows, self.cols):
+            a[:self.k] = a[keep]
+        self.size = self.k
+
+    def result(self):
+        self.shrink()
+        order = np.argsort(-np.abs(self.values[:self.size]), kind="stable")
+        return self.values[order], (self.rows[order], self.cols[order])
+
+
+def iterate_block_pairs(X, block_size, mean, scale, reading):
+    """Yields `(i_start, i_stop, j_start, j_stop, Xi, Xj)` with normalized blocks for all block pairs `i <= j`."""
+
+    n = X.shape[1]
+    starts = list(range(0, n, block_size))
+    for i_start in starts:
+        i_stop = min(n, i_start + block_size)
+        Xi = load_block(X, i_start, i_stop, mean, scale, reading)
+        for j_start in starts:
+            if j_start < i_start:
+                continue
+            j_stop = min(n, j_start + block_size)
+            Xj = Xi if j_start == i_start else load_block(X, j_start, j_stop, mean, scale, reading)
+            yield i_start, i_stop, j_start, j_stop, Xi, Xj
+            del Xj
+
+
+def derive_reading(X):
+    """Chunk size and `madvise` hint for reading blocks of `X` (see `coralsarticle.data.blocked.load_recommendation`)."""
+    recommendation = blocked.load_recommendation(layout="F" if X.flags.f_contiguous else "C", axis="columns")
+    return dict(block_bytes=recommendation["block_bytes"], advice=recommendation["advice"])
+
+
+def load_block(X, start, stop, mean, scale, reading):
+    """Reads columns `start:stop` and normalizes them (zero mean, unit norm)."""
+    block = blocked.read_block(X, start, stop, **reading)
+    block -= mean[start:stop]
+    block /= scale[start:stop]
+    return block
+
+
+def column_stats(X, block_size, reading):
+    """Column means and norms (after centering) in one pass over column blocks."""
+
+    n = X.shape[1]
+    mean = np.empty(n)
+    scale = np.empty(n)
+    for start in range(0, n, block_size):
+        stop = min(n, start + block_size)
+        block = blocked.read_block(X, start, stop, **reading)
+        mean[start:stop] = block.mean(axis=0)
+        block -= mean[start:stop]
+        scale[start:stop] = np.sqrt(np.einsum("ij,ij->j", block, block))
+    # constant columns have no defined correlation; keep them finite
+    scale[scale == 0] = 1
+    return mean, scale
+
+
+def derive_block_size(m, n, k=0, block_size=None, memory_budget=None):
+    """
+    Number of columns per block such that two (normalized) blocks, the correlations of a block pair
+    including the kernel's temporaries, and the top-k buffer fit into `memory_budget`
+    (bytes; default: a quarter of the available memory).
+    """
+
+    if block_size is not None:
+        return int(min(n, max(1, block_size)))
+
+    if memory_budget is None:
+        memory_budget = derive_memory_available() // 4
+
+    # top-k buffer (2k) and the kernel's top-k (k): (value, row, col)
+    budget = memory_budget - 3 * k * 24
+    # two blocks (2 m b) plus correlations and the kernel's temporaries (4 b^2), 8 bytes each:
+    # top-k: signs and partition indices (`topk_kernel`);
+    # threshold: mask and, at worst, (value, row, col) for all correlations (`threshold_kernel`)
+    a, b, c = 4 * 8, 2 * m * 8, -budget
+    block_size = int((-b + np.sqrt(b * b - 4 * a * c)) / (2 * a)) if budget > 0 else 1
+    return int(min(n, max(1, block_size)))
+
+
+def derive_memory_available():
+    """Available memory in bytes (`MemAvailable`; Linux only); total physical memory otherwise."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import os
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
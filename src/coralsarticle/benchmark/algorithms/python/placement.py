@@ -0,0 +1,282 @@
+"""
+CPU affinity and NUMA memory placement for `benchmark.py`.
+
+Placement policies select the CPUs an experiment may use (based on `/sys/devices/system/cpu` and `/sys/devices/system/node`):
+
+* `none`: no pinning
+* `compact`: physical cores of one NUMA node after the other (SMT siblings only once all cores are used)
+* `scatter`: physical cores round-robin across NUMA nodes (SMT siblings only once all cores are used)
+* an explicit CPU list, e.g., `0-7,16-23`
+
+The benchmark process is pinned to the selected CPUs via `sched_setaffinity`,
+which is inherited by its threads (e.g., BLAS) and child processes.
+joblib's worker processes are additionally pinned to disjoint slices of the selected CPUs (see `pin_joblib_workers`),
+so the threads of one worker do not compete with the threads of other workers;
+workers for which no slice is left stay unpinned (reported as `placement_unpinned_workers`, see `describe`).
+With `bind_threads`, OpenMP threads are bound to single CPUs via `OMP_PLACES` and `OMP_PROC_BIND`;
+this only takes effect before the OpenMP runtime is loaded (i.e., not for worker children, see `worker.py`).
+
+Memory placement policies (`set_mempolicy`; inherited by child processes):
+
+* `default`: the system's default policy
+* `first_touch`: allocate memory on the node of the CPU that first touches it
+* `interleave`: interleave memory across the nodes of the selected CPUs
+* `bind`: only allocate memory on the nodes of the selected CPUs
+
+Placements assume that experiments run exclusively, i.e., are not packed with other jobs (see `resources.py`).
+"""
+import collections
+import contextlib
+import ctypes
+import os
+import pathlib
+import shutil
+import tempfile
+
+
+PLACEMENT_POLICIES = ["none", "compact", "scatter"]
+MEMORY_POLICIES = ["default", "first_touch", "interleave", "bind"]
+
+# see `man set_mempolicy`
+MPOL_DEFAULT = 0
+MPOL_BIND = 2
+MPOL_INTERLEAVE = 3
+MPOL_LOCAL = 4
+SYS_SET_MEMPOLICY = {"x86_64": 238, "aarch64": 237, "ppc64le": 261}
+
+
+Cpu = collections.namedtuple("Cpu", ["cpu", "core", "package", "node"])
+
+Placement = collections.namedtuple("Placement", ["policy", "cpus", "nodes", "memory", "bind_threads"])
+
+
+def read_topology(sys_dir="/sys/devices/system"):
+    """Returns the CPUs available to this process (see `os.sched_getaffinity`) with core, package and NUMA node."""
+
+    sys_dir = pathlib.Path(sys_dir)
+
+    nodes = {}
+    for path in sorted(sys_dir.glob("node/node[0-9]*")):
+        for cpu in parse_cpulist((path / "cpulist").read_text()):
+            nodes[cpu] = int(path.name[4:])
+
+    cpus = []
+    for cpu in sorted(os.sched_getaffinity(0)):
+        topology = sys_dir / "cpu" / f"cpu{cpu}" / "topology"
+        cpus.append(Cpu(
+            cpu=cpu,
+            core=read_int(topology / "core_id", cpu),
+            package=read_int(topology / "physical_package_id", 0),
+            node=nodes.get(cpu, 0)))
+    return cpus
+
+
+def read_int(path, default):
+    try:
+        return int(path.read_text().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def parse_cpulist(cpulist):
+    """Parses CPU lists like `0-3,8,10-11`."""
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            start, stop = part.split("-")
+            cpus.extend(range(int(start), int(stop) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """Formats CPUs as CPU list (see `parse_cpulist`)."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if len(ranges) > 0 and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def derive_placement(policy, n_cpus, memory="default", bind_threads=False, topology=None):
+    """Selects `n_cpus` CPUs according to the given policy (see module documentation)."""
+
+    if memory not in MEMORY_POLICIES:
+        raise ValueError(f"Unknown memory placement: {memory}")
+    if topology is None:
+        topology = read_topology()
+
+    if policy is None or policy == "none":
+        selected = topology
+    elif policy in ("compact", "scatter"):
+        # rank of each CPU among its SMT siblings and rank of its core within its node
+        smt_rank = {}
+        core_rank = {}
+        n_smt = collections.Counter()
+        n_cores = collections.Counter()
+        for c in sorted(topology, key=lambda c: (c.node, c.package, c.core, c.cpu)):
+            core = (c.node, c.package, c.core)
+            if core not in core_rank:
+                core_rank[core] = n_cores[c.node]
+                n_cores[c.node] += 1
+            smt_rank[c.cpu] = n_smt[core]
+            n_smt[core] += 1
+        if policy == "compact":
+            key = lambda c: (smt_rank[c.cpu], c.node, core_rank[(c.node, c.package, c.core)])
+        else:
+            key = lambda c: (smt_rank[c.cpu], core_rank[(c.node, c.package, c.core)], c.node)
+        selected = sorted(topology, key=key)[:n_cpus]
+    else:
+        available = {c.cpu: c for c in topology}
+        cpus = parse_cpulist(str(policy))
+        missing = [c for c in cpus if c not in available]
+        if len(missing) > 0:
+            raise ValueError(f"CPUs not available: {format_cpulist(missing)}")
+        selected = [available[c] for c in cpus]
+
+    if len(selected) < n_cpus:
+        print(f"WARNING: Only {len(selected)} CPUs available for {n_cpus} threads/jobs")
+
+    return Placement(
+        policy="none" if policy is None else str(policy),
+        cpus=[c.cpu for c in selected],
+        nodes=sorted(set(c.node for c in selected)),
+        memory=memory,
+        bind_threads=bind_threads)
+
+
+def apply(placement):
+    """Pins this process (and thus its future threads and child processes) and sets its memory policy."""
+
+    if placement.policy != "none":
+        os.sched_setaffinity(0, placement.cpus)
+        if placement.bind_threads:
+            set_omp_places(placement.cpus, "close" if placement.policy != "scatter" else "spread")
+
+    if placement.memory != "default":
+        mode = dict(first_touch=MPOL_LOCAL, interleave=MPOL_INTERLEAVE, bind=MPOL_BIND)[placement.memory]
+        set_mempolicy(mode, [] if mode == MPOL_LOCAL else placement.nodes)
+
+
+def set_omp_places(cpus, proc_bind):
+    os.environ["OMP_PLACES"] = ",".join(f"{{{c}}}" for c in cpus)
+    os.environ["OMP_PROC_BIND"] = proc_bind
+
+
+def set_mempolicy(mode, nodes):
+    import platform
+
+    syscall_nr = SYS_SET_MEMPOLICY.get(platform.machine())
+    if syscall_nr is None:
+        raise OSError(f"set_mempolicy is not supported on {platform.machine()}")
+
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    n_words = max(nodes, default=0) // bits + 1
+    nodemask = (ctypes.c_ulong * n_words)()
+    for node in nodes:
+        nodemask[node // bits] |= 1 << (node % bits)
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+    result = libc.syscall(
+        syscall_nr, ctypes.c_int(mode), nodemask if len(nodes) > 0 else None, ctypes.c_ulong(n_words * bits + 1))
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"set_mempolicy failed: {os.strerror(errno)}")
+
+
+def describe(placement, unpinned_workers=0):
+    """Placement as attributes of a result (see `benchmark.py`); `unpinned_workers` as counted by `pin_joblib_workers`."""
+    return collections.OrderedDict(
+        placement_policy=placement.policy,
+        placement_cpus=format_cpulist(placement.cpus),
+        placement_nodes=format_cpulist(placement.nodes),
+        placement_unpinned_workers=unpinned_workers,
+        memory_placement=placement.memory,
+        bind_threads=placement.bind_threads)
+
+
+@contextlib.contextmanager
+def pin_joblib_workers(placement):
+    """
+    Pins each of joblib's process-based (loky) workers to its own slice of the selected CPUs.
+
+    The worker initializer is injected where joblib creates its executors,
+    so experiments keep their choice of backend (e.g., `prefer="threads"`).
+    Yields a list that holds the process ids of workers left unpinned (see `pin_worker`) on exit.
+    """
+
+    from joblib import _parallel_backends
+
+    unpinned = []
+    if placement.policy == "none":
+        yield unpinned
+        return
+
+    claim_dir = tempfile.mkdtemp(prefix="coralsarticle-placement-")
+    get_memmapping_executor = _parallel_backends.get_memmapping_executor
+
+    def get_pinned_executor(n_jobs, **kwargs):
+        if kwargs.get("initializer") is None:
+            kwargs.update(initializer=pin_worker, initargs=(placement.cpus, claim_dir, placement.bind_threads))
+        return get_memmapping_executor(n_jobs, **kwargs)
+
+    _parallel_backends.get_memmapping_executor = get_pinned_executor
+    try:
+        yield unpinned
+    finally:
+        _parallel_backends.get_memmapping_executor = get_memmapping_executor
+        unpinned.extend(int(path.name.split("-")[1]) for path in pathlib.Path(claim_dir).glob("unpinned-*"))
+        shutil.rmtree(claim_dir, ignore_errors=True)
+
+
+def pin_worker(cpus, claim_dir, bind_threads):
+    """
+    Initializer of joblib workers: claims a free slice of `cpus`
+    (sized by the number of threads joblib grants each worker, see `OMP_NUM_THREADS`) and pins the worker to it.
+    Slices of terminated workers are reused.
+    If all slices are taken (more workers than slices), the worker is left unpinned
+    (i.e., it may use all of `cpus`) and recorded in `claim_dir`.
+    """
+
+    n_threads = max(1, min(len(cpus), int(os.environ.get("OMP_NUM_THREADS", "1"))))
+    n_slots = max(1, len(cpus) // n_threads)
+
+    slot = claim_slot(claim_dir, n_slots)
+    if slot is None:
+        print(f"WARNING: No free slice of {n_threads} CPUs for worker {os.getpid()}; leaving it unpinned")
+        with open(os.path.join(claim_dir, f"unpinned-{os.getpid()}"), "w"):
+            pass
+        return
+    worker_cpus = cpus[slot * n_threads:(slot + 1) * n_threads]
+
+    os.sched_setaffinity(0, worker_cpus)
+    if bind_threads:
+        set_omp_places(worker_cpus, "close")
+
+
+def claim_slot(claim_dir, n_slots):
+    for slot in range(n_slots):
+        path = os.path.join(claim_dir, str(slot))
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # take over slots of terminated workers
+            try:
+                with open(path, "r") as f:
+                    pid = int(f.read() or 0)
+                os.kill(pid, 0)
+                continue
+            except (ProcessLookupError, ValueError):
+                fd = os.open(path, os.O_WRONLY | os.O_TRUNC)
+            except OSError:
+                continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return slot
+    return None
@@ -0,0 +1,119 @@
+"""
+Decorator-based experiment registry.
+
+Experiments are registered by name template and parameter grid, e.g.:
+
+```python
+@experiment("topk_batch_balltree_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def topk_batch_balltree(X, k, n_jobs, **kwargs):
+    return init, [X], dict(k=k, n_jobs=n_jobs)
+```
+
+The decorated function returns a tuple `(init_func, args, kwargs)`,
+where `init_func()` returns the function to benchmark.
+Algorithm modules must only be imported within `init_func` (see `import_function`),
+so loading the registry is cheap and only the selected experiment's module is imported.
+
+Grids are only expanded on demand:
+an experiment is looked up by matching its name against the name templates,
+so integer parameters (e.g., `n_jobs`) also accept values outside their grid.
+A grid can either be a list of values or a dict mapping name fragments to values,
+e.g., `backend={"": None, "_threads": "threads"}`.
+"""
+import collections
+import functools
+import importlib
+import itertools
+import re
+import string
+
+
+N_JOBS_RANGE = [1, 2, 4, 8, 16, 32, 64]
+
+
+Template = collections.namedtuple("Template", ["name", "grid", "factory", "regex"])
+
+
+TEMPLATES = collections.OrderedDict()
+
+
+def experiment(name, **grid):
+    """Registers an experiment (template); see module documentation."""
+
+    def decorator(factory):
+        if name in TEMPLATES:
+            raise ValueError(f"Experiment already registered: {name}")
+        TEMPLATES[name] = Template(name=name, grid=grid, factory=factory, regex=derive_regex(name, grid))
+        return factory
+
+    return decorator
+
+
+def import_function(module, name):
+    return getattr(importlib.import_module(module), name)
+
+
+def init_function(module, name):
+    """Returns an `init_func` that imports the function `name` from `module` when called."""
+    return functools.partial(import_function, module, name)
+
+
+def derive_regex(name, grid):
+
+    pattern = ""
+    for literal, field, _, _ in string.Formatter().parse(name):
+        pattern += re.escape(literal)
+        if field is None:
+            continue
+        if field not in grid:
+            raise ValueError(f"No grid given for parameter '{field}' of experiment: {name}")
+        values = grid[field]
+        if isinstance(values, dict):
+            fragments = values.keys()
+        elif all(isinstance(v, int) for v in values):
+            fragments = None
+        else:
+            fragments = [str(v) for v in values]
+        if fragments is None:
+            pattern += rf"(?P<{field}>\d+)"
+        else:
+            # longest first to avoid matching prefixes
+            pattern += f"(?P<{field}>" + "|".join(re.escape(f) for f in sorted(fragments, key=len, reverse=True)) + ")"
+
+    return re.compile(pattern)
+
+
+def match(name):
+    """Returns the template and parameters matching the given experiment name."""
+
+    for template in TEMPLATES.values():
+        m = template.regex.fullmatch(name)
+        if m is None:
+            continue
+        params = {}
+        for field, fragment in m.groupdict().items():
+            values = template.grid[field]
+            if isinstance(values, dict):
+                params[field] = values[fragment]
+            elif all(isinstance(v, int) for v in values):
+                params[field] = int(fragment)
+            else:
+                params[field] = values[[str(v) for v in values].index(fragment)]
+        return template, params
+
+    raise KeyError(f"Unknown experiment: {name}")
+
+
+def expand(template):
+    """Expands the grid of a template into `(name, params)` tuples."""
+
+    fields = list(template.grid.keys())
+    grids = [
+        list(template.grid[f].items()) if isinstance(template.grid[f], dict)
+        else [(str(v), v) for v in template.grid[f]]
+        for f in fields]
+
+    for combination in itertools.product(*grids):
+        name = template.name.format(**{f: fragment for f, (fragment, _) in zip(fields, combination)})
+        params = {f: value for f, (_, value) in zip(fields, combination)}
+        yield name, params
@@ -1,26 +1,25 @@
-import collections
-
-import corals.correlation.full.baselines as baselines
-import corals.correlation.full.matmul as matmul
-
-
-def load_experiments(X, **kwargs):
-
-    return collections.OrderedDict([
-        ("cor_corrcoef", (
-            lambda: baselines.full_corrcoef, 
-            [X], 
-            {})),
-        ("cor_matrix_symmetrical", (
-            lambda: matmul.full_matmul_symmetrical, 
-            [X], 
-            {})),
-        ("cor_matrix_symmetrical_nocopy", (
-            lambda: matmul.full_matmul_symmetrical, 
-            [X],
-            dict(avoid_copy=True))),
-        ("cor_matrix_asymmetrical", (
-            lambda: matmul.full_matmul_asymmetrical, 
-            [X], 
-            {})),
-    ])
+from registry.base import experiment, init_function
+
+
+BASELINES = "corals.correlation.full.baselines"
+MATMUL = "corals.correlation.full.matmul"
+
+
+@experiment("cor_corrcoef")
+def cor_corrcoef(X, **kwargs):
+    return init_function(BASELINES, "full_corrcoef"), [X], {}
+
+
+@experiment("cor_matrix_symmetrical")
+def cor_matrix_symmetrical(X, **kwargs):
+    return init_function(MATMUL, "full_matmul_symmetrical"), [X], {}
+
+
+@experiment("cor_matrix_symmetrical_nocopy")
+def cor_matrix_symmetrical_nocopy(X, **kwargs):
+    return init_function(MATMUL, "full_matmul_symmetrical"), [X], dict(avoid_copy=True)
+
+
+@experiment("cor_matrix_asymmetrical")
+def cor_matrix_asymmetrical(X, **kwargs):
+    return init_function(MATMUL, "full_matmul_asymmetrical"), [X], {}
@@ -0,0 +1,15 @@
+from registry.base import experiment, init_function, N_JOBS_RANGE
+
+
+# local Dask / Spark clusters started within the experiment (see `local_cluster.py`)
+LOCAL_CLUSTER = "local_cluster"
+
+
+@experiment("topk_{framework}_parallel_{n_jobs}", framework=["dask", "spark"], n_jobs=N_JOBS_RANGE)
+def topk_local_cluster(X, k, framework, n_jobs, **kwargs):
+    return init_function(LOCAL_CLUSTER, f"topk_{framework}"), [X], dict(k=k, n_jobs=n_jobs)
+
+
+@experiment("threshold_{framework}_parallel_{n_jobs}", framework=["dask", "spark"], n_jobs=N_JOBS_RANGE)
+def threshold_local_cluster(X, threshold, framework, n_jobs, **kwargs):
+    return init_function(LOCAL_CLUSTER, f"threshold_{framework}"), [X], dict(threshold=threshold, n_jobs=n_jobs)
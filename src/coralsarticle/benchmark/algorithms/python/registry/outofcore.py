@@ -0,0 +1,28 @@
+from registry.base import experiment, init_function, N_JOBS_RANGE
+
+
+# streaming over column blocks of memory-mapped data (see `outofcore.py`)
+OUTOFCORE = "outofcore"
+
+
+@experiment("topk_outofcore_{kernel}", kernel=["matmul", "balltree"])
+def topk_outofcore(X, k, kernel, **kwargs):
+    return init_function(OUTOFCORE, "topk_outofcore"), [X], dict(k=k, kernel=kernel)
+
+
+@experiment("topk_outofcore_balltree_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def topk_outofcore_balltree_parallel(X, k, n_jobs, **kwargs):
+    return init_function(OUTOFCORE, "topk_outofcore"), [X], dict(k=k, kernel="balltree", n_jobs=n_jobs)
+
+
+@experiment("threshold_outofcore_{kernel}", kernel=["matmul", "balltree"])
+def threshold_outofcore(X, threshold, kernel, **kwargs):
+    return init_function(OUTOFCORE, "threshold_outofcore"), [X], dict(threshold=threshold, kernel=kernel)
+
+
+@experiment("threshold_outofcore_balltree_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def threshold_outofcore_balltree_parallel(X, threshold, n_jobs, **kwargs):
+    return (
+        init_function(OUTOFCORE, "threshold_outofcore"), 
+        [X], 
+        dict(threshold=threshold, kernel="balltree", n_jobs=n_jobs))
@@ -1,37 +1,34 @@
-import collections
-
-import corals.correlation.threshold._deprecated.original as deprecated
-
-
-def load_experiments(X, **kwargs):
-
-    threshold = kwargs["threshold"]
-    n_jobs_range = [1,2,4,8,16,32,64]
-
-    return collections.OrderedDict([
-
-        # thresholds
-        ("threshold_matrix", (
-            lambda: deprecated.cor_threshold_matrix_symmetrical, 
-            [X], 
-            dict(threshold=threshold))),
-        ("threshold_balltree_combined_tree", (
-            lambda: deprecated.cor_threshold_balltree_combined_tree, 
-            [X], 
-            dict(threshold=threshold))),
-        ("threshold_balltree_combined_query", (
-            lambda: deprecated.cor_threshold_balltree_combined_query, 
-            [X], 
-            dict(threshold=threshold))),
-        ("threshold_balltree_twice", (
-            lambda: deprecated.cor_threshold_balltree_twice, 
-            [X], 
-            dict(threshold=threshold))),
-            
-        *[(f"threshold_balltree_combined_query_parallel_{n}", (
-            lambda: deprecated.cor_threshold_balltree_combined_query_parallel, 
-            [X], 
-            dict(threshold=threshold, n_jobs=n)))
-            for n in n_jobs_range],
-
-    ])
\ No newline at end of file
+from registry.base import experiment, init_function, N_JOBS_RANGE
+
+
+ORIGINAL = "corals.correlation.threshold._deprecated.original"
+
+
+# thresholds
+
+@experiment("threshold_matrix")
+def threshold_matrix(X, threshold, **kwargs):
+    return init_function(ORIGINAL, "cor_threshold_matrix_symmetrical"), [X], dict(threshold=threshold)
+
+
+@experiment("threshold_balltree_combined_tree")
+def threshold_balltree_combined_tree(X, threshold, **kwargs):
+    return init_function(ORIGINAL, "cor_threshold_balltree_combined_tree"), [X], dict(threshold=threshold)
+
+
+@experiment("threshold_balltree_combined_query")
+def threshold_balltree_combined_query(X, threshold, **kwargs):
+    return init_function(ORIGINAL, "cor_threshold_balltree_combined_query"), [X], dict(threshold=threshold)
+
+
+@experiment("threshold_balltree_twice")
+def threshold_balltree_twice(X, threshold, **kwargs):
+    return init_function(ORIGINAL, "cor_threshold_balltree_twice"), [X], dict(threshold=threshold)
+
+
+@experiment("threshold_balltree_combined_query_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def threshold_balltree_combined_query_parallel(X, threshold, n_jobs, **kwargs):
+    return (
+        init_function(ORIGINAL, "cor_threshold_balltree_combined_query_parallel"), 
+        [X], 
+        dict(threshold=threshold, n_jobs=n_jobs))
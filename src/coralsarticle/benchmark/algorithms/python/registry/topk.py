@@ -1,208 +1,155 @@
-import collections
 import functools
 
+from registry.base import experiment, init_function, N_JOBS_RANGE
 
-def load_experiments(X, **kwargs):
-
-    k = kwargs["k"]
-    threshold = kwargs["threshold"]
-    n_jobs_range = [1, 2, 4, 8, 16, 32, 64]
-
-    experiments = collections.OrderedDict()
-
-    def init_original(name):
-        import corals.correlation.topk._deprecated.original as original
-        return original.__dict__[name]
-
-    experiments["topk_corrcoef"] = (
-        functools.partial(init_original, "topk_corcoeff"), 
-        [X], dict(k=k))
-    experiments["topk_matrix"] = (
-        functools.partial(init_original, "topk_matrix"), 
-        [X], dict(k=k))
-    experiments["topk_partition"] = (
-        functools.partial(init_original, "topk_matrix"), 
-        [X], dict(k=k, sorting="partition"))
-    experiments["topk_balltree_twice"] = (
-        functools.partial(init_original, "topk_balltree_twice"), 
-        [X], dict(k=k))
-    experiments["topk_balltree_combined_tree"] = (
-        functools.partial(init_original, "topk_balltree_combined_tree"), 
-        [X], dict(k=k))
-    experiments["topk_balltree_combined_query"] = (
-        functools.partial(init_original, "topk_balltree_combined_query"), 
-        [X], dict(k=k))
-
-
-    # Does not seem to make a memory difference, so drop it.
-    experiments["topk_balltree_combined_tree_no-dual"] = (
-            functools.partial(init_original, "topk_balltree_combined_tree"), 
-            [X], 
-            dict(k=k, dualtree=False))
-    experiments["topk_balltree_combined_query_no-dual"] = (
-            functools.partial(init_original, "topk_balltree_combined_query"), 
-            [X], 
-            dict(k=k, dualtree=False))
-    experiments["topk_balltree_twice_no-dual"] = (
-            functools.partial(init_original, "topk_balltree_twice"),
-            [X], 
-            dict(k=k, dualtree=False))
-        
-    # parallel query
-    for n in n_jobs_range:
-        experiments[f"topk_balltree_combined_query_parallel_{n}"] = (
-            functools.partial(init_original, "topk_balltree_combined_query_parallel"), 
-            [X], 
-            dict(k=k, n_jobs=n))
-
-    # parallel tree
-    for n in n_jobs_range:
-        experiments[f"topk_balltree_combined_tree_parallel_{n}"] = (
-            functools.partial(init_original, "topk_balltree_combined_tree_parallel"), 
-            [X], 
-            dict(k=k, n_jobs=n))
-        
-    # tree - optimized
-    experiments["topk_balltree_combined_tree_optimized"] = (
-        functools.partial(init_original, "topk_balltree_combined_tree_parallel_optimized"),
+
+ORIGINAL = "corals.correlation.topk._deprecated.original"
+
+
+@experiment("topk_corrcoef")
+def topk_corrcoef(X, k, **kwargs):
+    return init_function(ORIGINAL, "topk_corcoeff"), [X], dict(k=k)
+
+
+@experiment("topk_matrix")
+def topk_matrix(X, k, **kwargs):
+    return init_function(ORIGINAL, "topk_matrix"), [X], dict(k=k)
+
+
+@experiment("topk_partition")
+def topk_partition(X, k, **kwargs):
+    return init_function(ORIGINAL, "topk_matrix"), [X], dict(k=k, sorting="partition")
+
+
+# Not using the dual tree does not seem to make a memory difference.
+@experiment(
+    "topk_balltree_{variant}{dualtree}", 
+    variant=["twice", "combined_tree", "combined_query"], 
+    dualtree={"": True, "_no-dual": False})
+def topk_balltree(X, k, variant, dualtree, **kwargs):
+    return init_function(ORIGINAL, f"topk_balltree_{variant}"), [X], dict(k=k, dualtree=dualtree)
+
+
+# parallel query / tree
+@experiment(
+    "topk_balltree_combined_{variant}_parallel_{n_jobs}", 
+    variant=["query", "tree"], 
+    n_jobs=N_JOBS_RANGE)
+def topk_balltree_combined_parallel(X, k, variant, n_jobs, **kwargs):
+    return init_function(ORIGINAL, f"topk_balltree_combined_{variant}_parallel"), [X], dict(k=k, n_jobs=n_jobs)
+
+
+# tree - optimized
+@experiment("topk_balltree_combined_tree_optimized")
+def topk_balltree_combined_tree_optimized(X, k, **kwargs):
+    return (
+        init_function(ORIGINAL, "topk_balltree_combined_tree_parallel_optimized"), 
         [X], 
         dict(k=k, n_jobs=1))
 
-    # tree - optimized - parallel
-    for n in n_jobs_range:
-        experiments[f"topk_balltree_combined_tree_optimized_parallel_{n}"] = (
-            functools.partial(init_original, "topk_balltree_combined_tree_parallel_optimized"),
-            [X], 
-            dict(
-                k=k, 
-                query_sort=True, 
-                n_jobs=n))
-
-    for n in n_jobs_range:
-        experiments[f"topk_balltree_combined_tree_optimized_partition_parallel_{n}"] = (
-            functools.partial(init_original, "topk_balltree_combined_tree_parallel_optimized"), 
-            [X], 
-            dict(
-                k=k, 
-                query_sort=True, 
-                argtopk_method="argpartition", 
-                n_jobs=n))
-
-    for n in n_jobs_range:
-        experiments[f"topk_balltree_combined_tree_optimized_direct_parallel_{n}"] = (
-            functools.partial(init_original, "topk_balltree_combined_tree_parallel_optimized"),
-            [X], 
-            dict(
-                k=k, 
-                query_sort=True, 
-                n_jobs=n, 
-                n_jobs_transfer_mode="direct"))
-
-    ###
-    # new comparisons based on batch paradigm
-    ###
-
-    def init_balltree():
-        from corals.correlation.topk.batched.base import topk_batched_generic
-        from corals.correlation.topk.batched.nearest_neighbors_balltree import BalltreeTopkMapReduce
-        return functools.partial(topk_batched_generic, mapreduce=BalltreeTopkMapReduce())
-
-    for n_jobs in n_jobs_range:
-
-        experiments[f"topk_batch_balltree_parallel_{n_jobs}"] = (
-            init_balltree, 
-            [X],
-            dict(
-                threshold=None,
-                k=k,
-                #
-                approximation_factor=10,
-                n_batches=n_jobs,
-                n_jobs=n_jobs,
-            ))
-
-    for n_jobs in n_jobs_range:
-
-        def init():
-            from corals.correlation.topk.batched.base import topk_batched_generic
-            from corals.correlation.topk.batched.nearest_neighbors_ann_ngt import NgtTopkMapReduce
-            return functools.partial(
-                topk_batched_generic, 
-                mapreduce=NgtTopkMapReduce(
-                    n_threads_build_index=n_jobs),
-            )
-        
-        experiments[f"topk_batch_ngt_parallel_{n_jobs}"] = (
-            init, 
-            [X],
-            dict(
-                threshold=None,
-                k=k,
-                #
-                approximation_factor=10,
-                n_batches=n_jobs,
-                n_jobs=n_jobs))
-
-    for n_jobs in n_jobs_range:
-
-        def init():
-            from corals.correlation.topk.batched.base import topk_batched_generic
-            from corals.correlation.topk.batched.nearest_neighbors_ann_nmslib import NmslibTopkMapReduce
-            return functools.partial(
-                topk_batched_generic, 
-                mapreduce=NmslibTopkMapReduce(
-                    # n_threads_build_index=n_jobs
-                )
-            )
-
-        experiments[f"topk_batch_nmslib_parallel_{n_jobs}"] = (
-            init, 
-            [X],
-            dict(
-                threshold=None,
-                k=k,
-                #
-                approximation_factor=10,
-                n_batches=n_jobs,
-                n_jobs=n_jobs,
-                # preferred_backend="threads",  # does not really work for nmslib it seems
-            ))
-
-    def init_matmul():
-        from corals.correlation.topk.batched.base import topk_batched_generic
-        from corals.correlation.topk.batched.matmul import MatmulTopkMapReduce
-        return functools.partial(
-            topk_batched_generic, 
-            mapreduce=MatmulTopkMapReduce()
-        )
-
-    for n_jobs in n_jobs_range:
-
-        experiments[f"topk_batch_matmul_parallel_{n_jobs}"] = (
-            init_matmul, 
-            [X],
-            dict(
-                threshold=None,
-                k=k,
-                #
-                approximation_factor=10,
-                n_batches=n_jobs,
-                n_jobs=n_jobs
-            ))
-
-    for n_jobs in n_jobs_range:
-
-        experiments[f"topk_batch_matmul_threads_parallel_{n_jobs}"] = (
-            init_matmul, 
-            [X],
-            dict(
-                threshold=None,
-                k=k,
-                #
-                approximation_factor=10,
-                n_batches=n_jobs,
-                n_jobs=n_jobs,
-                preferred_backend="threads",
-            ))
-    
-    return experiments
+
+# tree - optimized - parallel
+@experiment(
+    "topk_balltree_combined_tree_optimized{argtopk_method}_parallel_{n_jobs}", 
+    argtopk_method={"": None, "_partition": "argpartition"},
+    n_jobs=N_JOBS_RANGE)
+def topk_balltree_combined_tree_optimized_parallel(X, k, argtopk_method, n_jobs, **kwargs):
+    exp_kwargs = dict(k=k, query_sort=True, n_jobs=n_jobs)
+    if argtopk_method is not None:
+        exp_kwargs["argtopk_method"] = argtopk_method
+    return init_function(ORIGINAL, "topk_balltree_combined_tree_parallel_optimized"), [X], exp_kwargs
+
+
+@experiment("topk_balltree_combined_tree_optimized_direct_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def topk_balltree_combined_tree_optimized_direct_parallel(X, k, n_jobs, **kwargs):
+    return (
+        init_function(ORIGINAL, "topk_balltree_combined_tree_parallel_optimized"), 
+        [X], 
+        dict(
+            k=k, 
+            query_sort=True, 
+            n_jobs=n_jobs, 
+            n_jobs_transfer_mode="direct"))
+
+
+###
+# new comparisons based on batch paradigm
+###
+
+def init_batched(mapreduce_module, mapreduce_class, **mapreduce_kwargs):
+    from corals.correlation.topk.batched.base import topk_batched_generic
+    from registry.base import import_function
+    mapreduce = import_function(mapreduce_module, mapreduce_class)
+    return functools.partial(topk_batched_generic, mapreduce=mapreduce(**mapreduce_kwargs))
+
+
+def batched_kwargs(k, n_jobs, approximation_factor=10, **kwargs):
+    return dict(
+        threshold=None,
+        k=k,
+        #
+        approximation_factor=approximation_factor,
+        n_batches=n_jobs,
+        n_jobs=n_jobs,
+        **kwargs)
+
+
+@experiment("topk_batch_balltree_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def topk_batch_balltree(X, k, n_jobs, **kwargs):
+    return (
+        functools.partial(
+            init_batched, 
+            "corals.correlation.topk.batched.nearest_neighbors_balltree", "BalltreeTopkMapReduce"),
+        [X],
+        batched_kwargs(k, n_jobs))
+
+
+@experiment(
+    "topk_batch_balltree_approx-{approximation_factor}_parallel_{n_jobs}", 
+    approximation_factor=[1, 2, 5, 10, 20], 
+    n_jobs=N_JOBS_RANGE)
+def topk_batch_balltree_approx(X, k, approximation_factor, n_jobs, **kwargs):
+    return (
+        functools.partial(
+            init_batched, 
+            "corals.correlation.topk.batched.nearest_neighbors_balltree", "BalltreeTopkMapReduce"),
+        [X],
+        batched_kwargs(k, n_jobs, approximation_factor=approximation_factor))
+
+
+@experiment("topk_batch_ngt_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def topk_batch_ngt(X, k, n_jobs, **kwargs):
+    return (
+        functools.partial(
+            init_batched, 
+            "corals.correlation.topk.batched.nearest_neighbors_ann_ngt", "NgtTopkMapReduce",
+            n_threads_build_index=n_jobs),
+        [X],
+        batched_kwargs(k, n_jobs))
+
+
+@experiment("topk_batch_nmslib_parallel_{n_jobs}", n_jobs=N_JOBS_RANGE)
+def topk_batch_nmslib(X, k, n_jobs, **kwargs):
+    return (
+        functools.partial(
+            init_batched, 
+            "corals.correlation.topk.batched.nearest_neighbors_ann_nmslib", "NmslibTopkMapReduce"),
+        [X],
+        # preferred_backend="threads" does not really work for nmslib it seems
+        batched_kwargs(k, n_jobs))
+
+
+@experiment(
+    "topk_batch_matmul{backend}_parallel_{n_jobs}", 
+    backend={"": None, "_threads": "threads"}, 
+    n_jobs=N_JOBS_RANGE)
+def topk_batch_matmul(X, k, backend, n_jobs, **kwargs):
+    exp_kwargs = batched_kwargs(k, n_jobs)
+    if backend is not None:
+        exp_kwargs["preferred_backend"] = backend
+    return (
+        functools.partial(
+            init_batched, 
+            "corals.correlation.topk.batched.matmul", "MatmulTopkMapReduce"),
+        [X],
+        exp_kwargs)
@@ -0,0 +1,182 @@
+"""
+Shared-memory hand-off of datasets to joblib workers for `benchmark.py`.
+
+By default, joblib's process backend (loky) pickles arguments of each task
+or dumps large arrays to a temporary folder on every `Parallel` call.
+This serialization counts towards runtime and (via `include_children`) memory of parallel experiments.
+
+With `share`, the dataset is placed once in a `/dev/shm`-backed memory map.
+joblib forwards arrays backed by a memory map (including views, e.g., slices or transposes)
+by file name only, so workers map the same pages without copying.
+CorALS' algorithms, however, standardize the dataset first (`corals.correlation.utils.preprocess_XY`),
+so workers consume the standardized copy rather than the dataset;
+`share_preprocessed` makes CorALS write the standardized data into a `/dev/shm`-backed memory map as well.
+Other arrays derived within an experiment (e.g., the arrays of ball trees sent with each task)
+are dumped by joblib into `/dev/shm` once per `Parallel` call if they exceed `SHM_MAX_NBYTES`
+(instead of joblib's default of 1Mb), so tasks only carry file names (see `joblib_config`).
+
+`time_serialization` measures the time the parent spends serializing tasks for loky workers,
+so runtime can be split into serialization and compute.
+"""
+import contextlib
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+SHM_DIR = "/dev/shm"
+
+# arrays larger than this are handed to joblib workers as memory maps (see `joblib_config`)
+SHM_MAX_NBYTES = "16K"
+
+
+def derive_shm_dir(shm_dir=SHM_DIR):
+    """Returns `shm_dir` if it exists, otherwise the default temporary directory."""
+    if shm_dir is not None and os.path.isdir(shm_dir):
+        return shm_dir
+    return tempfile.gettempdir()
+
+
+@contextlib.contextmanager
+def share(X, shm_dir=SHM_DIR):
+    """
+    Copies `X` into a read-only memory map in `shm_dir` and yields it; the file is removed afterwards.
+    Memory-mapped arrays whose file already is in `shm_dir` are yielded as is.
+    """
+
+    shm_dir = derive_shm_dir(shm_dir)
+    if isinstance(X, np.memmap) and X.filename is not None \
+            and pathlib.Path(X.filename).parent == pathlib.Path(shm_dir):
+        yield X
+        return
+
+    fd, path = tempfile.mkstemp(dir=shm_dir, prefix="coralsarticle-", suffix=".npy")
+    os.close(fd)
+    try:
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=X.dtype, shape=X.shape, fortran_order=np.isfortran(X))
+        out[...] = X
+        out.flush()
+        del out
+        yield np.load(path, mmap_mode="r")
+    finally:
+        os.remove(path)
+
+
+@contextlib.contextmanager
+def share_preprocessed(shm_dir=SHM_DIR):
+    """
+    Makes `corals.correlation.utils.preprocess_X` (used by `preprocess_XY`) write its output into
+    writable memory maps in `shm_dir`, one per input array (reused across calls, e.g., rounds);
+    the files are removed afterwards.
+    The standardization itself still runs (and is timed) on every call.
+    """
+
+    import corals.correlation.utils
+
+    shm_dir = derive_shm_dir(shm_dir)
+    preprocess_X = corals.correlation.utils.preprocess_X
+    buffers = {}
+
+    def preprocess_X_shared(X):
+        X = np.asanyarray(X)
+        key = (X.__array_interface__["data"][0], X.shape, X.strides, X.dtype.str)
+        if key not in buffers:
+            fd, path = tempfile.mkstemp(dir=shm_dir, prefix="coralsarticle-", suffix=".npy")
+            os.close(fd)
+            buffers[key] = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.result_type(X.dtype, np.float64), shape=X.shape, fortran_order=np.isfortran(X))
+        Xh = buffers[key]
+        # see `corals.correlation.utils.preprocess_X`
+        np.subtract(X, np.mean(X, axis=0), out=Xh)
+        Xh /= np.std(Xh, axis=0) * np.sqrt(X.shape[0])
+        return Xh
+
+    corals.correlation.utils.preprocess_X = preprocess_X_shared
+    try:
+        yield
+    finally:
+        corals.correlation.utils.preprocess_X = preprocess_X
+        for Xh in buffers.values():
+            os.remove(Xh.filename)
+
+
+@contextlib.contextmanager
+def joblib_config(shm_dir=SHM_DIR, max_nbytes=SHM_MAX_NBYTES):
+    """
+    Makes joblib dump arrays larger than `max_nbytes` to `shm_dir` and hand them to workers as read-only memory maps.
+    """
+
+    import joblib
+    from joblib import _memmapping_reducer
+
+    shm_dir = derive_shm_dir(shm_dir)
+    previous = os.environ.get("JOBLIB_TEMP_FOLDER")
+    # older joblib versions (and code creating its own executors) only respect the environment variable
+    os.environ["JOBLIB_TEMP_FOLDER"] = shm_dir
+
+    # joblib reconstructs contiguous views of memory maps in the order of the memory map,
+    # so transposed views (e.g., `X.T` of a shared `X`) would arrive with their data reinterpreted
+    reduce_memmap_backed = _memmapping_reducer._reduce_memmap_backed
+
+    def reduce_memmap_backed_ordered(a, m):
+        func, args = reduce_memmap_backed(a, m)
+        filename, dtype, mode, offset, order, shape, strides = args[:7]
+        if strides is None and a.ndim > 1:
+            order = "F" if a.flags.f_contiguous and not a.flags.c_contiguous else "C"
+        return func, (filename, dtype, mode, offset, order, shape, strides) + args[7:]
+
+    _memmapping_reducer._reduce_memmap_backed = reduce_memmap_backed_ordered
+    try:
+        with joblib.parallel_config(temp_folder=shm_dir, mmap_mode="r", max_nbytes=max_nbytes):
+            yield
+    finally:
+        _memmapping_reducer._reduce_memmap_backed = reduce_memmap_backed
+        if previous is None:
+            del os.environ["JOBLIB_TEMP_FOLDER"]
+        else:
+            os.environ["JOBLIB_TEMP_FOLDER"] = previous
+
+
+class SerializationStats():
+
+    def __init__(self):
+        self.time = 0.
+        self.bytes = 0
+        self.n_tasks = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds, n_bytes):
+        with self.lock:
+            self.time += seconds
+            self.bytes += n_bytes
+            self.n_tasks += 1
+
+
+@contextlib.contextmanager
+def time_serialization():
+    """
+    Yields `SerializationStats` accumulating the time and bytes of pickling tasks sent through loky's queues,
+    including dumping large arrays to memory maps.
+    Only serialization within this process is covered (e.g., not within the child of the `rusage` memory backend).
+    """
+
+    from joblib.externals.loky.backend import queues
+
+    stats = SerializationStats()
+    dumps = queues.dumps
+
+    def timed_dumps(obj, *args, **kwargs):
+        start = time.perf_counter()
+        data = dumps(obj, *args, **kwargs)
+        stats.add(time.perf_counter() - start, len(data))
+        return data
+
+    queues.dumps = timed_dumps
+    try:
+        yield stats
+    finally:
+        queues.dumps = dumps
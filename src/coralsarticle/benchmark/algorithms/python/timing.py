@@ -0,0 +1,110 @@
+"""
+Runtime measurement with warm-up and adaptive repeats for `benchmark.py`.
+
+Rounds are repeated until the confidence interval of the mean runtime is narrow enough
+(relative to the mean), the maximum number of repeats is reached, or the time budget would be exceeded.
+This way, fast experiments get enough repeats to be reliable,
+while slow experiments (e.g., `topk_balltree_twice`) do not waste hours on repeats that do not add information.
+"""
+import gc
+import time
+import datetime
+
+import numpy as np
+
+
+def time_adaptive(
+        func, args, kwargs,
+        n_warmup=1,
+        min_repeat=3,
+        max_repeat=10,
+        target_ci=0.05,
+        time_budget=None,
+        confidence=0.95,
+        verbose=True):
+    """
+    Times `func(*args, **kwargs)` using `time.perf_counter`.
+
+    Parameters
+    ----------
+    n_warmup: int
+        Number of rounds run (and timed) before measuring; these are not part of the samples.
+    min_repeat, max_repeat: int
+        Minimum and maximum number of measured rounds.
+    target_ci: float
+        Stop when the half width of the confidence interval of the mean is below `target_ci * mean`.
+    time_budget: float, optional
+        Stop if the next round would exceed the time budget (in seconds, including warm-up);
+        at least one round is always measured.
+    confidence: float
+        Confidence level of the confidence interval.
+
+    Returns
+    -------
+    samples: list of float
+        Runtimes of the measured rounds in seconds.
+    warmup: list of float
+        Runtimes of the warm-up rounds in seconds.
+    """
+
+    start = time.perf_counter()
+
+    def run(label):
+        gc.collect()
+        if verbose:
+            print(f"* {label} ({datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}): ", end="")
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        runtime = time.perf_counter() - start_time
+        if verbose:
+            print(str(datetime.timedelta(seconds=runtime)))
+        return runtime
+
+    warmup = []
+    for i in range(n_warmup):
+        warmup.append(run(f"Warm-up {i}"))
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            break
+
+    samples = []
+    while len(samples) < max_repeat:
+
+        samples.append(run(f"Round {len(samples)}"))
+
+        if len(samples) >= min_repeat:
+            ci = relative_ci(samples, confidence=confidence)
+            if ci <= target_ci:
+                if verbose: print(f"  Target confidence interval reached: {ci:.04f} <= {target_ci}")
+                break
+
+        if time_budget is not None:
+            elapsed = time.perf_counter() - start
+            if elapsed + np.mean(samples) > time_budget:
+                if verbose: print(f"  Time budget exhausted: {elapsed:.02f}s of {time_budget}s")
+                break
+
+    return samples, warmup
+
+
+def relative_ci(samples, confidence=0.95):
+    """Half width of the confidence interval of the mean (Student's t) relative to the mean."""
+
+    if len(samples) < 2:
+        return np.inf
+
+    import scipy.stats
+
+    samples = np.asarray(samples)
+    mean = np.mean(samples)
+    if mean == 0:
+        return np.inf
+
+    sem = np.std(samples, ddof=1) / np.sqrt(samples.size)
+    t = scipy.stats.t.ppf((1 + confidence) / 2, df=samples.size - 1)
+    return t * sem / mean
+
+
+def summarize(samples):
+    """Median and interquartile range."""
+    q1, median, q3 = np.percentile(samples, [25, 50, 75])
+    return median, q3 - q1
@@ -0,0 +1,88 @@
+import click
+
+
+@click.command()
+@click.option("--jobs_file", required=True, help="JSON file describing the dataset and the experiments to run")
+def run(jobs_file):
+    """
+    Runs many experiments on the same dataset in one long-lived process.
+
+    Libraries are imported and the dataset is loaded only once.
+    Each experiment then runs in a forked child process,
+    so experiments are isolated from each other (crashes, leaks, global state)
+    and measure memory relative to the same state as a fresh `benchmark.py` run,
+    i.e., libraries imported and data loaded.
+    """
+
+    import json
+    import sys
+
+    with open(jobs_file, "r") as f:
+        jobs = json.load(f)
+
+    data = jobs["data"]
+    n_threads = jobs["n_threads"]
+    mmap = jobs.get("mmap", False)
+    experiments = jobs["experiments"]
+
+    # set threads (before importing numpy and co.)
+    import corals.threads
+    corals.threads.set_threads_for_external_libraries(n_threads=n_threads)
+
+    import multiprocessing
+
+    # warm up imports, so they are shared with all children
+    import numpy as np
+    import scipy
+    import sklearn
+    import h5py
+    import memory_profiler
+    import corals
+    import exps
+    from benchmark import load_data
+
+    print(f"Worker:      {data} ({len(experiments)} experiments)")
+    X = load_data(data, mmap=mmap)
+    print(f"* Data:      {X.shape}")
+
+    context = multiprocessing.get_context("fork")
+    failed = []
+    for kwargs in experiments:
+        process = context.Process(target=run_child, args=(X, n_threads, data, mmap, kwargs))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"* FAILED:    {kwargs['exp']} (exit code: {process.exitcode})")
+            failed.append(kwargs["exp"])
+
+    if len(failed) > 0:
+        print(f"Failed experiments: {failed}")
+        sys.exit(1)
+
+
+def run_child(X, n_threads, data, mmap, kwargs):
+    from benchmark import run_benchmark
+    import coralsarticle.benchmark.scheduler
+    import placement as placement_module
+
+    # pin this child (threads created from now on and joblib workers inherit it);
+    # NOTE: `bind_threads` has no effect since the OpenMP runtime was already loaded by the worker
+    cpu_placement = placement_module.derive_placement(
+        kwargs.pop("placement", "none"),
+        coralsarticle.benchmark.scheduler.derive_n_cores(kwargs["exp"], n_threads),
+        memory=kwargs.pop("memory_placement", "default"),
+        bind_threads=kwargs.pop("bind_threads", False))
+    placement_module.apply(cpu_placement)
+
+    # Memory pages inherited from the worker are shared with it.
+    # RSS counts them like in a fresh process, but USS/PSS do not,
+    # so the child takes ownership of the dataset to keep measurements comparable.
+    # A memory-mapped dataset is shared via the page cache in any case.
+    if kwargs["memory_backend"] in ("psutil_uss", "psutil_pss") and not mmap:
+        X = X.copy()
+
+    run_benchmark(data=data, n_threads=n_threads, X=X, mmap=mmap, placement=cpu_placement, **kwargs)
+
+
+if __name__ == "__main__":
+    run()
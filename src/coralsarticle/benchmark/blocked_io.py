@@ -0,0 +1,187 @@
+"""
+Autotuning of blocked reads from memory-mapped matrices (see `coralsarticle/data/blocked.py`).
+
+Extends `test_memmap.py` by measuring chunked reads:
+for each layout (`C`: row-major, `F`: column-major), `madvise` hint and block size,
+a test matrix is read in blocks along `axis` (default: column blocks, as needed by correlation)
+and throughput (Mb/s) and peak USS (Mb) of the reading process (sampled after each block) are recorded.
+Each read runs in a fresh process, by default with the file evicted from the page cache (cold reads).
+
+Measurements are written to `_out/benchmark/blocked_io.csv` and the fastest setting per layout
+(within `--max_uss`, if given) to `_out/benchmark/blocked_io.json` under the measured axis
+(recommendations for the other axis are kept), from which data-loading paths take their defaults
+(see `coralsarticle.data.blocked.load_recommendation`, e.g., `outofcore.py`).
+
+```bash
+python src/coralsarticle/benchmark/blocked_io.py --m 1000 --n 100000
+```
+"""
+import coralsarticle.data.blocked as blocked
+import collections
+import datetime
+import itertools
+import multiprocessing
+import pathlib
+import platform
+import json
+import time
+import click
+import os
+
+import numpy as np
+
+
+@click.command()
+@click.option("--m", default=1000, help="Rows (samples) of the test matrix.")
+@click.option("--n", default=100000, help="Columns (features) of the test matrix.")
+@click.option("--axis", default="columns", type=click.Choice(["columns", "rows"]), help="Read column or row blocks.")
+@click.option("--layouts", default="C,F", help="Layouts to compare (`C`: row-major, `F`: column-major).")
+@click.option("--advice", "advice_list", default="normal,sequential,willneed", help="`madvise` hints to compare.")
+@click.option("--block_mb", default="1,4,16,64,256", help="Block sizes (Mb) to compare.")
+@click.option("--n_repeat", default=3, help="Repetitions per setting.")
+@click.option("--cache", default="cold", type=click.Choice(["cold", "warm"]), help="Evict the file from the page cache before each read.")
+@click.option("--max_uss", default=None, type=float, help="Only recommend settings with a peak USS (Mb) below this.")
+@click.option("--tmp_dir", default="_out/benchmark/blocked_io", help="Directory for test matrices (removed afterwards).")
+@click.option("--out_file", default="_out/benchmark/blocked_io.csv", help="Measurements.")
+@click.option("--recommendation_file", default=blocked.RECOMMENDATION_FILE, help="Recommendation (read by data-loading paths by default).")
+def run(m, n, axis, layouts, advice_list, block_mb, n_repeat, cache, max_uss, tmp_dir, out_file, recommendation_file):
+
+    import pandas as pd
+
+    axis = 1 if axis == "columns" else 0
+    layouts = layouts.split(",")
+    advice_list = advice_list.split(",")
+    block_bytes_list = [int(float(b) * 1024**2) for b in block_mb.split(",")]
+
+    print("############################################################")
+    print(f"Matrix:     {m} x {n} ({m * n * 8 / 1024**2:.0f}Mb)")
+    print(f"Axis:       {'columns' if axis == 1 else 'rows'}")
+    print(f"Layouts:    {layouts}")
+    print(f"Advice:     {advice_list}")
+    print(f"Blocks:     {block_mb} Mb")
+    print(f"Cache:      {cache}")
+    print("############################################################")
+
+    rows = []
+    for layout in layouts:
+
+        path = pathlib.Path(tmp_dir) / f"matrix_{layout}.npy"
+        print()
+        print(f"Writing test matrix: {path}")
+        blocked.save_matrix(path, (m, n), layout=layout)
+
+        try:
+            for advice, block_bytes in itertools.product(advice_list, block_bytes_list):
+                for repetition in range(n_repeat):
+                    if cache == "cold":
+                        blocked.evict_page_cache(path)
+                    elapsed, uss = read_in_child(path, block_bytes, axis, advice)
+                    throughput = m * n * 8 / 1024**2 / elapsed
+                    print(f"* {layout} {advice:<10} {block_bytes / 1024**2:>8.2f}Mb: {throughput:>10.1f}Mb/s {uss:>10.1f}Mb (USS)")
+                    rows.append(collections.OrderedDict(
+                        layout=layout, advice=advice, block_bytes=block_bytes, repetition=repetition,
+                        runtime=elapsed, throughput=throughput, uss=uss))
+        finally:
+            path.unlink()
+
+    df = pd.DataFrame(rows)
+    out_file = pathlib.Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(out_file, index=False)
+    print()
+    print(f"Measurements written to: {out_file}")
+
+    machine = collections.OrderedDict(
+        hostname=platform.node(),
+        cpus=os.cpu_count(),
+        memory=os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+    axis_recommendation = collections.OrderedDict(
+        created=datetime.datetime.now().isoformat(),
+        matrix=[m, n],
+        cache=cache,
+        max_uss=max_uss,
+        layouts=recommend(df, max_uss=max_uss))
+
+    print()
+    print("Recommendation:")
+    for layout, r in axis_recommendation["layouts"].items():
+        print(f"* {layout}: {r['block_bytes'] / 1024**2:.2f}Mb blocks, {r['advice']} ({r['throughput']:.1f}Mb/s, {r['uss']:.1f}Mb USS)")
+
+    # keep recommendations for the other axis (if measured on this machine)
+    recommendation_file = pathlib.Path(recommendation_file)
+    recommendation = collections.OrderedDict(machine=machine, axes=collections.OrderedDict())
+    try:
+        with open(recommendation_file, "r") as f:
+            previous = json.load(f, object_pairs_hook=collections.OrderedDict)
+        if previous["machine"] == machine:
+            recommendation["axes"].update(previous["axes"])
+    except (OSError, ValueError, KeyError):
+        pass
+    recommendation["axes"]["columns" if axis == 1 else "rows"] = axis_recommendation
+
+    recommendation_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(recommendation_file, "w") as f:
+        json.dump(recommendation, f, indent=2)
+    print(f"Recommendation written to: {recommendation_file}")
+
+
+def recommend(df, max_uss=None):
+    """Fastest setting (median throughput) per layout, among settings with a median peak USS below `max_uss`."""
+
+    summary = df.groupby(["layout", "advice", "block_bytes"])[["throughput", "uss"]].median().reset_index()
+    if max_uss is not None:
+        summary = summary[summary["uss"] <= max_uss]
+
+    layouts = collections.OrderedDict()
+    for layout, group in summary.groupby("layout"):
+        best = group.loc[group["throughput"].idxmax()]
+        layouts[layout] = collections.OrderedDict(
+            block_bytes=int(best["block_bytes"]),
+            advice=best["advice"],
+            throughput=float(best["throughput"]),
+            uss=float(best["uss"]))
+    return layouts
+
+
+def read_in_child(path, block_bytes, axis, advice):
+    """Reads the matrix in a fresh process; returns runtime (s) and peak USS (Mb)."""
+
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=read, args=(path, block_bytes, axis, advice, sender))
+    process.start()
+    # only the child writes, so `recv` fails instead of blocking if the child dies
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"Reading failed (exit code {process.exitcode}): {path}")
+    finally:
+        process.join()
+    return result
+
+
+def read(path, block_bytes, axis, advice, sender):
+    import psutil
+
+    p = psutil.Process()
+    uss = p.memory_full_info().uss
+    sampling_time = 0.
+
+    start_time = time.perf_counter()
+    X = np.load(path, mmap_mode="r")
+    for _, _, block in blocked.iter_blocks(X, block_bytes=block_bytes, axis=axis, advice=advice):
+        # touch all values of the block
+        block.sum()
+        # sample before the block's pages are released (when the next block is requested); not timed
+        sampling_start = time.perf_counter()
+        uss = max(uss, p.memory_full_info().uss)
+        sampling_time += time.perf_counter() - sampling_start
+    elapsed = time.perf_counter() - start_time - sampling_time
+
+    sender.send((elapsed, uss / 1024**2))
+    sender.close()
+
+
+if __name__ == "__main__":
+    run()
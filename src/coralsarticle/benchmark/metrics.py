@@ -0,0 +1,130 @@
+"""
+Accuracy metrics on sets of index pairs.
+
+Top-k results are compared as sorted sets of encoded index pairs (`pair_keys`),
+so metrics never require a dense `n x n` matrix.
+"""
+import collections
+
+import numpy as np
+
+
+def pair_keys(idx_r, idx_c, n, values=None, mode="tril"):
+    """
+    Encodes index pairs as sorted, unique int64 keys `r * n + c`.
+
+    Parameters
+    ----------
+    idx_r, idx_c: array-like
+        Row and column indices.
+    n: int
+        Number of features.
+    values: array-like, optional
+        If given, pairs with a value of 0 are dropped (like comparing a densified matrix against 0).
+    mode: str
+        `tril`: only keep pairs with `r > c` (lower triangle; see `np.tril_indices(n, k=-1)`);
+        `symmetric`: `(r, c)` and `(c, r)` are the same pair (encoded as lower triangle); the diagonal is dropped.
+    """
+
+    idx_r = np.asarray(idx_r, dtype=np.int64)
+    idx_c = np.asarray(idx_c, dtype=np.int64)
+
+    if values is not None:
+        msk = np.asarray(values) != 0
+        idx_r, idx_c = idx_r[msk], idx_c[msk]
+
+    if mode == "tril":
+        msk = idx_r > idx_c
+        idx_r, idx_c = idx_r[msk], idx_c[msk]
+    elif mode == "symmetric":
+        msk = idx_r != idx_c
+        idx_r, idx_c = np.maximum(idx_r[msk], idx_c[msk]), np.minimum(idx_r[msk], idx_c[msk])
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    return np.unique(idx_r * n + idx_c)
+
+
+def set_metrics(keys_true, keys_pred, n_total=None):
+    """
+    Accuracy (if the number of all possible pairs `n_total` is given), precision, recall and F1
+    of predicted vs. true pairs (sorted unique keys, see `pair_keys`).
+    """
+
+    tp = count_intersection(keys_true, keys_pred)
+    fp = keys_pred.size - tp
+    fn = keys_true.size - tp
+
+    metrics = collections.OrderedDict()
+    if n_total is not None:
+        metrics["accuracy"] = (n_total - fp - fn) / n_total
+    metrics["precision"] = tp / (tp + fp) if tp + fp > 0 else 0.
+    metrics["recall"] = tp / (tp + fn) if tp + fn > 0 else 0.
+    p, r = metrics["precision"], metrics["recall"]
+    metrics["f1"] = 2 * p * r / (p + r) if p + r > 0 else 0.
+    return metrics
+
+
+def count_intersection(keys_a, keys_b):
+    """Size of the intersection of two sorted unique key arrays (binary search merge; no temporary union)."""
+    if keys_a.size == 0 or keys_b.size == 0:
+        return 0
+    pos = np.searchsorted(keys_a, keys_b)
+    pos[pos == keys_a.size] = 0
+    return int(np.count_nonzero(keys_a[pos] == keys_b))
+
+
+def ranked_pair_keys(idx_r, idx_c, n, values):
+    """
+    Like `pair_keys` (symmetric mode) but keys are ordered by absolute value (descending);
+    for duplicate pairs, the first occurrence in this order is kept.
+    Returns keys and values.
+    """
+
+    idx_r = np.asarray(idx_r, dtype=np.int64)
+    idx_c = np.asarray(idx_c, dtype=np.int64)
+    values = np.asarray(values)
+
+    msk = idx_r != idx_c
+    keys = np.maximum(idx_r[msk], idx_c[msk]) * n + np.minimum(idx_r[msk], idx_c[msk])
+    values = values[msk]
+
+    order = np.argsort(-np.abs(values), kind="stable")
+    keys, values = keys[order], values[order]
+    _, first = np.unique(keys, return_index=True)
+    first = np.sort(first)
+    return keys[first], values[first]
+
+
+def rank_metrics(keys_true, values_true, keys_pred, values_pred, k, fractions=(0.1, 0.25, 0.5, 1.0)):
+    """
+    Rank-aware metrics on ranked keys (see `ranked_pair_keys`):
+    
+    * `recall_at_<f>k`: fraction of the top `f * k` true pairs among the top `f * k` predicted pairs
+    * `kth_value_error`: absolute error of the `k`-th largest absolute value (i.e., the effective threshold)
+    * `kth_value_error_relative`: the same relative to the true `k`-th value
+    """
+
+    metrics = collections.OrderedDict()
+    for fraction in fractions:
+        kk = max(1, int(k * fraction))
+        top_true = np.sort(keys_true[:kk])
+        top_pred = np.sort(keys_pred[:kk])
+        metrics[f"recall_at_{fraction:.02f}k"] = count_intersection(top_true, top_pred) / max(1, top_true.size)
+
+    kk = min(k, keys_true.size, keys_pred.size)
+    if kk > 0:
+        kth_true = np.abs(values_true[kk - 1])
+        kth_pred = np.abs(values_pred[kk - 1])
+        metrics["kth_value_error"] = abs(kth_pred - kth_true)
+        metrics["kth_value_error_relative"] = abs(kth_pred - kth_true) / kth_true if kth_true != 0 else np.nan
+    else:
+        metrics["kth_value_error"] = np.nan
+        metrics["kth_value_error_relative"] = np.nan
+
+    return metrics
+
+
+def n_pairs_tril(n):
+    """Number of pairs in the lower triangle (without diagonal)."""
+    return n * (n - 1) // 2
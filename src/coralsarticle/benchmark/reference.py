@@ -0,0 +1,95 @@
+"""
+Persistent store of exact reference results (e.g., `topk_matrix`, `topkdiff_matrix`) for accuracy benchmarks.
+
+References are keyed by dataset identity (name, shape and a hash of the data),
+the algorithm (module, name and `corals` version) and its parameters (e.g., `k`, `spearman`).
+Each reference is a directory of `.npy` files (`values`, `idx_r`, `idx_c`) and a `meta.json`,
+which are loaded memory-mapped, so scoring against a reference does not require recomputing it.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+
+REFERENCE_DIR = "_out/benchmark/reference"
+
+
+def load_reference(func, *data, data_name, reference_dir=REFERENCE_DIR, **kwargs):
+    """
+    Returns `func(*data, **kwargs)` from the store or computes and stores it.
+
+    `func` must return `values, (idx_r, idx_c)`; these are returned as read-only memory-mapped arrays.
+    """
+
+    meta = derive_meta(func, *data, data_name=data_name, **kwargs)
+    path = pathlib.Path(reference_dir) / derive_key(meta)
+
+    if not path.exists():
+        print(f"* Calculate reference: {meta['algorithm']} ({path})")
+        values, (idx_r, idx_c) = func(*data, **kwargs)
+
+        # write to a temporary directory first, so concurrent runs never see incomplete references
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = pathlib.Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+        try:
+            np.save(tmp / "values.npy", np.asarray(values))
+            np.save(tmp / "idx_r.npy", np.asarray(idx_r))
+            np.save(tmp / "idx_c.npy", np.asarray(idx_c))
+            with open(tmp / "meta.json", "w") as f:
+                json.dump(meta, f, indent=2, default=str)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # another run stored the same reference in the meantime
+                if not path.exists():
+                    raise
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+    else:
+        print(f"* Load reference: {meta['algorithm']} ({path})")
+
+    values = np.load(path / "values.npy", mmap_mode="r")
+    idx_r = np.load(path / "idx_r.npy", mmap_mode="r")
+    idx_c = np.load(path / "idx_c.npy", mmap_mode="r")
+    return values, (idx_r, idx_c)
+
+
+def derive_meta(func, *data, data_name, **kwargs):
+    return dict(
+        data=data_name,
+        shapes=[list(X.shape) for X in data],
+        data_hash=derive_data_hash(*data),
+        algorithm=f"{func.__module__}.{func.__name__}",
+        algorithm_version=derive_version(func.__module__.split(".")[0]),
+        kwargs=kwargs)
+
+
+def derive_key(meta):
+    meta_json = json.dumps(meta, sort_keys=True, default=str)
+    return hashlib.sha256(meta_json.encode("utf-8")).hexdigest()[:32]
+
+
+def derive_data_hash(*data, block_bytes=2**26):
+    """Hashes the content of the given arrays (row block by row block)."""
+    h = hashlib.sha256()
+    for X in data:
+        X = np.asarray(X)
+        h.update(f"{X.dtype.str}{X.shape}".encode("utf-8"))
+        block_size = max(1, block_bytes // max(1, X[:1].nbytes))
+        for start in range(0, X.shape[0], block_size):
+            h.update(np.ascontiguousarray(X[start:start + block_size]).data)
+    return h.hexdigest()
+
+
+def derive_version(package):
+    import importlib.metadata
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
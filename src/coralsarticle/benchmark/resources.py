@@ -1,15 +1,31 @@
-from coralsarticle.utils import execute
+import coralsarticle.benchmark.scheduler as scheduler
+import collections
 import pathlib
+import json
 import yaml
 import click
+import os
 import re
 
 
+# timing, instrumentation, hand-off and placement options passed on to the python benchmark (see `benchmark.py`)
+PYTHON_TIMING_OPTIONS = [
+    "timing_mode", "n_warmup", "min_repeat", "target_ci", "time_budget", "n_repeat_memory", "counters", "shm", 
+    "placement", "memory_placement", "bind_threads"]
+
+
 @click.command()
 @click.option("-c", "--config_file", default="config/test.yml", help="Config file")
 @click.option("-o", "--overwrite", is_flag=True, help="Overwrite if experiment exists.")
 @click.option("-e", "--conda_env", default="benchmark", help="Environment used to execute benchmarks.")
-def run(config_file, overwrite, conda_env):
+@click.option("-s", "--scheduler", "scheduler_mode", default="sequential", type=click.Choice(["sequential", "parallel"]), help="Run jobs one after another or pack them onto the machine.")
+@click.option("--max_cores", default=None, type=int, help="Cores available to the parallel scheduler (default: all).")
+@click.option("--max_memory", default=None, type=float, help="Memory (in Gb) available to the parallel scheduler (default: available memory).")
+@click.option("--journal", "journal_file", default=None, help="Job status journal (default: `_out/benchmark/journal/<config>.jsonl`).")
+@click.option("--ignore_journal", is_flag=True, help="Rerun jobs even if the journal marks them as done.")
+@click.option("-r", "--runner", default="process", type=click.Choice(["process", "worker"]), help="Run each Python experiment in a fresh process or run all Python experiments per dataset in one worker.")
+@click.option("--cache_max_gb", default=None, type=float, help="Disk budget (in Gb) of the dataset cache `data/cache` (default: config's `cache_max_gb` or none).")
+def run(config_file, overwrite, conda_env, scheduler_mode, max_cores, max_memory, journal_file, ignore_journal, runner, cache_max_gb):
 
     # general settings
     # conda_env = "benchmark"
@@ -20,6 +36,7 @@ def run(config_file, overwrite, conda_env):
     benchmark_julia =   benchmark_dir / "julia/benchmark.jl"
     benchmark_r =       benchmark_dir / "r/benchmark.R"
     benchmark_python =  benchmark_dir / "python/benchmark.py"
+    benchmark_worker =  benchmark_dir / "python/worker.py"
 
     # load config
     with open(config_file, 'r') as stream:
@@ -31,6 +48,8 @@ def run(config_file, overwrite, conda_env):
     data_regex = config["context"].get("data", "synthetic_mn_m-50_n-5000_postprocessed")
     k_ratio = config["context"].get("k_ratio", 0.001)
     threshold = config["context"].get("threshold", 0.9)
+    if cache_max_gb is None:
+        cache_max_gb = config["context"].get("cache_max_gb")
 
     # load available data
     if data_regex.startswith("volatile_synthetic"):
@@ -38,43 +57,54 @@ def run(config_file, overwrite, conda_env):
         m = int(re.search("m-(.*?)_", data_regex).group(1))
         n = int(re.search("n-(.*?)_", data_regex).group(1))
         from coralsarticle.data.utils import load_data
+        from coralsarticle.data.cache import DatasetCache
         data_regex, _ = load_data(
             dataset="synthetic_mn", 
             m=m,
             n=n,
             data_dir="./data",
-            dataset_name_prefix="volatile_")
+            dataset_name_prefix="volatile_",
+            cache=DatasetCache(
+                "./data/cache", 
+                max_bytes=int(cache_max_gb * 1024**3) if cache_max_gb is not None else None))
+        print("Created dataset:", data_regex)
+    elif data_regex.startswith("outofcore_synthetic"):
+        print("Creating out-of-core dataset ...")
+        m = int(re.search(r"m-(\d+)", data_regex).group(1))
+        n = int(re.search(r"n-(\d+)", data_regex).group(1))
+        seed = re.search(r"seed-(\d+)", data_regex)
+        from coralsarticle.data.utils import create_outofcore_synthetic_mn
+        data_regex = create_outofcore_synthetic_mn(
+            m=m, 
+            n=n, 
+            seed=int(seed.group(1)) if seed is not None else None, 
+            data_dir="./data")
         print("Created dataset:", data_regex)
 
     data = []
     print("Available data:")
-    for p in pathlib.Path('./data/benchmark').iterdir():
-        if p.is_file():
+    for p in sorted(pathlib.Path('./data/benchmark').iterdir()):
+        # `.npy` sidecars (see `load_matrix`) belong to the `.h5` file of the same name
+        if p.is_file() and p.suffix in (".h5", ".npy"):
             f = p.with_suffix('').name
+            if f in data:
+                continue
             selected = "x" if re.match(data_regex, f) else " "
             print(f"* [{selected}]", f)
             data.append(f)
 
     print()
-    print("Running experiments:")
+    jobs = []
+    worker_groups = collections.OrderedDict()
     for d in data:
         for exp in config["experiments"]:
 
             if re.match(data_regex, d):
 
-                print()
-                print("############################################################")
-                print(f"Context:    {config['context']}")
-                print(f"Experiment: {exp}")
-                print(f"Overwrite:  {overwrite}")
-                print("############################################################")
-
                 execution_context = None
                 if exp["lang"] == "python":
-                    execution_context = f"python {benchmark_python}"
-                    if "python" in config["context"]:
-                        if "memory_backend" in config["context"]["python"]:
-                            execution_context += f" --memory_backend {config['context']['python']['memory_backend']}"
+                    execution_context = f"python {benchmark_python}" + \
+                        derive_python_options(config["context"].get("python", {}))
                 elif exp["lang"] == "julia":
                     execution_context = f"julia {benchmark_julia}"
                 elif exp["lang"] == "r":
@@ -101,17 +131,152 @@ def run(config_file, overwrite, conda_env):
                 if exp["lang"] == "julia":
                     overwrite_exec = str(overwrite).lower()
 
-                execute(
-                    execution_context +
-                    f" --prefix {prefix}" +
-                    f" --exp {exp['algorithm']}" + 
-                    f" --data {d}" + 
-                    f" --k_ratio {k_ratio_local}" + 
-                    f" --threshold {threshold}" + 
-                    f" --n_repeat {n_repeat}" +
-                    f" --n_threads {n_threads_local}" +
-                    f" --overwrite {overwrite_exec}", 
-                    conda_env=conda_env)
+                cmd = execution_context + \
+                    f" --prefix {prefix}" + \
+                    f" --exp {exp['algorithm']}" + \
+                    f" --data {d}" + \
+                    f" --k_ratio {k_ratio_local}" + \
+                    f" --threshold {threshold}" + \
+                    f" --n_repeat {n_repeat}" + \
+                    f" --n_threads {n_threads_local}" + \
+                    f" --overwrite {overwrite_exec}"
+
+                # resources
+                n_cores = exp.get("n_cores", scheduler.derive_n_cores(exp["algorithm"], n_threads_local))
+                if "memory" in exp:
+                    memory = int(exp["memory"] * 1024**3)
+                else:
+                    memory = scheduler.estimate_memory(
+                        exp["algorithm"], load_data_shape(d), lang=exp["lang"], k_ratio=k_ratio_local)
+                # parallel timings must not be contaminated by other jobs; 
+                # pinned jobs would compete for the same CPUs (see `placement.py`)
+                pinned = exp["lang"] == "python" and \
+                    config["context"].get("python", {}).get("placement", "none") != "none"
+                exclusive = exp.get("exclusive", config["context"].get("exclusive", n_cores > 1 or pinned))
+                # the `cgroup` memory backend measures the whole cgroup, i.e., including jobs running next to it
+                if exp["lang"] == "python" and \
+                        config["context"].get("python", {}).get("memory_backend", "psutil") == "cgroup":
+                    exclusive = True
+
+                # collect python experiments per dataset to run them in one worker
+                if runner == "worker" and exp["lang"] == "python":
+                    memory_backend = config["context"].get("python", {}).get("memory_backend", "psutil")
+                    mmap = config["context"].get("python", {}).get("mmap", False)
+                    group_key = (d, n_threads_local, memory_backend, mmap)
+                    if group_key not in worker_groups:
+                        worker_groups[group_key] = []
+                        jobs.append(group_key)
+                    worker_groups[group_key].append((
+                        dict(
+                            prefix=prefix, 
+                            exp=exp["algorithm"], 
+                            n_repeat=n_repeat, 
+                            k_ratio=k_ratio_local, 
+                            threshold=threshold, 
+                            overwrite=overwrite, 
+                            memory_backend=memory_backend,
+                            results_store=config["context"].get("python", {}).get("results_store"),
+                            **{
+                                o: config["context"]["python"][o] 
+                                for o in PYTHON_TIMING_OPTIONS 
+                                if o in config["context"].get("python", {})}), 
+                        n_cores, memory, exclusive))
+                    continue
+
+                jobs.append(scheduler.Job(
+                    id=scheduler.derive_job_id(cmd),
+                    cmd=cmd,
+                    name=f"{exp['lang']}/{exp['algorithm']}/{d}",
+                    n_cores=n_cores,
+                    memory=memory,
+                    exclusive=exclusive))
+
+    # replace worker groups by worker jobs
+    for i, job in enumerate(jobs):
+        if job in worker_groups:
+            d, n_threads_local, _, mmap = job
+            group = worker_groups[job]
+            worker_jobs = dict(data=d, n_threads=n_threads_local, mmap=mmap, experiments=[g[0] for g in group])
+            worker_jobs_json = json.dumps(worker_jobs, indent=2)
+            worker_jobs_file = pathlib.Path("_out/benchmark/worker") / \
+                f"{scheduler.derive_job_id(worker_jobs_json)}.json"
+            worker_jobs_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(worker_jobs_file, "w") as f:
+                f.write(worker_jobs_json)
+            cmd = f"python {benchmark_worker} --jobs_file {worker_jobs_file}"
+            jobs[i] = scheduler.Job(
+                id=scheduler.derive_job_id(cmd),
+                cmd=cmd,
+                name=f"python/worker[{len(group)}]/{d}",
+                n_cores=max(g[1] for g in group),
+                memory=max(g[2] for g in group),
+                exclusive=any(g[3] for g in group))
+
+    # journal
+    if journal_file is None:
+        journal_file = pathlib.Path("_out/benchmark/journal") / f"{pathlib.Path(config_file).stem}.jsonl"
+    journal = scheduler.Journal(journal_file)
+    if not ignore_journal:
+        status = scheduler.load_journal(journal_file)
+        jobs_done = [j for j in jobs if status.get(j.id) == "done"]
+        if len(jobs_done) > 0:
+            print(f"Skipping {len(jobs_done)} jobs marked as done in journal: {journal_file}")
+        jobs = [j for j in jobs if status.get(j.id) != "done"]
+
+    print()
+    print("############################################################")
+    print(f"Context:    {config['context']}")
+    print(f"Jobs:       {len(jobs)}")
+    print(f"Overwrite:  {overwrite}")
+    print(f"Scheduler:  {scheduler_mode}")
+    print(f"Runner:     {runner}")
+    print(f"Journal:    {journal_file}")
+    print("############################################################")
+
+    print()
+    print("Running experiments:")
+    if scheduler_mode == "sequential":
+        scheduler.run_sequential(jobs, journal, conda_env=conda_env)
+    else:
+        if max_cores is None:
+            max_cores = os.cpu_count()
+        max_memory = scheduler.derive_memory_available() if max_memory is None else int(max_memory * 1024**3)
+        failed = scheduler.run_parallel(
+            jobs, journal, max_cores=max_cores, max_memory=max_memory, conda_env=conda_env)
+        if len(failed) > 0:
+            raise click.ClickException(f"{len(failed)} jobs failed: {', '.join(j.name for j in failed)}")
+
+
+def derive_python_options(python_context):
+    """Command line options of the python benchmark from the `python` section of a config's `context`."""
+    options = ""
+    if "memory_backend" in python_context:
+        options += f" --memory_backend {python_context['memory_backend']}"
+    for option in PYTHON_TIMING_OPTIONS:
+        if option in python_context:
+            options += f" --{option} {python_context[option]}"
+    if "mmap" in python_context:
+        options += f" --mmap {python_context['mmap']}"
+    if "results_store" in python_context:
+        options += f" --results_store {python_context['results_store']}"
+    return options
+
+
+def load_data_shape(data, data_dir="./data/benchmark"):
+    """Reads the data shape (of `<data>.h5` or `<data>.npy`) without loading the data; `None` if unknown."""
+    import h5py
+    import numpy as np
+    try:
+        with h5py.File(pathlib.Path(data_dir) / f"{data}.h5", "r") as f:
+            return f["data"].shape
+    except (OSError, KeyError):
+        pass
+    # e.g., out-of-core data (see `coralsarticle.data.utils.create_outofcore_synthetic_mn`)
+    try:
+        return np.load(pathlib.Path(data_dir) / f"{data}.npy", mmap_mode="r").shape
+    except (OSError, ValueError):
+        return None
+
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,309 @@
+"""
+Consolidated store of benchmark results.
+
+All runs are kept in a single SQLite database with one row per run (parameters as columns)
+and one row per measured round, so results can be filtered without globbing and parsing file names:
+
+```python
+store = ResultsStore("_out/benchmark/results.sqlite")
+store.import_archive("_out/benchmark")  # existing file-per-run results
+df = store.query(data="pregnancy", algorithm=["topk_matrix", "topk_balltree_combined_tree_parallel_64"], k_ratio=0.001)
+```
+
+Many benchmark processes can append to the same store concurrently
+(SQLite serializes writers; readers are not blocked thanks to write-ahead logging).
+Runs are unique by file and algorithm, so appending or importing a run again replaces it.
+"""
+import contextlib
+import datetime
+import json
+import pathlib
+import re
+import sqlite3
+
+import numpy as np
+
+
+RESULTS_STORE = "_out/benchmark/results.sqlite"
+
+
+# parameter columns of a run (besides `id`)
+RUN_COLUMNS = [
+    ("file", "TEXT NOT NULL"),
+    ("algorithm", "TEXT NOT NULL"),
+    ("prefix", "TEXT"),
+    ("context", "TEXT"),
+    ("context_param", "REAL"),
+    ("lang", "TEXT"),
+    ("data", "TEXT"),
+    ("n_threads", "INTEGER"),
+    ("k", "INTEGER"),
+    ("k_ratio", "REAL"),
+    ("threshold", "REAL"),
+    ("n_repeat", "INTEGER"),
+    ("memory_backend", "TEXT"),
+    ("timing_mode", "TEXT"),
+    ("mmap", "INTEGER"),
+    ("timestamp", "REAL"),
+    ("runtime_median", "REAL"),
+    ("memory_median", "REAL"),
+    # remaining attributes and per-round extras (e.g., `memory_extra`, `timing`) as JSON
+    ("attrs", "TEXT"),
+    ("extra", "TEXT"),
+]
+
+RUN_COLUMN_NAMES = [c for c, _ in RUN_COLUMNS]
+
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    {", ".join(f"{c} {t}" for c, t in RUN_COLUMNS)},
+    UNIQUE (file, algorithm)
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    repetition INTEGER NOT NULL,
+    runtime REAL,
+    memory REAL,
+    PRIMARY KEY (run_id, repetition)
+);
+CREATE INDEX IF NOT EXISTS runs_data_algorithm ON runs (data, algorithm, n_threads, k);
+CREATE INDEX IF NOT EXISTS runs_context ON runs (context, context_param);
+"""
+
+
+class ResultsStore():
+
+    def __init__(self, path=RESULTS_STORE, timeout=600):
+        """
+        Parameters
+        ----------
+        path: str or pathlib.Path
+            SQLite database file; created if it does not exist.
+        timeout: float
+            Seconds to wait for concurrent writers before failing.
+        """
+        self.path = pathlib.Path(path)
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self):
+        # transactions are managed explicitly (see `append`)
+        con = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            con.execute("PRAGMA foreign_keys=ON")
+            yield con
+        finally:
+            con.close()
+
+    def append(self, runtime, memory, extra=None, attrs=None, **params):
+        """
+        Appends a run (replacing a previous run of the same `file` and `algorithm`).
+
+        Parameters
+        ----------
+        runtime, memory: list of float
+            Per-round measurements (seconds, Mb); `memory` may be shorter than `runtime` (see `timing_mode`).
+        extra: dict, optional
+            Further per-round measurements (stored as JSON).
+        attrs: dict, optional
+            Further attributes (stored as JSON).
+        params:
+            Parameter columns (see `RUN_COLUMNS`); `file` and `algorithm` are required.
+        """
+
+        unknown = set(params) - set(RUN_COLUMN_NAMES)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown run parameters: {sorted(unknown)}")
+        params = dict(params)
+        params["attrs"] = json.dumps(attrs or {}, sort_keys=True, default=to_json)
+        params["extra"] = json.dumps(extra or {}, sort_keys=True, default=to_json)
+        params = {c: to_sql(v) for c, v in params.items()}
+
+        runtime = list(runtime)
+        memory = list(memory)
+        rounds = [
+            (i, to_sql(runtime[i]) if i < len(runtime) else None, to_sql(memory[i]) if i < len(memory) else None)
+            for i in range(max(len(runtime), len(memory)))]
+
+        with self.connect() as con:
+            # take the write lock right away, so concurrent appends do not deadlock
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                con.execute(
+                    "DELETE FROM runs WHERE file = ? AND algorithm = ?", (params["file"], params["algorithm"]))
+                cursor = con.execute(
+                    f"INSERT INTO runs ({', '.join(params)}) VALUES ({', '.join('?' * len(params))})",
+                    list(params.values()))
+                run_id = cursor.lastrowid
+                con.executemany(
+                    "INSERT INTO rounds (run_id, repetition, runtime, memory) VALUES (?, ?, ?, ?)",
+                    [(run_id, *r) for r in rounds])
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        return run_id
+
+    def query(self, data=None, algorithm=None, n_threads=None, k=None, rounds=True, **filters):
+        """
+        Returns a tidy DataFrame of runs matching the given filters
+        (one row per round if `rounds`, otherwise one row per run).
+
+        Filters are either single values or lists of values (any of which matches)
+        and can be given for any column in `RUN_COLUMNS` (e.g., `context`, `k_ratio`, `prefix`).
+        """
+
+        import pandas as pd
+
+        filters = dict(data=data, algorithm=algorithm, n_threads=n_threads, k=k, **filters)
+        unknown = set(filters) - set(RUN_COLUMN_NAMES)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown filters: {sorted(unknown)}")
+
+        where = []
+        values = []
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if not isinstance(value, (list, tuple, set, np.ndarray)):
+                value = [value]
+            value = [to_sql(v) for v in value]
+            where.append(f"runs.{column} IN ({', '.join('?' * len(value))})")
+            values.extend(value)
+        where = f"WHERE {' AND '.join(where)}" if len(where) > 0 else ""
+
+        if rounds:
+            sql = f"""
+                SELECT runs.*, rounds.repetition, rounds.runtime, rounds.memory
+                FROM runs JOIN rounds ON rounds.run_id = runs.id
+                {where}
+                ORDER BY runs.id, rounds.repetition"""
+        else:
+            sql = f"SELECT runs.* FROM runs {where} ORDER BY runs.id"
+
+        with self.connect() as con:
+            df = pd.read_sql_query(sql, con, params=values)
+
+        df["mmap"] = df["mmap"].astype("boolean")
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+        return df
+
+    def import_archive(self, benchmark_dir="_out/benchmark", pattern="benchmark_*.h5"):
+        """
+        Imports file-per-run benchmark results (see `benchmark.py`); parameters are parsed from file names.
+        Returns the number of imported runs.
+        """
+
+        n = 0
+        for file in sorted(pathlib.Path(benchmark_dir).glob(pattern)):
+            print(f"* Import: {file.name}")
+            for run in load_archive_file(file):
+                self.append(**run)
+                n += 1
+        return n
+
+
+def load_archive_file(file):
+    """Yields the runs of a file-per-run benchmark file as keyword arguments for `ResultsStore.append`."""
+
+    import h5py
+
+    file = pathlib.Path(file)
+    params = parse_file_name(file.name)
+
+    runs = []
+
+    def visit(name, group):
+        if isinstance(group, h5py.Group) and "memory" in group and "runtime" in group:
+            attrs = {k: to_json(v) for k, v in group.attrs.items()}
+            extra = {
+                k: group[k][()].tolist() for k in group
+                if k not in ("memory", "runtime") and isinstance(group[k], h5py.Dataset)}
+            runs.append(dict(
+                params,
+                file=file.name,
+                algorithm=name,
+                n_threads=attrs.pop("n_threads", derive_n_threads(name)),
+                memory_backend=attrs.pop("memory_backend", params.get("memory_backend", "default")),
+                timing_mode=attrs.pop("timing_mode", params.get("timing_mode", "combined")),
+                mmap=attrs.pop("mmap", None),
+                timestamp=attrs.pop("timestamp", None),
+                runtime_median=attrs.pop("runtime_median", None),
+                memory_median=attrs.pop("memory_median", None),
+                k=attrs.pop("k", None) if (params["context"] or "").startswith("topk") else None,
+                runtime=np.atleast_1d(group["runtime"][()]).tolist(),
+                memory=np.atleast_1d(group["memory"][()]).tolist(),
+                extra=extra,
+                attrs=attrs))
+
+    with h5py.File(file, "r") as f:
+        f.visititems(visit)
+
+    return runs
+
+
+def parse_file_name(name):
+    """
+    Parses parameters from file names like
+    `benchmark___prefix-<prefix>___context-<context>___lang-<lang>___data-<data>___algorithm-<algorithm>___repeat-<n>[___...].h5`.
+    """
+
+    params = {}
+    for token in re.sub(r"\.h5$", "", name).split("___")[1:]:
+        key, _, value = token.partition("-")
+        params[key] = value
+
+    context = params.get("context")
+    context_param = None
+    k_ratio = None
+    threshold = None
+    if context is not None:
+        m = re.fullmatch(r"(.*?)-([0-9.]+)(percent)?", context)
+        if m is not None:
+            context, context_param = m.group(1), float(m.group(2))
+            if context.startswith("topk"):
+                k_ratio = round(context_param / 100, 12)
+            elif context.startswith("threshold"):
+                threshold = context_param
+
+    return dict(
+        prefix=params.get("prefix"),
+        context=context,
+        context_param=context_param,
+        lang=params.get("lang"),
+        data=params.get("data"),
+        k_ratio=k_ratio,
+        threshold=threshold,
+        n_repeat=int(params["repeat"]) if "repeat" in params else None,
+        memory_backend=params.get("memory_backend"),
+        timing_mode="separate" if params.get("timing") == "separate" else "combined")
+
+
+def derive_n_threads(algorithm):
+    """Number of threads from the `_nthreads-<n>` suffix of an experiment name (see `benchmark.py`)."""
+    m = re.search(r"_nthreads-(\d+)$", algorithm)
+    return int(m.group(1)) if m is not None else 1
+
+
+def to_sql(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def to_json(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
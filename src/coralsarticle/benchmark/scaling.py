@@ -0,0 +1,313 @@
+"""
+Strong and weak scaling sweeps.
+
+A sweep runs one base experiment for a list of worker counts and reports speedup, parallel efficiency
+and the serial fraction, instead of listing every worker count as a separate experiment.
+Sweeps are configured in YAML files (see `config/scaling`) with the usual `context` plus a `sweep` section:
+
+```yaml
+sweep:
+  algorithm: topk_balltree_combined_tree_optimized_parallel_{n_jobs}
+  n_jobs: [1, 2, 4, 8, 16, 32, 64]
+  mode: strong          # or `weak`
+  data: cancer_postprocessed_nonegatives_dropduplicates_sample-1.00
+```
+
+Worker counts fill the `{n_jobs}` placeholder of the registry's experiment templates (see `registry/base.py`);
+algorithms without placeholder are swept over `n_threads` instead (e.g., BLAS threads of `cor_*`).
+
+* `strong`: fixed data; speedup `S(p) = p_0 T(p_0) / T(p)`, efficiency `E(p) = S(p) / p`,
+  serial fraction from a least-squares fit of Amdahl's law `T(p) = T_s + T_p / p`.
+* `weak`: data grows with workers; `data` gives the synthetic base dataset for one worker (`m`, `n`, `seed`)
+  and features are scaled by `p^(1 / work_exponent)`, so the work per worker stays constant
+  (`work_exponent: 2` for all-pairs correlation); efficiency `E(p) = T(p_0) / T(p)`,
+  scaled speedup `S(p) = p E(p)`, serial fraction from a least-squares fit of Gustafson's law `S(p) = f + (1 - f) p`.
+
+In both modes, the Karp-Flatt metric `e(p) = (1 / S(p) - 1 / p) / (1 - 1 / p)` gives the experimentally
+determined serial fraction per worker count (a growing `e(p)` indicates parallel overhead rather than serial code).
+
+Runs are appended to the results store (see `results.py`), from which the median runtime of the latest run
+of each point is taken. The report is written as JSON to `_out/benchmark/scaling/<config>.json`.
+"""
+import coralsarticle.benchmark.scheduler as scheduler
+import coralsarticle.benchmark.resources as resources
+import coralsarticle.benchmark.results as results
+import collections
+import datetime
+import pathlib
+import json
+import yaml
+import click
+
+import numpy as np
+
+
+SCALING_MODES = ["strong", "weak"]
+
+
+Point = collections.namedtuple("Point", ["n_workers", "algorithm", "n_threads", "data"])
+
+
+@click.command()
+@click.option("-c", "--config_file", default="config/scaling/bench_topk_scaling_strong.yml", help="Sweep config file")
+@click.option("-o", "--overwrite", is_flag=True, help="Overwrite if experiment exists.")
+@click.option("-e", "--conda_env", default="benchmark", help="Environment used to execute benchmarks.")
+@click.option("--journal", "journal_file", default=None, help="Job status journal (default: `_out/benchmark/journal/<config>.jsonl`).")
+@click.option("--ignore_journal", is_flag=True, help="Rerun jobs even if the journal marks them as done.")
+@click.option("--analyze_only", is_flag=True, help="Only analyze runs already in the results store.")
+@click.option("--out_dir", default="_out/benchmark/scaling", help="Directory of scaling reports.")
+def run(config_file, overwrite, conda_env, journal_file, ignore_journal, analyze_only, out_dir):
+
+    benchmark_python = pathlib.Path("src/coralsarticle/benchmark/algorithms/python/benchmark.py")
+
+    # load config
+    with open(config_file, 'r') as stream:
+        config = yaml.safe_load(stream)
+
+    context = config["context"]
+    sweep = config["sweep"]
+    prefix = context.get("prefix", "scaling")
+    n_threads = context.get("n_threads", 1)
+    n_repeat = context.get("n_repeat", 1)
+    k_ratio = context.get("k_ratio", 0.001)
+    threshold = context.get("threshold", 0.9)
+
+    # runs are analyzed from the results store
+    python_context = dict(context.get("python", {}))
+    python_context.setdefault("results_store", results.RESULTS_STORE)
+
+    mode = sweep.get("mode", "strong")
+    if mode not in SCALING_MODES:
+        raise click.BadParameter(f"Unknown scaling mode: {mode}")
+
+    points = derive_points(
+        sweep["algorithm"],
+        sweep["n_jobs"],
+        mode=mode,
+        data=sweep["data"],
+        n_threads=n_threads,
+        work_exponent=sweep.get("work_exponent", 2))
+
+    if not analyze_only:
+
+        jobs = []
+        for point in points:
+            cmd = f"python {benchmark_python}" + \
+                resources.derive_python_options(python_context) + \
+                f" --prefix {prefix}" + \
+                f" --exp {point.algorithm}" + \
+                f" --data {point.data}" + \
+                f" --k_ratio {k_ratio}" + \
+                f" --threshold {threshold}" + \
+                f" --n_repeat {n_repeat}" + \
+                f" --n_threads {point.n_threads}" + \
+                f" --overwrite {overwrite}"
+            # scaling timings must not be contaminated by other jobs
+            jobs.append(scheduler.Job(
+                id=scheduler.derive_job_id(cmd),
+                cmd=cmd,
+                name=f"python/{point.algorithm}/{point.data}",
+                n_cores=scheduler.derive_n_cores(point.algorithm, point.n_threads),
+                memory=None,
+                exclusive=True))
+
+        # journal
+        if journal_file is None:
+            journal_file = pathlib.Path("_out/benchmark/journal") / f"{pathlib.Path(config_file).stem}.jsonl"
+        journal = scheduler.Journal(journal_file)
+        if not ignore_journal:
+            status = scheduler.load_journal(journal_file)
+            jobs_done = [j for j in jobs if status.get(j.id) == "done"]
+            if len(jobs_done) > 0:
+                print(f"Skipping {len(jobs_done)} jobs marked as done in journal: {journal_file}")
+            jobs = [j for j in jobs if status.get(j.id) != "done"]
+
+        print()
+        print("############################################################")
+        print(f"Context:    {context}")
+        print(f"Sweep:      {sweep}")
+        print(f"Jobs:       {len(jobs)}")
+        print(f"Journal:    {journal_file}")
+        print("############################################################")
+
+        print()
+        print("Running experiments:")
+        scheduler.run_sequential(jobs, journal, conda_env=conda_env)
+
+    # analyze
+    print()
+    print(f"Loading runs from results store: {python_context['results_store']}")
+    store = results.ResultsStore(python_context["results_store"])
+    measurements = [load_runtimes(store, prefix, point) for point in points]
+    missing = [p for p, m in zip(points, measurements) if m is None]
+    for point in missing:
+        print(f"* WARNING: No runs found for: {point.algorithm} ({point.n_threads} threads) on {point.data}")
+    points = [p for p, m in zip(points, measurements) if m is not None]
+    measurements = [m for m in measurements if m is not None]
+    if len(points) == 0:
+        raise click.ClickException("No runs found to analyze.")
+
+    report = analyze(
+        [p.n_workers for p in points],
+        [np.median(m) for m in measurements],
+        mode=mode)
+    for point, m, row in zip(points, measurements, report["points"]):
+        q25, q75 = np.percentile(m, [25, 75])
+        row.update(
+            algorithm=point.algorithm,
+            n_threads=point.n_threads,
+            data=point.data,
+            runtime_iqr=float(q75 - q25),
+            runtime_samples=[float(r) for r in m])
+    report = collections.OrderedDict(
+        config=str(config_file),
+        created=datetime.datetime.now().isoformat(),
+        context=context,
+        sweep=sweep,
+        **report)
+
+    print()
+    print(f"{'workers':>8} {'runtime':>10} {'speedup':>8} {'efficiency':>10} {'karp-flatt':>10}")
+    for row in report["points"]:
+        karp_flatt = "-" if row["karp_flatt"] is None else f"{row['karp_flatt']:.3f}"
+        print(f"{row['n_workers']:>8} {row['runtime']:>10.3f} {row['speedup']:>8.2f} {row['efficiency']:>10.2f} {karp_flatt:>10}")
+    print(f"Serial fraction ({report['fit']['model']}): {report['fit']['serial_fraction']:.4f}")
+
+    out_file = pathlib.Path(out_dir) / f"{pathlib.Path(config_file).stem}.json"
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to: {out_file}")
+
+
+def derive_points(algorithm, n_workers, mode="strong", data=None, n_threads=1, work_exponent=2):
+    """
+    Derives the experiments of a sweep (see module documentation).
+    Synthetic datasets (`data` given as dict with `m`, `n` and optionally `seed`) are created if necessary.
+    """
+
+    points = []
+    for p in sorted(n_workers):
+
+        # workers as parallel jobs (registry template) or threads
+        if "{n_jobs}" in algorithm:
+            algorithm_point, n_threads_point = algorithm.format(n_jobs=p), n_threads
+        else:
+            algorithm_point, n_threads_point = algorithm, p
+
+        if isinstance(data, dict):
+            n = data["n"]
+            if mode == "weak":
+                n = int(round(n * p ** (1 / work_exponent)))
+            data_point = create_synthetic_data(m=data["m"], n=n, seed=data.get("seed"))
+        elif mode == "weak":
+            raise ValueError("Weak scaling requires a synthetic base dataset (`m`, `n`, `seed`).")
+        else:
+            data_point = data
+
+        points.append(Point(n_workers=p, algorithm=algorithm_point, n_threads=n_threads_point, data=data_point))
+
+    return points
+
+
+def create_synthetic_data(m, n, seed=None, data_dir="./data"):
+    from coralsarticle.data.utils import load_data
+    name, _ = load_data(dataset="synthetic_mn", m=m, n=n, seed=seed, data_dir=data_dir)
+    return name
+
+
+def load_runtimes(store, prefix, point):
+    """Runtime samples of the latest run of a point in the results store; `None` if there is none."""
+
+    algorithm = point.algorithm + ("" if point.n_threads == 1 else f"_nthreads-{point.n_threads}")
+    df = store.query(data=point.data, algorithm=algorithm, n_threads=point.n_threads, prefix=prefix)
+    df = df[df["runtime"].notna()]
+    if len(df) == 0:
+        return None
+    latest = df.loc[df["timestamp"].idxmax(), "id"]
+    return df.loc[df["id"] == latest, "runtime"].to_numpy()
+
+
+def analyze(n_workers, runtimes, mode="strong"):
+    """
+    Computes speedup, efficiency and Karp-Flatt metric per worker count
+    and fits the serial fraction (see module documentation).
+    Measurements are relative to the smallest worker count.
+    """
+
+    order = np.argsort(n_workers)
+    p = np.asarray(n_workers, dtype=float)[order]
+    t = np.asarray(runtimes, dtype=float)[order]
+
+    if mode == "strong":
+        # assume perfect scaling up to the smallest worker count
+        speedup = p[0] * t[0] / t
+        efficiency = speedup / p
+    elif mode == "weak":
+        efficiency = t[0] / t
+        speedup = p * efficiency
+    else:
+        raise ValueError(f"Unknown scaling mode: {mode}")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        karp_flatt = (1 / speedup - 1 / p) / (1 - 1 / p)
+
+    points = []
+    for i in range(len(p)):
+        points.append(collections.OrderedDict(
+            n_workers=int(p[i]),
+            runtime=float(t[i]),
+            speedup=float(speedup[i]),
+            efficiency=float(efficiency[i]),
+            karp_flatt=float(karp_flatt[i]) if p[i] > 1 else None))
+
+    fit = fit_amdahl(p, t) if mode == "strong" else fit_gustafson(p, speedup)
+    return collections.OrderedDict(mode=mode, points=points, fit=fit)
+
+
+def fit_amdahl(p, t):
+    """Least-squares fit of `T(p) = T_s + T_p / p` (with `T_s, T_p >= 0`)."""
+
+    A = np.stack([np.ones_like(p), 1 / p], axis=1)
+    if len(np.unique(p)) > 1:
+        (t_serial, t_parallel), *_ = np.linalg.lstsq(A, t, rcond=None)
+    else:
+        t_serial, t_parallel = 0., t[0] * p[0]
+    # constrained solutions lie on the boundary
+    if t_serial < 0:
+        t_serial, t_parallel = 0., np.sum(t / p) / np.sum(1 / p**2)
+    elif t_parallel < 0:
+        t_serial, t_parallel = np.mean(t), 0.
+
+    serial_fraction = t_serial / (t_serial + t_parallel) if t_serial + t_parallel > 0 else 0.
+    predicted = t_serial + t_parallel / p
+    return collections.OrderedDict(
+        model="amdahl",
+        serial_fraction=float(serial_fraction),
+        runtime_serial=float(t_serial),
+        runtime_parallel=float(t_parallel),
+        max_speedup=float(1 / serial_fraction) if serial_fraction > 0 else None,
+        r2=r2(t, predicted))
+
+
+def fit_gustafson(p, speedup):
+    """Least-squares fit of `S(p) = f + (1 - f) p` (with `0 <= f <= 1`)."""
+
+    denominator = np.sum((1 - p)**2)
+    f = np.sum((speedup - p) * (1 - p)) / denominator if denominator > 0 else 0.
+    f = float(np.clip(f, 0, 1))
+    return collections.OrderedDict(
+        model="gustafson",
+        serial_fraction=f,
+        r2=r2(speedup, f + (1 - f) * p))
+
+
+def r2(y, predicted):
+    ss_total = np.sum((y - np.mean(y))**2)
+    if ss_total == 0:
+        return None
+    return float(1 - np.sum((y - predicted)**2) / ss_total)
+
+
+if __name__ == "__main__":
+    run()
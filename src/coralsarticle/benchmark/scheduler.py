@@ -0,0 +1,227 @@
+"""
+Resource-aware scheduling of benchmark jobs.
+
+Jobs are packed onto the machine based on the number of cores they declare and an estimate of their memory footprint.
+Exclusive jobs (e.g., parallel timing experiments) only run when nothing else is running
+such that their measurements are not contaminated by other jobs.
+
+Every job's status is written to a journal (one JSON object per line),
+so an interrupted sweep can be resumed by skipping jobs that are already done.
+"""
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import re
+import subprocess
+import threading
+
+from coralsarticle.utils import execute
+
+
+Job = collections.namedtuple("Job", ["id", "cmd", "name", "n_cores", "memory", "exclusive"])
+
+
+# algorithms that materialize the full correlation matrix (or more)
+FULL_MATRIX_REGEX = r"^(cor_|topk_corrcoef|topk_matrix|topk_partition|threshold_matrix|topkdiff_matrix)"
+
+# algorithms that stream memory-mapped data and size their blocks to a quarter of the available memory (see `outofcore.py`)
+OUTOFCORE_REGEX = r"^(topk|threshold)_outofcore_"
+
+
+def derive_job_id(cmd):
+    return "job-" + hashlib.sha1(cmd.encode("utf-8")).hexdigest()[:12]
+
+
+def derive_n_cores(algorithm, n_threads):
+    """Number of cores a job occupies: the maximum of its threads and the number of parallel jobs in its name."""
+    match = re.search(r"_parallel_(\d+)$", algorithm)
+    n_jobs = int(match.group(1)) if match else 1
+    return max(n_threads, n_jobs)
+
+
+def estimate_memory(algorithm, shape, lang="python", k_ratio=0.001):
+    """
+    Rough estimate of the peak memory (in bytes) of a benchmark job.
+
+    This errs on the large side; if a more accurate value is known,
+    it can be set via the `memory` key (in Gb) of an experiment in the config file.
+    """
+
+    # interpreter and libraries
+    memory = 2 * 1024**3 if lang in ("julia", "r") else 512 * 1024**2
+
+    if shape is None:
+        return memory
+
+    m, n = shape
+
+    if re.match(OUTOFCORE_REGEX, algorithm):
+        # block memory budget, column statistics and (values, row index, column index) for 3k top-k candidates
+        memory_available = derive_memory_available()
+        memory += memory_available // 4 if memory_available is not None else 3 * m * n * 8
+        memory += 2 * n * 8 + int(3 * n * n * k_ratio) * 24
+        return memory
+
+    # data, normalized copy and temporary copies during loading
+    memory += 3 * m * n * 8
+
+    if re.match(FULL_MATRIX_REGEX, algorithm):
+        # correlation matrix plus flattened / absolute copies for sorting
+        memory += 3 * n * n * 8
+    else:
+        # (values, row index, column index) for the top-k candidates
+        memory += int(10 * n * n * k_ratio) * 24
+
+    return memory
+
+
+def derive_memory_available():
+    """Available memory in bytes (Linux only); `None` if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def load_journal(journal_file):
+    """Returns the last recorded status for each job id."""
+
+    status = collections.OrderedDict()
+
+    journal_file = pathlib.Path(journal_file)
+    if not journal_file.exists():
+        return status
+
+    with open(journal_file, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # partially written line of an interrupted run
+                continue
+            status[entry["job"]] = entry["status"]
+
+    return status
+
+
+class Journal():
+
+    def __init__(self, journal_file):
+        self.journal_file = pathlib.Path(journal_file)
+        self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def write(self, job, status, **kwargs):
+        entry = collections.OrderedDict(
+            job=job.id,
+            status=status,
+            time=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            name=job.name,
+            **kwargs)
+        with self.lock:
+            with open(self.journal_file, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def run_sequential(jobs, journal, conda_env=None):
+    """Runs jobs one after another; stops at the first failing job (as before)."""
+
+    for job in jobs:
+        print()
+        print("############################################################")
+        print(f"Job:        {job.name} ({job.id})")
+        print("############################################################")
+
+        journal.write(job, "started", cmd=job.cmd)
+        try:
+            execute(job.cmd, conda_env=conda_env)
+        except subprocess.CalledProcessError as e:
+            journal.write(job, "failed", return_code=e.returncode)
+            raise
+        journal.write(job, "done")
+
+
+def run_parallel(jobs, journal, max_cores, max_memory=None, conda_env=None, log_dir="_out/benchmark/logs"):
+    """
+    Runs jobs concurrently while respecting core and memory limits.
+
+    Jobs are started in order (first fit).
+    If the next exclusive job cannot be started, no further jobs are started
+    until the machine has been drained, so exclusive jobs are never starved.
+
+    Returns the list of failed jobs.
+    """
+
+    log_dir = pathlib.Path(log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    def run_job(job):
+        execute(job.cmd, conda_env=conda_env, log_file=log_dir / f"{job.id}.log")
+
+    def clamp(job):
+        # jobs exceeding the machine run alone
+        n_cores = min(job.n_cores, max_cores)
+        memory = job.memory if max_memory is None else min(job.memory, max_memory)
+        exclusive = job.exclusive \
+            or job.n_cores >= max_cores \
+            or (max_memory is not None and job.memory >= max_memory)
+        return job._replace(n_cores=n_cores, memory=memory, exclusive=exclusive)
+
+    pending = [clamp(job) for job in jobs]
+    running = {}
+    failed = []
+
+    def fits(job):
+        if job.exclusive:
+            return len(running) == 0
+        if any(j.exclusive for j in running.values()):
+            return False
+        cores_used = sum(j.n_cores for j in running.values())
+        memory_used = sum(j.memory for j in running.values())
+        if cores_used + job.n_cores > max_cores:
+            return False
+        if max_memory is not None and memory_used + job.memory > max_memory:
+            return False
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_cores) as executor:
+
+        while pending or running:
+
+            # start as many jobs as possible
+            for job in list(pending):
+                if fits(job):
+                    pending.remove(job)
+                    journal.write(job, "started", cmd=job.cmd)
+                    print(f"* Start:  {job.name} ({job.id}; cores: {job.n_cores}; memory: {job.memory / 1024**3:.01f}Gb{'; exclusive' if job.exclusive else ''})")
+                    running[executor.submit(run_job, job)] = job
+                elif job.exclusive:
+                    break
+
+            # wait for jobs to finish
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    future.result()
+                    journal.write(job, "done")
+                    print(f"* Done:   {job.name} ({job.id})")
+                except subprocess.CalledProcessError as e:
+                    journal.write(job, "failed", return_code=e.returncode)
+                    print(f"* FAILED: {job.name} ({job.id}; see {log_dir / f'{job.id}.log'})")
+                    failed.append(job)
+
+    return failed
@@ -1,12 +1,14 @@
 import logging
+import os
+import pathlib
 import re
 
+import h5py
+import numpy as np
 import pandas as pd
 
-import pandas as pd
-from rpy2 import robjects
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.conversion import localconverter
+import coralsarticle.data.cache
+import coralsarticle.data.rmatrix
 
 logger = logging.getLogger(__name__)
 
@@ -71,38 +73,36 @@ pregnancy_multiomics_subset_info = {
         pregnancy_multiomics_subset_names_full_short)}
 
 
-def load_pregnancy_multiomics_data(data_file="../data/raw/pregnancy.rda"):
-    
-    # loading Cellfree RNA','PlasmaLuminex','SerumLuminex','Microbiome','ImmuneSystem','Metabolomics', 'PlasmaSomalogic'
-    # see README
-    robjects.r['load'](data_file)
-    serum_luminex =    _load_matrix(robjects.r["InputData"][2])
-    plasma_luminex =   _load_matrix(robjects.r["InputData"][1])
-    microbiome =       _load_matrix(robjects.r["InputData"][3])
-    cellfree_rna =     _load_matrix(robjects.r["InputData"][0])
-    immune_system =    _load_matrix(robjects.r["InputData"][4])
-    metabolomics =     _load_matrix(robjects.r["InputData"][5])
-    plasma_somalogic = _load_matrix(robjects.r["InputData"][6])
-    
+def load_pregnancy_multiomics_data(data_file="../data/raw/pregnancy.rda", cache_dir="../data/cache"):
+    """
+    Loads the pregnancy multiomics data as a single DataFrame (feature groups as first column level).
+
+    The converted feature groups are cached (see `coralsarticle.data.cache.DatasetCache`)
+    under a key derived from the data file and the conversion code, so only the first call needs R.
+    Set `cache_dir=None` to always load the data via R.
+    """
+
+    if cache_dir is None:
+        subsets = _load_subsets_r(data_file)
+    else:
+        cache = coralsarticle.data.cache.DatasetCache(cache_dir)
+        stat = os.stat(data_file)
+        provenance = dict(
+            dataset="pregnancy_multiomics",
+            data_file=str(pathlib.Path(data_file).resolve()),
+            data_file_size=stat.st_size,
+            data_file_mtime_ns=stat.st_mtime_ns,
+            code=coralsarticle.data.cache.derive_code_version(
+                _load_subsets_r, _load_matrix, load_r_matrix, coralsarticle.data.rmatrix))
+        key = cache.key(**provenance)
+        path = cache.get_or_create(
+            key, lambda p: _save_subsets(p, _load_subsets_r(data_file)), provenance=provenance)
+        subsets = _load_subsets(path)
+
     # combine datasets
     data = pd.concat(
-        [
-            cellfree_rna, 
-            plasma_luminex, 
-            serum_luminex, 
-            microbiome, 
-            immune_system, 
-            metabolomics, 
-            plasma_somalogic
-        ], 
-        keys=[
-            "cellfree_rna", 
-            "plasma_luminex", 
-            "serum_luminex", 
-            "microbiome",           # check
-            "immune_system", 
-            "metabolomics", 
-            "plasma_somalogic"],    # check
+        [subsets[s] for s in pregnancy_multiomics_subsets],
+        keys=pregnancy_multiomics_subsets,
         axis=1)
     
     # divide study id and term
@@ -112,6 +112,41 @@ def load_pregnancy_multiomics_data(data_file="../data/raw/pregnancy.rda"):
     return data
 
 
+def _load_subsets_r(data_file):
+    """Loads feature groups via R; the returned DataFrames are views of R's memory."""
+
+    from rpy2 import robjects
+
+    # loading Cellfree RNA','PlasmaLuminex','SerumLuminex','Microbiome','ImmuneSystem','Metabolomics', 'PlasmaSomalogic'
+    # see README
+    robjects.r['load'](data_file)
+    input_data = robjects.r["InputData"]
+    return {s: _load_matrix(input_data[i]) for i, s in enumerate(pregnancy_multiomics_subsets)}
+
+
+def _save_subsets(path, subsets):
+    with h5py.File(path, "w") as f:
+        for s, df in subsets.items():
+            g = f.create_group(s)
+            # R matrices are column-major, so their transpose can be written without copying
+            g["data"] = df.values.T
+            g["rownames"] = np.array(df.index, dtype=h5py.string_dtype())
+            g["colnames"] = np.array(df.columns, dtype=h5py.string_dtype())
+
+
+def _load_subsets(path):
+    subsets = {}
+    with h5py.File(path, "r") as f:
+        for s in pregnancy_multiomics_subsets:
+            g = f[s]
+            subsets[s] = pd.DataFrame(
+                g["data"][()].T,
+                index=g["rownames"].asstr()[()],
+                columns=g["colnames"].asstr()[()],
+                copy=False)
+    return subsets
+
+
 def _load_matrix(r_matrix, skip_colnames=False, number=True):
 
     df = load_r_matrix(r_matrix, read_colnames=not skip_colnames, colname_formatter="number" if number else None)
@@ -127,49 +162,31 @@ def _load_matrix(r_matrix, skip_colnames=False, number=True):
 def load_r_matrix(
         r_matrix, read_rownames=True, read_colnames=True,
         rowname_formatter=None, colname_formatter=None, name_encoding="latin1"):
+    """
+    Returns an R matrix as DataFrame backed by R's memory (see `coralsarticle.data.rmatrix.r_matrix_to_numpy`).
+
+    Name formatters are either `"number"` (prefix names with their position) or functions `formatter(i, name)`.
+    """
+
+    from rpy2 import robjects
 
     if isinstance(r_matrix, str):
         r_matrix = robjects.r[r_matrix]
 
-    if rowname_formatter == "number":
-        def rowname_formatter(i, rowname):
-            if rowname is None:
-                return str(i)
-            else:
-                return "{}_{}".format(i, rowname)
-
-    if colname_formatter == "number":
-        def colname_formatter(i, colname):
-            if colname is None:
-                return str(i)
-            else:
-                return "{}_{}".format(i, colname)
-
-    # handle rownames
-    if read_rownames:
-        rownames = robjects.r["rownames"](r_matrix)
-        if name_encoding is not None:
-            rownames = robjects.r("iconv")(rownames, name_encoding, "UTF-8")
-        if rowname_formatter is not None:
-            rownames = [rowname_formatter(i, r) for i, r in enumerate(rownames)]
-    else:
-        if rowname_formatter is not None:
-            rownames = [rowname_formatter(i, None) for i in range(robjects.r["dim"](r_matrix)[0])]
-        else:
-            rownames = None
-
-    # handle colnames
-    if read_colnames:
-        colnames = robjects.r["colnames"](r_matrix)
-        if name_encoding is not None:
-            colnames = robjects.r("iconv")(colnames, name_encoding, "UTF-8", sub='???')
-        if colname_formatter is not None:
-            colnames = [colname_formatter(i, colname) for i, colname in enumerate(colnames)]
-    else:
-        if colname_formatter is not None:
-            colnames = [colname_formatter(i, None) for i in range(robjects.r["dim"](r_matrix)[1])]
-        else:
-            colnames = None
+    X = coralsarticle.data.rmatrix.r_matrix_to_numpy(r_matrix)
+    rownames = _load_names(r_matrix, 0, X.shape[0], read_rownames, rowname_formatter, name_encoding)
+    colnames = _load_names(r_matrix, 1, X.shape[1], read_colnames, colname_formatter, name_encoding, sub="???")
+
+    return pd.DataFrame(X, index=rownames, columns=colnames, copy=False)
+
 
-    with localconverter(robjects.default_converter + pandas2ri.converter):
-        return pd.DataFrame(robjects.conversion.rpy2py(r_matrix), index=rownames, columns=colnames)
+def _load_names(r_matrix, axis, n, read, formatter, encoding, sub=None):
+
+    names = coralsarticle.data.rmatrix.r_names(r_matrix, axis, encoding=encoding, sub=sub) if read else None
+
+    if formatter == "number":
+        return coralsarticle.data.rmatrix.number_names(names, n)
+    elif formatter is not None:
+        return [formatter(i, name) for i, name in enumerate(names if names is not None else [None] * n)]
+    else:
+        return names
@@ -0,0 +1,201 @@
+"""
+Blocked reading of memory-mapped matrices.
+
+Iterating a memory map element by element (or row by row across columns) is slow,
+while touching it all at once loads everything into memory (see `benchmark/test_memmap.py`).
+`iter_blocks` reads a memory-mapped matrix in blocks of a given size along one axis and
+passes access-pattern hints to the kernel (`madvise`):
+
+* `normal`: default read-ahead
+* `sequential`: aggressive read-ahead; pages may be dropped soon after being read
+* `willneed`: prefetch the next block while the current one is processed
+* `random`: no read-ahead
+
+With `release`, pages of processed blocks are released from the process (`MADV_DONTNEED`),
+so its memory (RSS/USS) stays flat; the data stays in the page cache.
+Blocks along the contiguous axis (columns of column-major / rows of row-major matrices)
+map to contiguous byte ranges; otherwise, hints apply to all memory spanned by the matrix
+(e.g., a column slice of a row-major matrix; see `byte_span`) and pages are released after the last block.
+
+The block size and hint working best on a machine are measured by `coralsarticle/benchmark/blocked_io.py`,
+which writes a recommendation per axis and layout (see `load_recommendation`) used by default.
+"""
+import ctypes
+import json
+import mmap
+import os
+import pathlib
+
+import numpy as np
+
+
+RECOMMENDATION_FILE = "_out/benchmark/blocked_io.json"
+
+DEFAULT_BLOCK_BYTES = 2**26
+DEFAULT_ADVICE = "normal"
+
+ADVICE = {
+    "normal": mmap.MADV_NORMAL,
+    "sequential": mmap.MADV_SEQUENTIAL,
+    "willneed": mmap.MADV_WILLNEED,
+    "random": mmap.MADV_RANDOM,
+}
+
+PAGE_SIZE = mmap.PAGESIZE
+
+LIBC = ctypes.CDLL(None, use_errno=True)
+
+
+def load_recommendation(path=RECOMMENDATION_FILE, layout="F", axis="columns"):
+    """
+    Returns the recommended `block_bytes` and `advice` for reading blocks along `axis` (`columns` or `rows`)
+    of matrices of the given layout (`F`: column-major, `C`: row-major)
+    or defaults if there is no recommendation for this machine.
+    """
+
+    recommendation = dict(block_bytes=DEFAULT_BLOCK_BYTES, advice=DEFAULT_ADVICE, source="default")
+    try:
+        with open(path, "r") as f:
+            layouts = json.load(f)["axes"][axis]["layouts"]
+    except (OSError, ValueError, KeyError):
+        return recommendation
+    if layout in layouts:
+        recommendation.update(
+            block_bytes=int(layouts[layout]["block_bytes"]),
+            advice=layouts[layout]["advice"],
+            source=str(path))
+    return recommendation
+
+
+def iter_blocks(X, block_bytes=None, axis=1, advice=None, release=True):
+    """
+    Yields `(start, stop, block)` with views of `X` of about `block_bytes` along `axis` (see module documentation).
+    Views must not be used after the next block was requested if `release` is set; copy them if necessary.
+    Defaults for `block_bytes` and `advice` are taken from `load_recommendation`.
+    """
+
+    if block_bytes is None or advice is None:
+        recommendation = load_recommendation(
+            layout="F" if X.flags.f_contiguous else "C", axis="columns" if axis == 1 else "rows")
+        block_bytes = recommendation["block_bytes"] if block_bytes is None else block_bytes
+        advice = recommendation["advice"] if advice is None else advice
+    if advice not in ADVICE:
+        raise ValueError(f"Unknown advice: {advice}")
+
+    n = X.shape[axis]
+    slice_bytes = max(1, X.size // max(1, n) * X.itemsize)
+    block_size = int(max(1, block_bytes // slice_bytes))
+
+    mapped = is_mapped(X)
+    contiguous = X.flags.f_contiguous if axis == 1 else X.flags.c_contiguous
+    span_start, span_stop = byte_span(X)
+
+    if mapped:
+        # `willneed` is given per block below (for the whole matrix, it would read everything)
+        madvise(X, span_start, span_stop, "normal" if advice == "willneed" else advice)
+
+    for start in range(0, n, block_size):
+        stop = min(n, start + block_size)
+
+        if mapped and contiguous and advice == "willneed":
+            if start == 0:
+                madvise(X, 0, stop * slice_bytes, "willneed")
+            if stop < n:
+                # prefetch the next block while this one is processed
+                madvise(X, stop * slice_bytes, min(n, stop + block_size) * slice_bytes, "willneed")
+
+        yield start, stop, X[:, start:stop] if axis == 1 else X[start:stop]
+
+        if mapped and contiguous and release:
+            release_pages(X, start * slice_bytes, stop * slice_bytes)
+
+    if mapped and not contiguous and release:
+        release_pages(X, span_start, span_stop)
+
+
+def read_block(X, start, stop, axis=1, block_bytes=None, advice=None, dtype=np.float64):
+    """Copies `X[:, start:stop]` (`axis=1`) or `X[start:stop]` (`axis=0`) by reading it via `iter_blocks`."""
+
+    view = X[:, start:stop] if axis == 1 else X[start:stop]
+    out = np.empty(view.shape, dtype=dtype, order="F" if axis == 1 else "C")
+    for a, b, block in iter_blocks(view, block_bytes=block_bytes, axis=axis, advice=advice):
+        if axis == 1:
+            out[:, a:b] = block
+        else:
+            out[a:b] = block
+    return out
+
+
+def is_mapped(X):
+    """Whether `X` is a read-only view of a memory map (so its pages can be released safely)."""
+    if X.flags.writeable:
+        return False
+    base = X
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return True
+        base = getattr(base, "base", None)
+    return False
+
+
+def byte_span(X):
+    """
+    Bytes `start:stop` (relative to `X.ctypes.data`) from the first to the last element of `X`,
+    which exceed `X.nbytes` for non-contiguous views.
+    """
+    if X.size == 0:
+        return 0, 0
+    start = sum(min(0, (s - 1) * stride) for s, stride in zip(X.shape, X.strides))
+    stop = sum(max(0, (s - 1) * stride) for s, stride in zip(X.shape, X.strides)) + X.itemsize
+    return start, stop
+
+
+def madvise(X, start, stop, advice):
+    """Passes `advice` for the bytes `start:stop` of `X`'s memory (aligned to pages); ignored where not supported."""
+
+    address = X.ctypes.data + start
+    aligned = address - address % PAGE_SIZE
+    length = X.ctypes.data + stop - aligned
+    if length <= 0:
+        return
+    LIBC.madvise(ctypes.c_void_p(aligned), ctypes.c_size_t(length), ctypes.c_int(ADVICE.get(advice, advice)))
+
+
+def release_pages(X, start, stop):
+    # only whole pages within the range, so neighboring blocks are not affected
+    address = X.ctypes.data + start
+    first = address + (-address) % PAGE_SIZE
+    last = X.ctypes.data + stop
+    last -= last % PAGE_SIZE
+    if last > first:
+        madvise(X, first - X.ctypes.data, last - X.ctypes.data, mmap.MADV_DONTNEED)
+
+
+def evict_page_cache(path):
+    """Drops clean pages of a file from the page cache (so reads are cold); no root required."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def save_matrix(path, shape, layout="F", block_bytes=DEFAULT_BLOCK_BYTES, seed=0):
+    """Writes a random matrix in the given layout to a `.npy` file block by block (e.g., to test reading)."""
+
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    random = np.random.RandomState(seed)
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=shape, fortran_order=layout == "F")
+    axis = 1 if layout == "F" else 0
+    n = shape[axis]
+    block_size = max(1, block_bytes // (shape[1 - axis] * 8))
+    for start in range(0, n, block_size):
+        stop = min(n, start + block_size)
+        if axis == 1:
+            out[:, start:stop] = random.random_sample((shape[0], stop - start))
+        else:
+            out[start:stop] = random.random_sample((stop - start, shape[1]))
+    out.flush()
+    del out
+    return path
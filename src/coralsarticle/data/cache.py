@@ -0,0 +1,201 @@
+"""
+Content-addressed dataset cache.
+
+Datasets are stored under a key derived from everything that determines their content
+(dataset parameters, preprocessing flags, seed, code version; see `DatasetCache.key`),
+so changed parameters or code never reuse stale files.
+Entries are written to a temporary file and atomically renamed,
+producers of the same entry are serialized via a lock file,
+and the least recently used entries are evicted if the cache exceeds its disk budget.
+
+Benchmarks still read datasets by name (`data/benchmark/<name>.h5`);
+these files are published from the cache (see `DatasetCache.publish`)
+and carry the key of their cache entry as `provenance_key` attribute.
+Evicting an entry also removes its published files (they would keep its space in use);
+`coralsarticle.data.utils.load_data` recreates them when needed.
+"""
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import h5py
+
+
+class DatasetCache:
+
+    def __init__(self, cache_dir="data/cache", max_bytes=None):
+        """
+        Parameters
+        ----------
+        cache_dir: str or pathlib.Path
+            Directory of the cache; may be shared by concurrent processes.
+        max_bytes: int, optional
+            Disk budget; least recently used entries are evicted when it is exceeded.
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def key(self, **params):
+        """Derives the key of an entry from JSON serializable parameters."""
+        params_json = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(params_json.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.h5"
+
+    def links_path(self, key):
+        """File listing the paths an entry was published to (one per line)."""
+        return self.cache_dir / f"{key}.links"
+
+    def get(self, key):
+        """Returns the path of an entry (and marks it as recently used) or `None` if it does not exist."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        import fcntl
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / f"{key}.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_create(self, key, create_func, provenance=None):
+        """
+        Returns the path of an entry; if it does not exist, it is created via `create_func(path)`,
+        which must write an h5 file to the given (temporary) path.
+        """
+
+        path = self.get(key)
+        if path is not None:
+            return path
+
+        with self.lock(key):
+
+            # another process may have created the entry in the meantime
+            path = self.get(key)
+            if path is not None:
+                return path
+
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{key}.", suffix=".h5")
+            os.close(fd)
+            try:
+                create_func(pathlib.Path(tmp))
+                with h5py.File(tmp, "a") as f:
+                    f.attrs["provenance_key"] = key
+                    f.attrs["provenance"] = json.dumps(provenance or {}, sort_keys=True, default=str)
+                os.replace(tmp, self.path(key))
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        self.evict(keep=[key])
+        return self.path(key)
+
+    def publish(self, key, path):
+        """
+        Atomically places the entry at `path` (hard link if possible, copy otherwise).
+
+        NOTE: A hard link shares its content with the cache entry, so published files must not be written in place;
+        replace them (see `coralsarticle.data.utils.save_h5`) or remove them first.
+        """
+
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a stale sidecar would shadow the new data (see `coralsarticle.data.utils.load_matrix`)
+        path.with_suffix(".npy").unlink(missing_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            try:
+                os.link(self.path(key), tmp)
+            except OSError:
+                shutil.copyfile(self.path(key), tmp)
+            os.replace(tmp, path)
+            if path.resolve() not in self.links(key):
+                with open(self.links_path(key), "a") as f:
+                    f.write(f"{path.resolve()}\n")
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def links(self, key):
+        """Paths an entry was published to."""
+        try:
+            with open(self.links_path(key), "r") as f:
+                return [pathlib.Path(line.strip()) for line in f if line.strip() != ""]
+        except FileNotFoundError:
+            return []
+
+    def remove(self, key):
+        """Removes an entry together with the files published from it (unless they were replaced since)."""
+        path = self.path(key)
+        for link in self.links(key):
+            try:
+                if os.path.samefile(link, path):
+                    link.unlink()
+            except FileNotFoundError:
+                pass
+        path.unlink(missing_ok=True)
+        self.links_path(key).unlink(missing_ok=True)
+
+    def evict(self, keep=()):
+        """
+        Removes least recently used entries (including their published files, see `remove`)
+        until the cache fits into `max_bytes`.
+        """
+
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for p in self.cache_dir.glob("*.h5"):
+            # skip temporary files of entries being created
+            if p.name.startswith("."):
+                continue
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if p.stem in keep:
+                continue
+            self.remove(p.stem)
+            total -= size
+            print(f"  * evicted from dataset cache: {p.stem}")
+
+
+def read_provenance_key(path):
+    """Returns the cache key of a published dataset or `None` if it was not published from the cache."""
+    with h5py.File(path, "r") as f:
+        key = f.attrs.get("provenance_key", None)
+    if isinstance(key, bytes):
+        key = key.decode("utf-8")
+    return key
+
+
+def derive_code_version(*objs):
+    """Hashes the source code of the given functions or modules."""
+    h = hashlib.sha256()
+    for obj in objs:
+        h.update(inspect.getsource(obj).encode("utf-8"))
+    return h.hexdigest()[:16]
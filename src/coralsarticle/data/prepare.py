@@ -1,7 +1,9 @@
+import coralsarticle.data.cache
 import coralsarticle.data.utils
+import click
 
 
-def prepare_synthetic_data():
+def prepare_synthetic_data(cache=None):
 
     # prepare synthetic data
 
@@ -16,19 +18,20 @@ def prepare_synthetic_data():
 
     synthetic_data = []
     for m, n in synthetic_data_grid:
-        name, X = coralsarticle.data.utils.load_data(dataset="synthetic_mn", m=m, n=n)
+        name, X = coralsarticle.data.utils.load_data(dataset="synthetic_mn", m=m, n=n, cache=cache)
         synthetic_data.append(name)
 
     return synthetic_data
 
 
-def prepare_real_data():
+def prepare_real_data(cache=None):
 
     # prepare real world data
     real_data = []
     real_data_params = dict(
         postprocess_data_negative=True,
-        postprocess_data_drop_duplicates=True)
+        postprocess_data_drop_duplicates=True,
+        cache=cache)
 
     name, _ = coralsarticle.data.utils.load_data(dataset="preeclampsia", **real_data_params)
     real_data.append(name)
@@ -45,22 +48,31 @@ def prepare_real_data():
     name, _ = coralsarticle.data.utils.load_data(dataset="cancer", sample_size=1.00, **real_data_params)
     real_data.append(name)
 
-    name, _ = coralsarticle.data.utils.load_data(dataset="singlecell")
+    name, _ = coralsarticle.data.utils.load_data(dataset="singlecell", cache=cache)
     real_data.append(name)
     
-    name, _ = coralsarticle.data.utils.load_data(dataset="singlecell_large")
+    name, _ = coralsarticle.data.utils.load_data(dataset="singlecell_large", cache=cache)
     real_data.append(name)
     
-    name, X = coralsarticle.data.utils.load_data(dataset_name_prefix="large_", dataset="synthetic_mn", m=500, n=200000)
+    name, X = coralsarticle.data.utils.load_data(dataset_name_prefix="large_", dataset="synthetic_mn", m=500, n=200000, cache=cache)
     real_data.append(name)
 
     return real_data
 
 
-def prepare_all():
-    prepare_synthetic_data()
-    prepare_real_data()
+def prepare_all(cache=None):
+    prepare_synthetic_data(cache=cache)
+    prepare_real_data(cache=cache)
+
+
+@click.command()
+@click.option("--cache_max_gb", default=None, type=float, help="Disk budget (in Gb) of the dataset cache `data/cache` (default: none).")
+def run(cache_max_gb):
+    cache = coralsarticle.data.cache.DatasetCache(
+        "data/cache", 
+        max_bytes=int(cache_max_gb * 1024**3) if cache_max_gb is not None else None)
+    prepare_all(cache=cache)
 
 
 if __name__ == "__main__":
-    prepare_all()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -1,16 +1,181 @@
 import pathlib
+import re
 import numpy as np
 import pandas as pd
-import rpy2.robjects
-import pyreadr
 import h5py
 import click
 
 
+CANCER_TYPE = "stomach"
+OMICS = ['RNA_HiSeq', 'Methylation', 'miRNA', 'RPPA', 'Methylation_site', 'SCNV', 'Mutation']
+
+
 def prepare_data_cancer(
+        input_dir="data/raw/cancer", 
+        output_dir="data/processed",
+        engine="python",
+        chunksize=5000):
+    """
+    Merges the omics of all patients into `<output_dir>/cancer.h5` (patients x features).
+
+    The `python` engine streams each omic through a chunked, typed parser
+    and writes column blocks directly into the output file;
+    the `r` engine is the original R implementation (requires `rpy2` and `pyreadr`).
+    Both apply the same cleaning: rows (features) with missing values and duplicate features are dropped,
+    features are named `<omic><i>`, patients are named like R's `make.names`, 
+    and only patients with all omics are kept (sorted by name);
+    features with non-numeric values are dropped afterwards (keeping the numbering of the remaining features).
+    """
+
+    if engine == "python":
+        prepare_data_cancer_python(input_dir=input_dir, output_dir=output_dir, chunksize=chunksize)
+    elif engine == "r":
+        prepare_data_cancer_r(input_dir=input_dir, output_dir=output_dir)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+
+
+def prepare_data_cancer_python(
+        input_dir="data/raw/cancer", 
+        output_dir="data/processed",
+        chunksize=5000):
+
+    # prepare output dir
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # find omics and read their headers (patients)
+    print("load data (Python)")
+    omics = []
+    for omic in OMICS:
+        file = pathlib.Path(input_dir) / f"{omic}_{CANCER_TYPE}.txt"
+        if file.exists():
+            with open(file, "r") as f:
+                header = f.readline().split()
+            omics.append((omic, file, make_names(header[1:])))
+        else:
+            print(f"Did not find omic: {omic}")
+
+    # inner join on patients
+    if len(omics) == 0:
+        raise ValueError(f"No omics found in: {input_dir}")
+    patients = sorted(set.intersection(*[set(p) for _, _, p in omics]))
+    print(f"Patients: {len(patients)}")
+    if len(patients) == 0:
+        raise ValueError(f"Omics share no patients: {', '.join(str(file) for _, file, _ in omics)}")
+
+    # stream omics into the output file
+    print("writing data")
+    with h5py.File(output_dir / f"cancer.h5", "w") as f:
+
+        data = f.create_dataset(
+            "data", 
+            shape=(len(patients), 0), 
+            maxshape=(len(patients), None), 
+            chunks=(len(patients), max(1, min(chunksize, 2**20 // max(1, len(patients))))),
+            dtype=np.float64)
+        colnames = []
+
+        for omic, file, omic_patients in omics:
+            print(f"Loading: {omic}")
+            idx_patients = pd.Index(omic_patients).get_indexer(patients)
+            seen = set()
+            n_features = 0
+            n_non_numeric = 0
+            for block in read_omic(file, n_patients=len(omic_patients), chunksize=chunksize):
+
+                # drop features with missing values and duplicate features
+                names = pd.Index(block[0])
+                msk = block.notna().all(axis=1).values & ~names.isin(seen)
+                msk[msk] = ~names[msk].duplicated(keep="first")
+                seen.update(names[msk])
+
+                # then drop features with non-numeric values (like the `r` engine, after numbering features)
+                values, numeric = parse_values(block)
+                numbers = np.arange(n_features + 1, n_features + msk.sum() + 1)[numeric[msk]]
+                n_features += msk.sum()
+                n_non_numeric += (msk & ~numeric).sum()
+                values = values[msk & numeric][:, idx_patients].transpose()
+
+                # write column block
+                start = data.shape[1]
+                data.resize(start + values.shape[1], axis=1)
+                data[:, start:] = values
+                colnames.extend(f"{omic}{i}" for i in numbers)
+
+            print(f"* features: {n_features - n_non_numeric} (dropped non-numeric: {n_non_numeric})")
+
+        f["rownames"] = np.array(patients, dtype=h5py.string_dtype())
+        f["colnames"] = np.array(colnames, dtype=h5py.string_dtype())
+
+
+def read_omic(file, n_patients, chunksize=5000):
+    """
+    Reads an omic (features x patients, whitespace separated, with header) in chunks.
+    Feature names are parsed as strings and values as numbers where possible (see `parse_values`);
+    like R's `read.table`, only `NA` marks missing values and `#` starts a comment.
+    """
+    return pd.read_csv(
+        file, 
+        sep=r"\s+", 
+        header=None, 
+        skiprows=1, 
+        names=list(range(n_patients + 1)),
+        dtype={0: str},
+        keep_default_na=False,
+        na_values=["NA"],
+        comment="#",
+        chunksize=chunksize)
+
+
+def parse_values(block):
+    """
+    Returns the values of a chunk (see `read_omic`) as floats and whether each feature (row) is numeric;
+    non-numeric values become `NaN` (like R's `as.numeric`).
+    """
+
+    values = block.iloc[:, 1:]
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in values.dtypes):
+        values = values.to_numpy(dtype=np.float64)
+        return values, np.ones(len(values), dtype=bool)
+
+    missing = values.isna().to_numpy()
+    values = values.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    return values, ~(np.isnan(values) & ~missing).any(axis=1)
+
+
+def make_names(names):
+    """Like R's `make.names(names, unique=TRUE)` (used by `read.table` for column names)."""
+
+    names = [re.sub(r"[^A-Za-z0-9._]", ".", n) for n in names]
+    names = [n if re.match(r"^([A-Za-z]|\.(?![0-9]))", n) else "X" + n for n in names]
+
+    # make unique like R's `make.unique`
+    counts = {}
+    unique = []
+    seen = set(names)
+    for n in names:
+        if n in counts:
+            while True:
+                candidate = f"{n}.{counts[n]}"
+                counts[n] += 1
+                if candidate not in seen:
+                    break
+            seen.add(candidate)
+            unique.append(candidate)
+        else:
+            counts[n] = 1
+            unique.append(n)
+    return unique
+
+
+def prepare_data_cancer_r(
         input_dir="data/raw/cancer", 
         output_dir="data/processed"):
 
+    import rpy2.robjects
+    import pyreadr
+
     # prepare output dir
     output_dir = pathlib.Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -91,11 +256,13 @@ def prepare_data_cancer(
 
 @click.command()
 @click.option("--data_dir", default="./data", type=str)
-def run(data_dir):
+@click.option("--engine", default="python", type=click.Choice(["python", "r"]))
+def run(data_dir, engine):
     prepare_data_cancer(
         input_dir=data_dir + "/raw/cancer",
-        output_dir=data_dir + "/processed")
+        output_dir=data_dir + "/processed",
+        engine=engine)
     
 
 if __name__ == "__main__":
-    prepare_data_cancer()
+    run()
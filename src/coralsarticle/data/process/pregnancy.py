@@ -1,52 +1,50 @@
 import pathlib
 import numpy as np
-import pandas as pd
 import rpy2.robjects
 import h5py
 
+import coralsarticle.data.rmatrix
+
+
+# feature group identifiers (in order of `InputData`)
+FEATURE_GROUPS = [
+    "cellfree_rna",     # 37275
+    "plasma_luminex",   # 62
+    "serum_luminex",    # 62
+    "microbiome",       # 18548
+    "immune_system",    # 534
+    "metabolomics",     # 3485
+    "plasma_somalogic"] # 1300
+
 
 def prepare_data_pregnancy(
     input_file="data/raw/pregnancy.rda", 
     output_dir="data/processed"):
 
-    rpy2.robjects.r(f"""
-        
-        load("{input_file}")
-
-        # feature group identifiers
-        featureGroups <- c(
-                "cellfree_rna",     # 37275
-                "plasma_luminex",   # 62
-                "serum_luminex",    # 62
-                "microbiome",       # 18548
-                "immune_system",    # 534
-                "metabolomics",     # 3485
-                "plasma_somalogic") # 1300
-        
-        # prepend feature group identifiers to feature names
-        for (i in 1:length(featureGroups)) {{
-            colnames(InputData[[i]]) <- sapply(colnames(InputData[[i]]), function(x) paste(featureGroups[[i]], "___", x, sep=""))
-        }}
-
-        # combine feature groups
-        features <- do.call(cbind, InputData)
-
-        # fix feature names
-        colnames(features) <- iconv(colnames(features), "latin1", "utf-8")
-        
-    """)
-
-    # load dataframe
-    df = pd.DataFrame(np.array(rpy2.robjects.r["features"]))
-    df.index = rpy2.robjects.r("rownames(features)")
-    df.columns = rpy2.robjects.r("colnames(features)")
-
-    # save dataframe
+    rpy2.robjects.r["load"](input_file)
+    input_data = rpy2.robjects.r["InputData"]
+
+    # views of R's memory (no copy); feature groups are combined when writing instead of via `cbind` in R
+    matrices = [coralsarticle.data.rmatrix.r_matrix_to_numpy(m) for m in input_data]
+
+    # names: row names of the first feature group (like `cbind`); 
+    # column names prefixed with their feature group identifier and converted from latin1
+    rownames = coralsarticle.data.rmatrix.r_names(input_data[0], axis=0, encoding=None)
+    colnames = np.concatenate([
+        np.char.add(f"{group}___", coralsarticle.data.rmatrix.r_names(m, axis=1))
+        for group, m in zip(FEATURE_GROUPS, input_data)])
+
+    # save data
     print("Writing data")
+    shape = (matrices[0].shape[0], sum(X.shape[1] for X in matrices))
     with h5py.File(pathlib.Path(output_dir) / f"pregnancy.h5", "w") as f:
-        f["data"] = df
-        f["rownames"] = df.index.values
-        f["colnames"] = df.columns.values
+        dset = f.create_dataset("data", shape=shape, dtype=np.result_type(*matrices))
+        offset = 0
+        for X in matrices:
+            coralsarticle.data.rmatrix.write_columns(dset, X, offset=offset)
+            offset += X.shape[1]
+        f["rownames"] = np.array(rownames, dtype=h5py.string_dtype())
+        f["colnames"] = np.array(colnames, dtype=h5py.string_dtype())
 
 
 if __name__ == "__main__":
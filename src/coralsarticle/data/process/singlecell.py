@@ -23,31 +23,30 @@ def prepare_data_singlecell(
         marker_file=marker_file, 
         verbose=verbose)
     
-    # prepare cell sampling
-    _, cytof_preprocessed_function, subgroups, subgroups_with_cell_types, sample_masking, cell_types, _ = prepare_cell_sampling(
+    # prepare cell sampling (cells are preprocessed after sampling)
+    _, _, subgroups, subgroups_with_cell_types, sample_index, cell_types, _ = prepare_cell_sampling(
         cytof,
         cell_type_selection=cell_type_selection,
         marker_file=marker_file,
+        preprocess=False,
         verbose=verbose
     )
 
     # sample cells
+    # NOTE: all subgroups are sampled to keep the random stream (and thus the sample) as before
     idx_sample = sample_cell_subgroups(
         subgroups=subgroups_with_cell_types,
-        subgroups_masking=sample_masking,
+        subgroups_masking=sample_index,
         n_sampled_cells_per_celltype=n_sampled_cells_per_celltype,
         sampling_scheme=sampling_scheme,
         random_state=random_state,
         verbose=verbose)
-    
-    # select cells based on cell index 
-    cytof_preprocessed_sample = collections.OrderedDict()
-    for (timepoint, cell_type), idx in idx_sample.items():
-        cytof_preprocessed_sample.setdefault(timepoint, dict())[cell_type] = cytof_preprocessed_function[idx,:] 
-    
-    # concatenate celltypes for one subgroup
-    cytof_preprocessed_sample_matrix = np.concatenate([cytof_preprocessed_sample[subgroups[0]][c] for c in cell_types])
-    cytof_preprocessed_sample_matrix = cytof_preprocessed_sample_matrix.T
+
+    # preprocess sampled cells of the first subgroup (functional markers), concatenated by cell type
+    cytof_preprocessed_sample_matrix = preprocess_cells(
+        cytof, 
+        [idx_sample[(subgroups[0], c)] for c in cell_types],
+        columns=load_marker_info(cytof=cytof, marker_file=marker_file)[2])
 
     # save dataframe
     print("Writing data")
@@ -96,43 +95,52 @@ def load_cytof(
 
     # cleaning overlapping cell types
 
-    new_cells = []
     new_cell_categories = list(cytof.cell_type.dtype.categories) + [r.name for r in CELL_TYPE_FITLERS]
 
     # extract patient ids and timepoints
     # this is used to filter by each timepoint and patient separately
-    patient_ids = np.unique(cytof.patient_id)
-    timepoints = np.unique(cytof.timepoint)
+    patient_ids, patient_codes = np.unique(np.asarray(cytof.patient_id), return_inverse=True)
+    timepoints, timepoint_codes = np.unique(np.asarray(cytof.timepoint), return_inverse=True)
+
+    # group index over (patient, timepoint, cell type); cells of a group keep their order
+    cell_types = cytof.cell_type.dtype.categories
+    index = build_group_index(
+        patient_codes.reshape(-1), timepoint_codes.reshape(-1), cytof.cell_type.cat.codes.values + 1,
+        shape=(patient_ids.size, timepoints.size, cell_types.size + 1))
+    times = cytof.Time.values
+
+    def group_rows(p, t, cell_type):
+        if cell_type not in cell_types:
+            return np.empty(0, dtype=np.intp)
+        return index_rows(index, (p, t, cell_types.get_loc(cell_type) + 1))
+
+    # collect rows (positions) and new cell types of all filtered cells, so the frame is sliced only once
+    rows = []
+    rows_cell_type = []
 
     if verbose > 0: print("Filtering cell types:")
-    for p in patient_ids:
-        for t in timepoints:
+    for i_p, p in enumerate(patient_ids):
+        for i_t, t in enumerate(timepoints):
             if verbose > 0: print("*", p,t)
             for rule in CELL_TYPE_FITLERS:
                 if verbose > 0: print("  *", rule.name)
                 
                 # collect source cells
-                cells = []
-                for s in rule.source:
-                    c = cytof[(cytof.patient_id == p) & (cytof.timepoint == t) & (cytof.cell_type == s)]
-                    cells.append(c)
-                cells = pd.concat(cells)
-                if verbose > 0: print("   ", cells.shape[0], end=" -> ")
+                cells = np.concatenate([group_rows(i_p, i_t, s) for s in rule.source])
+                if verbose > 0: print("   ", cells.size, end=" -> ")
 
                 # remove cells
-                for r in rule.remove:
-                    cells_to_remove = cytof[(cytof.patient_id == p) & (cytof.timepoint == t) & (cytof.cell_type == r)].Time
-                    cells = cells.loc[~cells.Time.isin(cells_to_remove)]
-                if verbose >0 : print(cells.shape[0], f"({rule})")
-                
-                # name cells
-                cells.cell_type = pd.Categorical.from_codes(
-                    np.repeat(new_cell_categories.index(rule.name), cells.shape[0]),
-                    new_cell_categories)
+                cells_to_remove = np.concatenate([times[group_rows(i_p, i_t, r)] for r in rule.remove])
+                cells = cells[~np.isin(times[cells], cells_to_remove)]
+                if verbose >0 : print(cells.size, f"({rule})")
                 
-                new_cells.append(cells)
-        
-    new_cells = pd.concat(new_cells)
+                rows.append(cells)
+                rows_cell_type.append(np.repeat(new_cell_categories.index(rule.name), cells.size))
+
+    # name cells
+    new_cells = cytof.iloc[np.concatenate(rows)].copy()
+    new_cells.cell_type = pd.Categorical.from_codes(np.concatenate(rows_cell_type), new_cell_categories)
+
     if verbose > 0: print("Shape of new cell types:", new_cells.shape)
 
     # reset categories and add filtered cell types
@@ -142,11 +150,40 @@ def load_cytof(
     return cytof
 
 
+GroupIndex = collections.namedtuple("GroupIndex", ["order", "offsets", "shape"])
+
+
+def build_group_index(*codes, shape):
+    """
+    Index of rows by group, where a group is a combination of (non-negative) codes, e.g., (patient, timepoint, cell type).
+
+    Rows are sorted by group (stable, i.e., rows keep their order within a group);
+    the rows of group `g` are `order[offsets[g]:offsets[g + 1]]` (see `index_rows`).
+    """
+    group = np.ravel_multi_index(codes, shape)
+    order = np.argsort(group, kind="stable")
+    offsets = np.searchsorted(group[order], np.arange(np.prod(shape) + 1))
+    return GroupIndex(order=order, offsets=offsets, shape=shape)
+
+
+def index_rows(index, codes):
+    """Rows (positions) of a group in ascending order."""
+    g = np.ravel_multi_index(codes, index.shape)
+    return index.order[index.offsets[g]:index.offsets[g + 1]]
+
+
 def prepare_cell_sampling(
         cytof, 
         cell_type_selection="filter", 
         marker_file="data/raw/singlecell/markers.xlsx",
+        preprocess=True,
         verbose=0):
+    """
+    Prepares sampling cells by subgroups (see `sample_cell_subgroups`).
+
+    If `preprocess`, all cells are preprocessed for correlations (phenotype and functional markers);
+    otherwise, `None` is returned for the preprocessed cells (see `preprocess_cells` to preprocess sampled cells only).
+    """
 
     # set cell types of interest to sample from
     if verbose > 0: print("Select cell type order")
@@ -164,13 +201,19 @@ def prepare_cell_sampling(
 
     # preprocessing for correlations
 
-    if verbose > 0: print("Preprocessing for correlations: phenotype")
-    cytof_preprocessed_phenotype = corals.correlation.utils.preprocess_X(
-        cytof[columns_phenotype].values.transpose()).transpose()
+    if preprocess:
 
-    if verbose > 0: print("Preprocessing for correlations: functional")
-    cytof_preprocessed_function = corals.correlation.utils.preprocess_X(
-        cytof[columns_function].values.transpose()).transpose()
+        if verbose > 0: print("Preprocessing for correlations: phenotype")
+        cytof_preprocessed_phenotype = corals.correlation.utils.preprocess_X(
+            cytof[columns_phenotype].values.transpose()).transpose()
+
+        if verbose > 0: print("Preprocessing for correlations: functional")
+        cytof_preprocessed_function = corals.correlation.utils.preprocess_X(
+            cytof[columns_function].values.transpose()).transpose()
+
+    else:
+        cytof_preprocessed_phenotype = None
+        cytof_preprocessed_function = None
 
     # define subgroups to distinguish
 
@@ -189,12 +232,18 @@ def prepare_cell_sampling(
             subgroups_with_cell_types.append(subgroup_id)
 
     if verbose > 0: print("Subgroups with cell types: ", len(subgroups_with_cell_types))
-            
-    def sample_masking(subgroup_id):
-        timepoint, cell_type = subgroup_id
-        return (cytof.timepoint == timepoint) & (cytof.cell_type == cell_type)
 
-    return cytof_preprocessed_phenotype, cytof_preprocessed_function, subgroups, subgroups_with_cell_types, sample_masking, cell_types, cell_type_order
+    # index cells by subgroup (see `sample_cell_subgroups`)
+    timepoints, timepoint_codes = np.unique(np.asarray(cytof.timepoint), return_inverse=True)
+    categories = cytof.cell_type.dtype.categories
+    index = build_group_index(
+        timepoint_codes.reshape(-1), cytof.cell_type.cat.codes.values + 1, 
+        shape=(timepoints.size, categories.size + 1))
+    sample_index = SubgroupIndex(index=index, codes={
+        (t, c): (list(timepoints).index(t), categories.get_loc(c) + 1 if c in categories else None)
+        for t, c in subgroups_with_cell_types})
+
+    return cytof_preprocessed_phenotype, cytof_preprocessed_function, subgroups, subgroups_with_cell_types, sample_index, cell_types, cell_type_order
 
 
 def sample_cell_subgroups(
@@ -204,7 +253,12 @@ def sample_cell_subgroups(
         sampling_scheme="double-replacement", 
         random_state=None,
         verbose=0):
-    """Samples cell by predefined subgroups."""
+    """
+    Samples cell by predefined subgroups.
+
+    `subgroups_masking` is either a `SubgroupIndex` (see `prepare_cell_sampling`) 
+    or a function returning a boolean mask of the cells of a subgroup.
+    """
 
     rng = np.random.default_rng(random_state)
 
@@ -216,25 +270,30 @@ def sample_cell_subgroups(
     for subgroup_id in subgroups:
         if verbose > 0: print("  * Subgroup:", subgroup_id)
 
-        msk = subgroups_masking(subgroup_id)
+        # cells (positions) of the subgroup in ascending order
+        if isinstance(subgroups_masking, SubgroupIndex):
+            cells = subgroup_rows(subgroups_masking, subgroup_id)
+        else:
+            msk = subgroups_masking(subgroup_id)
+            cells = np.arange(msk.size)[msk]
 
         # sampling
         if sampling_scheme == "with-replacement":
             sample_idx = rng.choice(
-                np.arange(msk.size)[msk], 
-                min(msk.sum(), n_sampled_cells_per_celltype), 
+                cells, 
+                min(cells.size, n_sampled_cells_per_celltype), 
                 replace=True)
         
         elif sampling_scheme == "without-replacement":
             sample_idx = rng.choice(
-                np.arange(msk.size)[msk], 
-                min(msk.sum(), n_sampled_cells_per_celltype), 
+                cells, 
+                min(cells.size, n_sampled_cells_per_celltype), 
                 replace=False)
         
         elif sampling_scheme == "double-replacement":
             sample_idx = rng.choice(
-                np.arange(msk.size)[msk], 
-                msk.sum(), 
+                cells, 
+                cells.size, 
                 replace=True)
             sample_idx = rng.choice(
                 sample_idx, 
@@ -249,6 +308,49 @@ def sample_cell_subgroups(
     return idx
 
 
+SubgroupIndex = collections.namedtuple("SubgroupIndex", ["index", "codes"])
+
+
+def subgroup_rows(subgroup_index, subgroup_id):
+    codes = subgroup_index.codes[subgroup_id]
+    if None in codes:
+        return np.empty(0, dtype=np.intp)
+    return index_rows(subgroup_index.index, codes)
+
+
+def preprocess_cells(cytof, idx, columns):
+    """
+    Preprocesses the selected cells for correlations like `prepare_cell_sampling`, 
+    i.e., each cell is standardized across markers (`corals.correlation.utils.preprocess_X`).
+    Since cells are preprocessed independently, only the selected cells are read and preprocessed.
+
+    Parameters
+    ----------
+    idx: list of arrays
+        Cells (positions) to select; the selections are concatenated.
+    columns: list
+        Markers.
+
+    Returns
+    -------
+    Preprocessed cells as markers x cells matrix.
+    """
+
+    columns = cytof.columns.get_indexer(columns)
+    dtype = np.result_type(*cytof.dtypes.iloc[columns], np.float16)
+
+    # write blocks straight into the output
+    out = np.empty((columns.size, sum(i.size for i in idx)), dtype=dtype)
+    start = 0
+    for i in idx:
+        # markers x cells (C-contiguous like in `prepare_cell_sampling`, so results are identical)
+        block = np.ascontiguousarray(cytof.iloc[i, columns].to_numpy().transpose())
+        out[:, start:start + i.size] = corals.correlation.utils.preprocess_X(block)
+        start += i.size
+
+    return out
+
+
 def load_marker_info(
         cytof=None,
         marker_file="data/raw/singlecell/markers.xlsx"):
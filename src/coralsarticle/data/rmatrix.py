@@ -0,0 +1,67 @@
+"""
+Conversion of R matrices (via `rpy2`) to NumPy without copying.
+
+R stores numeric matrices column-major in a single vector,
+so `r_matrix_to_numpy` returns a Fortran-ordered view of R's memory.
+Views stay valid as long as they are alive (they reference the R object),
+but they must not be modified unless the R object may change as well.
+Copies are only made when the data is persisted (see `write_columns`).
+
+Names are converted as whole vectors (one call to R's `iconv` per axis, NumPy string operations for formatting)
+instead of element by element.
+"""
+import numpy as np
+
+
+def r_matrix_to_numpy(r_matrix):
+    """Returns a Fortran-ordered view (no copy) of an R numeric (double, integer or logical) matrix."""
+
+    from rpy2 import robjects
+
+    nrow, ncol = robjects.r["dim"](r_matrix)
+    try:
+        view = r_matrix.memoryview()
+    except AttributeError:
+        raise TypeError(f"Not a numeric R matrix: {type(r_matrix)}")
+
+    # depending on the `rpy2` version, the view is flat or already has the matrix' shape
+    return np.asarray(view).reshape((nrow, ncol), order="F")
+
+
+def r_names(r_matrix, axis, encoding="latin1", sub=None):
+    """
+    Returns row (`axis=0`) or column (`axis=1`) names of an R matrix as NumPy string array
+    or `None` if the matrix does not have names.
+    If `encoding` is given, names are converted from it to UTF-8 (see R's `iconv`).
+    """
+
+    from rpy2 import robjects
+
+    names = robjects.r["rownames" if axis == 0 else "colnames"](r_matrix)
+    if robjects.r["is.null"](names)[0]:
+        return None
+
+    if encoding is not None:
+        kwargs = dict(sub=sub) if sub is not None else dict()
+        names = robjects.r["iconv"](names, encoding, "UTF-8", **kwargs)
+
+    return np.array(names, dtype=str)
+
+
+def number_names(names, n):
+    """Prefixes names with their position (`<i>_<name>`); returns positions only if `names` is `None`."""
+    numbers = np.arange(n).astype(str)
+    if names is None:
+        return numbers
+    return np.char.add(np.char.add(numbers, "_"), names)
+
+
+def write_columns(dset, X, offset=0, block_bytes=2**26):
+    """
+    Writes `X` to the columns `offset:offset + X.shape[1]` of an h5 dataset.
+    Columns are written in blocks, so at most one block of a Fortran-ordered `X` is copied at a time.
+    """
+    block_size = max(1, block_bytes // max(1, X.shape[0] * X.dtype.itemsize))
+    for start in range(0, X.shape[1], block_size):
+        stop = min(X.shape[1], start + block_size)
+        dset[:, offset + start:offset + stop] = X[:, start:stop]
@@ -1,14 +1,17 @@
+import os
 import pathlib
 from sys import prefix
 import numpy as np
 import h5py
 import pandas as pd
 import subprocess
+import types
 import warnings
 
 from pandas.core import base
 
 import coralsarticle
+import coralsarticle.data.cache
 import coralsarticle.data.utils
 import coralsarticle.utils
 import coralsarticle.data.process.cancer
@@ -28,7 +31,16 @@ def load_data(
         postprocess_data_drop_duplicates=False,
         sample_size=None,
 
+        cache=None,
+
         **dataset_kwargs):
+    """
+    Prepares (if necessary) and loads a benchmark dataset.
+
+    Processed and final data are cached by a key derived from dataset parameters (including `seed`),
+    preprocessing flags and code version (see `coralsarticle.data.cache`).
+    `cache` is a `DatasetCache`; by default, `<data_dir>/cache` without disk budget.
+    """
 
     data_dir = pathlib.Path(data_dir)
 
@@ -58,46 +70,94 @@ def load_data(
         prefix=dataset_name_prefix
     )
 
-    # check if final data file already exists; if so we are done
+    # derive cache keys from everything that determines the data
+    if cache is None:
+        cache = coralsarticle.data.cache.DatasetCache(data_dir / "cache")
+    prepare_func = globals()[f"prepare_data_{dataset}"]
+    provenance_base = dict(
+        dataset=dataset,
+        dataset_kwargs=dataset_kwargs,
+        code=coralsarticle.data.cache.derive_code_version(prepare_func, *derive_process_modules(dataset)))
+    key_base = cache.key(**provenance_base)
+    provenance_final = dict(
+        base=key_base,
+        postprocess_data=postprocess_data,
+        postprocess_data_negative=postprocess_data_negative,
+        postprocess_data_drop_duplicates=postprocess_data_drop_duplicates,
+        sample_size=sample_size,
+        code=coralsarticle.data.cache.derive_code_version(
+            preprocess, preprocess_mask, select_columns, clip_negative, 
+            group_columns, verify_columns, hash_columns, mask_unique_exact, mask_min_nunique))
+    key_final = cache.key(**provenance_final)
+
+    # check if final data file already exists and is up to date; if so we are done
     data_file_final = pathlib.Path(data_dir) / "benchmark" / f"{name_final}.h5"
     print(f"Loading data: {name_final} ({data_file_final})")
     if data_file_final.exists():
-        print(f"  * benchmark data exists; returning")
-        return name_final, load_h5(data_file_final)
+        key_existing = coralsarticle.data.cache.read_provenance_key(data_file_final)
+        if key_existing == key_final:
+            print(f"  * benchmark data exists; returning")
+            return name_final, load_h5(data_file_final)
+        elif key_existing is None:
+            warnings.warn(f"Benchmark data has no provenance (created before caching); reusing: {data_file_final}")
+            return name_final, load_h5(data_file_final)
+        else:
+            print(f"  * benchmark data is outdated; recreating")
 
     # load, or prepare and cache, base data
     data_file_base = data_dir / "processed" / f"{name_base}.h5"
-    if not data_file_base.exists():
-        print(f"  * processing raw data")
-        df = globals()[f"prepare_data_{dataset}"](**dataset_kwargs)
-        save_h5(df, data_file_base)
-    else:
-        print(f"  * processed data exists; loading ...")
-        df = load_h5(data_file_base)
-    data = df.values
 
-    # prepare final data
-    if postprocess_data:
-        print(f"  * post-processing data")
-        data = coralsarticle.data.utils.preprocess(
-            data, 
-            negative=postprocess_data_negative, 
-            drop_duplicates=postprocess_data_drop_duplicates, 
-            min_nunique=2)
-
-    # sample data
-    if sample_size is not None:
-        print(f"  * sampling data")
-        max_n = int(data.shape[1] * sample_size)
-        data = data[:,:max_n]
+    def create_base(path):
+        if data_file_base.exists() and coralsarticle.data.cache.read_provenance_key(data_file_base) is None:
+            warnings.warn(f"Processed data has no provenance (created before caching); reusing: {data_file_base}")
+            print(f"  * processed data exists; loading ...")
+            df = load_h5(data_file_base)
+        else:
+            # a published file shares its content with a cache entry (see `DatasetCache.publish`),
+            # and processing may write it in place
+            data_file_base.unlink(missing_ok=True)
+            print(f"  * processing raw data")
+            df = prepare_func(**dataset_kwargs)
+        save_h5(df, path)
+
+    def create_final(path):
+        cache.get_or_create(key_base, create_base, provenance=provenance_base)
+        cache.publish(key_base, data_file_base)
+        data = load_matrix(cache.path(key_base), mmap=False)
+
+        # prepare final data
+        if postprocess_data:
+            print(f"  * post-processing data")
+            data = coralsarticle.data.utils.preprocess(
+                data, 
+                negative=postprocess_data_negative, 
+                drop_duplicates=postprocess_data_drop_duplicates, 
+                min_nunique=2,
+                inplace=True)
+
+        # sample data
+        if sample_size is not None:
+            print(f"  * sampling data")
+            max_n = int(data.shape[1] * sample_size)
+            data = data[:,:max_n]
+
+        save_h5(pd.DataFrame(data), path)
 
     # cache final data
+    cache.get_or_create(key_final, create_final, provenance=provenance_final)
     print(f"  * saving data to: {data_file_final}")
-    save_h5(pd.DataFrame(data), data_file_final)
+    cache.publish(key_final, data_file_final)
     print("  * done")
     
     # return
-    return name_final, data
+    return name_final, load_h5(data_file_final)
+
+
+def derive_process_modules(dataset):
+    """Modules in `coralsarticle.data.process` used to prepare the given dataset (e.g., `singlecell` for `singlecell_large`)."""
+    return [
+        m for n, m in vars(coralsarticle.data.process).items() 
+        if isinstance(m, types.ModuleType) and dataset.startswith(n)]
 
 
 def derive_data_final_name(
@@ -127,23 +187,28 @@ def derive_data_final_name(
     return basename
 
 
-def derive_data_name_synthetic_mn(m, n):
-    return f"synthetic_mn_m-{m}_n-{n}"
+def derive_data_name_synthetic_mn(m, n, seed=None):
+    return f"synthetic_mn_m-{m}_n-{n}" + derive_data_name_seed(seed)
+
 
+def derive_data_name_synthetic_nratio(size, m_ratio, seed=None):
+    return f"synthetic_ratio_size-{size}_ratio-{m_ratio}" + derive_data_name_seed(seed)
 
-def derive_data_name_synthetic_nratio(size, m_ratio):
-    return f"synthetic_ratio_size-{size}_ratio-{m_ratio}" 
 
+def derive_data_name_seed(seed):
+    # unseeded data keeps its original name
+    return "" if seed is None else f"_seed-{seed}"
 
-def prepare_data_synthetic_mn(m, n):
-    X = np.random.random((m, n))
+
+def prepare_data_synthetic_mn(m, n, seed=None):
+    X = np.random.RandomState(seed).random_sample((m, n)) if seed is not None else np.random.random((m, n))
     df = pd.DataFrame(X)
     return df
 
 
-def prepare_data_synthetic_nratio(size, n_ratio):
+def prepare_data_synthetic_nratio(size, n_ratio, seed=None):
     m, n = nratio_size_to_m_n(n_ratio=n_ratio, size=size)
-    X = np.random.random((m, n))
+    X = np.random.RandomState(seed).random_sample((m, n)) if seed is not None else np.random.random((m, n))
     return pd.DataFrame(X)
 
 
@@ -210,22 +275,119 @@ def prepare_data_preeclampsia(data_dir="./data"):
     return load_h5(data_file_processed)
 
 
-def load_h5(path):
-    
-    # read dataframe
+def load_h5(path, mmap=False):
+    """Loads an h5 data file as dataframe; see `load_matrix` for `mmap`."""
+
+    df5 = pd.DataFrame(load_matrix(path, mmap=mmap), copy=False)
+    df5.index, df5.columns = load_names(path)
+    return df5
+
+
+def load_matrix(path, mmap=True):
+    """
+    Loads the data matrix of an h5 data file as numpy array (without names).
+
+    With `mmap=True`, the matrix is memory-mapped read-only instead of read into memory, 
+    so it is shared with other processes via the page cache and only pages that are accessed are loaded.
+    This works if the h5 dataset is stored contiguously and uncompressed (default of `save_h5`) 
+    or if there is a `.npy` sidecar next to the h5 file (see `save_npy_sidecar`).
+    Otherwise, the matrix is read into memory.
+    """
+
+    path = pathlib.Path(path)
+    sidecar = path.with_suffix(".npy")
+
+    if mmap and sidecar.exists():
+        return np.load(sidecar, mmap_mode="r")
+    if not path.exists() and sidecar.exists():
+        return np.load(sidecar)
+
+    with h5py.File(path, "r") as f:
+        dset = f["data"]
+        if mmap:
+            offset = dset.id.get_offset()
+            if dset.chunks is None and dset.compression is None and offset is not None:
+                return np.memmap(path, mode="r", dtype=dset.dtype, shape=dset.shape, offset=offset)
+            warnings.warn(f"Data can not be memory-mapped (chunked or compressed); reading into memory: {path}")
+        return dset[()]
+
+
+def load_names(path):
+    """Loads row and column names of an h5 data file."""
+
+    with h5py.File(path, "r") as f:
+        rownames = [c.decode("utf-8") if isinstance(c, str) else str(c) for c in f["rownames"][:]]
+        colnames = [c.decode("utf-8") if isinstance(c, str) else str(c) for c in f["colnames"][:]]
+        return rownames, colnames
+
+
+def save_npy_sidecar(path):
+    """
+    Writes the data matrix of an h5 data file to a `.npy` file next to it, 
+    so it can be memory-mapped by `load_matrix` regardless of the h5 layout.
+    """
+
+    path = pathlib.Path(path)
+    sidecar = path.with_suffix(".npy")
     with h5py.File(path, "r") as f:
-        df5 = pd.DataFrame(f["data"][:])
-        df5.index = [c.decode("utf-8") if isinstance(c, str) else str(c) for c in f["rownames"][:]]
-        df5.columns = [c.decode("utf-8") if isinstance(c, str) else str(c) for c in f["colnames"][:]]
-        return df5
+        dset = f["data"]
+        out = np.lib.format.open_memmap(sidecar, mode="w+", dtype=dset.dtype, shape=dset.shape)
+        # copy in row blocks to avoid loading the whole matrix
+        block_size = max(1, 2**27 // max(1, dset.shape[1] * dset.dtype.itemsize))
+        for start in range(0, dset.shape[0], block_size):
+            out[start:start + block_size] = dset[start:start + block_size]
+        out.flush()
+        del out
+    return sidecar
+
+
+def create_outofcore_synthetic_mn(m, n, seed=None, data_dir="data", block_bytes=2**27):
+    """
+    Writes a synthetic dataset (see `prepare_data_synthetic_mn`) that may exceed memory
+    as column-major (Fortran-ordered) `.npy` file to `<data_dir>/benchmark`,
+    so column blocks are contiguous when memory-mapped (see `load_matrix` and `outofcore.py`).
+    The matrix is generated block by block; values only depend on the seed, not on `block_bytes`.
+    Returns the dataset name.
+    """
+
+    name = "outofcore_" + derive_data_name_synthetic_mn(m, n, seed=seed)
+    path = pathlib.Path(data_dir) / "benchmark" / f"{name}.npy"
+    if path.exists():
+        print(f"  * out-of-core data exists: {path}")
+        return name
+
+    print(f"  * writing out-of-core data: {path} ({m * n * 8 / 1024**3:.02f}Gb)")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    random = np.random.RandomState(seed)
+    tmp = path.with_suffix(".tmp.npy")
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float64, shape=(m, n), fortran_order=True)
+    block_size = max(1, block_bytes // (m * 8))
+    for start in range(0, n, block_size):
+        stop = min(n, start + block_size)
+        # the random stream fills memory in order, i.e., column by column
+        out[:, start:stop] = random.random_sample(m * (stop - start)).reshape((m, stop - start), order="F")
+    out.flush()
+    del out
+    tmp.rename(path)
+    return name
 
 
 def save_h5(df, path):
     path.parent.mkdir(parents=True, exist_ok=True)
-    with h5py.File(path, "w") as f:
-        f["data"] = df
-        f["rownames"] = df.index.values
-        f["colnames"] = df.columns.values
+    # a stale sidecar would shadow the new data (see `load_matrix`)
+    path.with_suffix(".npy").unlink(missing_ok=True)
+    # NOTE: the data is stored contiguously and uncompressed, so it can be memory-mapped
+    # NOTE: the file is replaced rather than overwritten, as it may be a hard link to a cache entry
+    #       (see `coralsarticle.data.cache.DatasetCache.publish`)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with h5py.File(tmp, "w") as f:
+            f["data"] = df
+            f["rownames"] = df.index.values
+            f["colnames"] = df.columns.values
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
 
 
 
@@ -239,39 +401,170 @@ def save_h5(df, path):
 #     return data_dir / file_name
 
 
-def preprocess(X, return_mask=False, negative=False, drop_duplicates=False, min_nunique=2):
+def preprocess(X, return_mask=False, negative=False, drop_duplicates=False, min_nunique=2, inplace=False, block_size=None):
+    """
+    Clips negative values (`negative`), drops duplicate features (`drop_duplicates`) 
+    and features with less than `min_nunique` unique values.
+
+    The data is processed column block by column block (see `preprocess_mask`), 
+    so besides the result only a block is held in memory.
+    With `inplace`, `X` (e.g., a writable memmap) is clipped and compacted in place 
+    and the result is a view of `X` (see `select_columns`); otherwise `X` is left untouched.
+    """
+
+    msk = preprocess_mask(
+        X, 
+        negative=negative, 
+        drop_duplicates=drop_duplicates, 
+        min_nunique=min_nunique, 
+        inplace=inplace, 
+        block_size=block_size)
+
+    # clipping was already applied in place
+    X = select_columns(X, msk, negative=negative and not inplace, inplace=inplace, block_size=block_size)
+
+    if return_mask:
+        return X, msk
+    else:
+        return X
+
+
+def preprocess_mask(X, negative=False, drop_duplicates=False, min_nunique=2, inplace=False, block_size=None):
+    """
+    Derives the feature mask of `preprocess` in one pass over column blocks of `X`:
+    each block is clipped, checked for the number of unique values and hashed for duplicate detection.
+    Only duplicates (according to their hash) are verified in a second step.
+    With `inplace`, clipping is applied to `X`.
+    """
+
+    m, n = X.shape
+    if block_size is None:
+        block_size = derive_block_size(X)
+    is_float = np.issubdtype(X.dtype, np.floating)
 
-    # make a copy
-    X = X.copy()
-    
     # init mask
-    msk = np.ones(X.shape[1], dtype=bool)
+    msk = np.ones(n, dtype=bool)
+    if drop_duplicates:
+        hashes = np.empty(n, dtype=np.uint64)
+        msk_nan = np.zeros(n, dtype=bool)
+
+    for start in range(0, n, block_size):
+        block = X[:, start:start + block_size]
+
+        # set everything <=0 to zero
+        if negative:
+            block = clip_negative(block, inplace=inplace)
+
+        # drop duplicate features
+        # TODO: do we really want to do that; we might be loosing feature names that might be interesting?
+        if drop_duplicates:
+            hashes[start:start + block_size] = hash_columns(block)
+            if is_float:
+                msk_nan[start:start + block_size] = np.isnan(block).any(axis=0)
+
+        # drop features with less than x unique value
+        if min_nunique is not None:
+            msk[start:start + block_size] &= mask_min_nunique(block, min_nunique, block_size=block_size)
 
-    # set everything <=0 to zero
-    if negative:
-        msk_leq0 = np.where(X < 0)
-        X[msk_leq0] = 0
-    
-    # drop duplicate features
-    # TODO: do we really want to do that; we might be loosing feature names that might be interesting?
     if drop_duplicates:
-        msk &= mask_unique(X)
-        
-    # drop features with less than x unique value
-    if min_nunique is not None:
-        msk_nunique_gt = mask_min_nunique(X, min_nunique)
-        msk &= msk_nunique_gt
-        
-    if return_mask:
-        return X[:,msk], msk
+        labels = group_columns(hashes, msk_nan)
+        transform = clip_negative if negative and not inplace else None
+        if verify_columns(X, labels, block_size=block_size, transform=transform):
+            msk &= labels == np.arange(n)
+        else:
+            warnings.warn("Hash collision while detecting duplicate columns; falling back to `np.unique`.")
+            msk &= mask_unique_exact(clip_negative(X) if negative and not inplace else X)
+
+    return msk
+
+
+def select_columns(X, msk, negative=False, inplace=False, block_size=None):
+    """
+    Returns `X[:, msk]` (clipped if `negative`) block by block.
+    
+    With `inplace`, selected columns are moved to the front of `X` and a view is returned,
+    which is C-contiguous if `X` is.
+    """
+
+    idx = np.flatnonzero(msk)
+    m, n = X.shape
+    k = idx.size
+    if block_size is None:
+        block_size = derive_block_size(X)
+
+    if not inplace:
+        out = np.empty((m, k), dtype=X.dtype)
+        for start in range(0, k, block_size):
+            block = X[:, idx[start:start + block_size]]
+            out[:, start:start + block_size] = clip_negative(block, inplace=True) if negative else block
+        return out
+
+    if negative:
+        for start in range(0, n, block_size):
+            clip_negative(X[:, start:start + block_size], inplace=True)
+
+    if X.flags.c_contiguous:
+        # compact row blocks within the flat buffer; rows are read before they are overwritten
+        flat = X.reshape(-1)
+        row_block_size = max(1, block_size * m // max(1, n))
+        for start in range(0, m, row_block_size):
+            stop = min(m, start + row_block_size)
+            block = flat[start * n:stop * n].reshape(stop - start, n)[:, idx]
+            flat[start * k:stop * k] = block.reshape(-1)
+        return flat[:m * k].reshape(m, k)
+    else:
+        # compact column blocks; columns are only moved to the left
+        for start in range(0, k, block_size):
+            stop = min(k, start + block_size)
+            X[:, start:stop] = X[:, idx[start:stop]]
+        return X[:, :k]
+
+
+def clip_negative(X, inplace=False):
+    """Sets negative values to zero (NaNs are kept)."""
+    return np.maximum(X, 0, out=X if inplace else None)
+
+
+def mask_unique(data, return_inverse=False, block_size=None):
+    """
+    Marks the first occurrence of each distinct column.
+
+    Columns are grouped by a 64-bit hash computed in one pass over the rows (see `hash_columns`);
+    groups are verified against their first column, so hash collisions can not merge distinct columns
+    (if one occurs, we fall back to `np.unique(..., axis=1)`).
+    Like `np.unique`, `0.0` and `-0.0` are equal and columns containing NaN are never duplicates.
+
+    If `return_inverse`, also returns the index of each column's group 
+    where groups are numbered by their first occurrence.
+    """
+
+    n = data.shape[1]
+    if not (np.issubdtype(data.dtype, np.number) or np.issubdtype(data.dtype, np.bool_)):
+        return mask_unique_exact(data, return_inverse=return_inverse)
+    if block_size is None:
+        block_size = derive_block_size(data)
+
+    msk_nan = np.isnan(data).any(axis=0) if np.issubdtype(data.dtype, np.floating) else np.zeros(n, dtype=bool)
+    labels = group_columns(hash_columns(data), msk_nan)
+    if not verify_columns(data, labels, block_size=block_size):
+        warnings.warn("Hash collision while detecting duplicate columns; falling back to `np.unique`.")
+        return mask_unique_exact(data, return_inverse=return_inverse)
+
+    msk_unique = labels == np.arange(n)
+
+    if return_inverse:
+        rank = np.zeros(n, dtype=np.intp)
+        rank[msk_unique] = np.arange(np.count_nonzero(msk_unique))
+        return msk_unique, rank[labels]
     else:
-        return X[:,msk]
+        return msk_unique
 
 
-def mask_unique(data, return_inverse=False):
+def mask_unique_exact(data, return_inverse=False):
     
     _, idx_unique, idx_reverse = np.unique(
         data, axis=1, return_index=True, return_inverse=True)
+    idx_reverse = idx_reverse.reshape(-1)
 
     ord_unique = np.argsort(idx_unique)
     idx_unique_sorted = idx_unique[ord_unique]
@@ -279,25 +572,126 @@ def mask_unique(data, return_inverse=False):
     msk_unique[idx_unique_sorted] = True
     
     if return_inverse:
-        d = {k:v for k,v in zip(np.arange(ord_unique.size),np.argsort(ord_unique))}
-        return msk_unique, np.array([d[i] for i in idx_reverse])
+        return msk_unique, np.argsort(ord_unique)[idx_reverse]
     else:
         return msk_unique
-    
 
-def mask_min_nunique(data, min_nunique=2):
-    return np.array([
-        len(np.unique(data[:,i])) >= min_nunique 
-        for i in range(data.shape[1])])
 
+def group_columns(hashes, msk_nan):
+    """
+    Returns the representative (first) column of each column's group of equal hashes;
+    columns containing NaN (`msk_nan`) are their own group.
+    """
+
+    n = hashes.size
+    labels = np.arange(n)
+    idx = np.flatnonzero(~msk_nan)
+    if idx.size > 0:
+        _, idx_first, idx_group = np.unique(hashes[idx], return_index=True, return_inverse=True)
+        labels[idx] = idx[idx_first[idx_group.reshape(-1)]]
+    return labels
+
+
+def verify_columns(data, labels, block_size=None, transform=None):
+    """Checks that columns are equal to their representative column; `transform` is applied to both first."""
+
+    if block_size is None:
+        block_size = derive_block_size(data)
+
+    # only duplicates need to be checked
+    idx = np.flatnonzero(labels != np.arange(labels.size))
+    for start in range(0, idx.size, block_size):
+        idx_block = idx[start:start + block_size]
+        block = data[:, idx_block]
+        block_representatives = data[:, labels[idx_block]]
+        if transform is not None:
+            block = transform(block)
+            block_representatives = transform(block_representatives)
+        if not np.all(block == block_representatives):
+            return False
+    return True
+
+
+def hash_columns(data):
+    """64-bit hash of each column, computed row by row (vectorized over columns)."""
+
+    h = np.full(data.shape[1], 0xcbf29ce484222325, dtype=np.uint64)
+    prime = np.uint64(0x100000001b3)
+    for row in data:
+        if np.issubdtype(row.dtype, np.floating):
+            # normalize -0.0 to 0.0
+            words = np.ascontiguousarray(row + row.dtype.type(0)).view(f"u{row.dtype.itemsize}").astype(np.uint64)
+        else:
+            words = row.astype(np.int64).view(np.uint64)
+        # mix words (splitmix64 finalizer), so similar values do not produce similar hashes
+        words ^= words >> np.uint64(30)
+        words *= np.uint64(0xbf58476d1ce4e5b9)
+        words ^= words >> np.uint64(27)
+        words *= np.uint64(0x94d049bb133111eb)
+        words ^= words >> np.uint64(31)
+        h ^= words
+        h *= prime
+    return h
+
+
+def mask_min_nunique(data, min_nunique=2, block_size=None):
+    """
+    Marks columns with at least `min_nunique` unique values (NaNs count as one value like in `np.unique`).
+    """
+
+    m, n = data.shape
+    if min_nunique <= 0:
+        return np.ones(n, dtype=bool)
+    if m == 0:
+        return np.zeros(n, dtype=bool)
+    if min_nunique == 1:
+        return np.ones(n, dtype=bool)
+
+    if block_size is None:
+        block_size = derive_block_size(data)
+    is_float = np.issubdtype(data.dtype, np.floating)
+
+    msk = np.zeros(n, dtype=bool)
+    for start in range(0, n, block_size):
+        block = data[:, start:start + block_size]
+
+        if min_nunique == 2:
+            # any value different from the first one; no sorting necessary
+            diff = block != block[0]
+            if is_float:
+                diff &= ~(np.isnan(block) & np.isnan(block[0]))
+            msk[start:start + block_size] = diff.any(axis=0)
+
+        else:
+            block = np.sort(block, axis=0)
+            diff = block[1:] != block[:-1]
+            if is_float:
+                # NaNs are sorted to the end
+                diff &= ~np.isnan(block[1:]) | ~np.isnan(block[:-1])
+            msk[start:start + block_size] = 1 + diff.sum(axis=0) >= min_nunique
+
+    return msk
+
+
+def derive_block_size(data, block_bytes=2**26):
+    """Number of columns per block, so a block takes about `block_bytes`."""
+    return max(1, block_bytes // max(1, data.shape[0] * data.dtype.itemsize))
 
-def preprocess_diff(X, return_mask=False, negative=False, drop_duplicates=False, min_nunique=2):
 
-    _, msk1 = preprocess(X[:X.shape[0] // 2,:], return_mask=True, negative=negative, drop_duplicates=drop_duplicates, min_nunique=min_nunique)
-    _, msk2 = preprocess(X[X.shape[0] // 2:,:], return_mask=True, negative=negative, drop_duplicates=drop_duplicates, min_nunique=min_nunique)
+def preprocess_diff(X, return_mask=False, negative=False, drop_duplicates=False, min_nunique=2, inplace=False, block_size=None):
+    """
+    Drops features that would be dropped by `preprocess` in either half of the samples.
+    Note that the resulting data is not clipped.
+    """
+
+    kwargs = dict(negative=negative, drop_duplicates=drop_duplicates, min_nunique=min_nunique, block_size=block_size)
+    msk1 = preprocess_mask(X[:X.shape[0] // 2,:], **kwargs)
+    msk2 = preprocess_mask(X[X.shape[0] // 2:,:], **kwargs)
     msk = msk1 & msk2
 
+    X = select_columns(X, msk, inplace=inplace, block_size=block_size)
+
     if return_mask:
-        return X[:,msk], msk
+        return X, msk
     else:
-        return X[:,msk]
\ No newline at end of file
+        return X
@@ -1,9 +1,11 @@
 import subprocess
 
 
-def execute(cmd, conda_env=None):
+def execute(cmd, conda_env=None, log_file=None):
     """
     Source: https://stackoverflow.com/questions/4417546/constantly-print-subprocess-output-while-process-is-running
+
+    If `log_file` is given, output is written to that file instead of stdout.
     """
 
     if conda_env is not None:
@@ -16,8 +18,17 @@ def execute(cmd, conda_env=None):
         universal_newlines=True, 
         shell=True,
         executable='/bin/bash')
-    for stdout_line in iter(popen.stdout.readline, ""):
-        print(stdout_line, end="") 
+    log = open(log_file, "a") if log_file is not None else None
+    try:
+        for stdout_line in iter(popen.stdout.readline, ""):
+            if log is None:
+                print(stdout_line, end="") 
+            else:
+                log.write(stdout_line)
+                log.flush()
+    finally:
+        if log is not None:
+            log.close()
     popen.stdout.close()
     return_code = popen.wait()
     if return_code: